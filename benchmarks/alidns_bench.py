@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+# coding: utf-8
+# 基于本地 Alidns 替身服务 (opscat.alidns.fakeserver) 的 alidns 吞吐量基准
+# 按不同的记录数分别测量分页拉取, 搜索, 批量修改与声明式同步的耗时与 API 调用次数
+# 用法: python3 benchmarks/alidns_bench.py [--sizes 100,1000,10000,100000] [--latency 20] [--transport async]
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+
+from opscat.alidns import alidns
+from opscat.alidns.fakeserver import FakeAlidns, FakeAlidnsServer
+from opscat.alidns.rate_limit import RequestLimiter
+from opscat.alidns.stats import ApiStats
+from opscat.alidns.zone_cache import ZoneCache
+
+
+@contextlib.contextmanager
+def quiet():
+    # update 前后的记录, sync 的变更计划等输出不计入结果
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def measure(name, size, items, func):
+    # 批量执行时 API 请求分散在多个工作线程中, 使用 ApiStats 统计全部调用
+    alidns.api_stats = ApiStats()
+    with quiet():
+        start = time.monotonic()
+        result = func()
+        elapsed = time.monotonic() - start
+    stats, alidns.api_stats = alidns.api_stats, None
+    items = items if items is not None else len(result)
+    return {"case": name, "size": size, "elapsed": round(elapsed, 4), "items": items,
+            "items_per_second": round(items / elapsed, 1) if elapsed else 0,
+            "api_calls": sum(action_stats.calls for action_stats in stats.actions.values()),
+            "retries": sum(action_stats.retries for action_stats in stats.actions.values())}
+
+
+def bench_zone(client, server, size, args):
+    domain = "zone-%d.example.com" % size
+    server.alidns.add_zone(domain, size)
+    results = []
+
+    alidns.zone_cache = None
+    results.append(measure("paging -w 1", size, None, lambda: alidns.get_domain_records(client, domain, workers=1)))
+    results.append(measure("paging -w %d" % args.workers, size, None,
+                           lambda: alidns.get_domain_records(client, domain, workers=args.workers)))
+    keyword = "host-%d" % (size // 2)
+    results.append(measure("search exact", size, 1, lambda: alidns.get_domain_records(
+        client, domain, mode="EXACT", keyword=keyword, workers=args.workers)))
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        alidns.zone_cache = ZoneCache(cache_dir, ttl=3600)
+        alidns.get_domain_records(client, domain, workers=args.workers)
+        results.append(measure("search cached", size, 1, lambda: alidns.get_domain_records(
+            client, domain, mode="LIKE", keyword=keyword, workers=args.workers)))
+        alidns.zone_cache = None
+
+    # 批量修改 batch_rows 条记录的 Value
+    rows = min(size, args.batch_rows)
+    batch_kwargs = [{"action": "update", "domain": domain, "type": "A", "record": "host-%d" % i,
+                     "line": "", "value": "172.16.%d.%d" % (i // 256 % 256, i % 256), "priority": "",
+                     "ttl": "600", "status": "", "remark": ""} for i in range(rows)]
+    results.append(measure("batch update -j %d" % args.jobs, size, rows, lambda: alidns.batch_execute(
+        client, alidns.iter_plan_batch(client, iter(batch_kwargs), args.workers), args.jobs)))
+
+    # 期望记录集相对线上记录集: 1% 修改 Value, 1% 删除, 1% 新增
+    live = alidns.get_domain_records(client, domain, workers=args.workers)
+    changed = max(1, size // 100)
+    desired = [{"domain": domain, "type": record.get("Type"), "record": record.get("RR"),
+                "value": record.get("Value"), "ttl": "", "priority": "", "status": "", "remark": ""}
+               for record in live[changed:]]
+    for i in range(changed):
+        desired[i]["value"] = "192.168.%d.%d" % (i // 256 % 256, i % 256)
+        desired.append({"domain": domain, "type": "A", "record": "new-%d" % i, "value": "10.255.0.1",
+                        "ttl": "", "priority": "", "status": "", "remark": ""})
+    results.append(measure("sync -j %d" % args.jobs, size, changed * 3, lambda: alidns.sync_zone(
+        client, domain, desired, args.jobs, args.workers, assume_yes=True)))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+                        help="逗号分隔的域名记录数, 默认值为 100,1000,10000,100000")
+    parser.add_argument("--latency", type=float, default=0, help="替身服务每个请求的平均延迟(毫秒), 默认值为 0")
+    parser.add_argument("--server-qps", type=float, default=0,
+                        help="替身服务超过该 QPS 时返回 Throttling.User, 默认值为 0 即不限流")
+    parser.add_argument("--throttle-rate", type=float, default=0, help="替身服务随机返回 Throttling.User 的比例")
+    parser.add_argument("--qps", type=float, default=0, help="alidns 端的 QPS 上限, 同 alidns --qps")
+    parser.add_argument("--transport", choices=("sync", "async"), default="sync", help="同 alidns --transport")
+    parser.add_argument("-w", "--workers", type=int, default=8, help="同 alidns --workers")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="同 alidns --jobs")
+    parser.add_argument("--batch-rows", type=int, default=1000, help="批量修改的行数上限, 默认值为 1000")
+    parser.add_argument("--json", action="store_true", help="以 JSON Lines 格式输出结果, 便于在 CI 中比较")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = FakeAlidnsServer(alidns=FakeAlidns(), latency=args.latency, qps=args.server_qps,
+                              throttle_rate=args.throttle_rate).start()
+    pool_size = max(args.workers, args.jobs, 10)
+    client = alidns.build_client("ak", "secret", "cn-hangzhou", pool_size, args.transport, server.endpoint)
+    alidns.request_limiter = RequestLimiter(args.qps, max(args.workers, args.jobs), retries=8)
+    alidns.minimal_calls = True
+
+    if not args.json:
+        print("%-20s%10s%10s%10s%14s%10s%10s" % ("Case", "Size", "Elapsed", "Items", "Items/s", "Calls", "Retries"))
+    try:
+        for size in (int(size) for size in args.sizes.split(",")):
+            for result in bench_zone(client, server, size, args):
+                if args.json:
+                    print(json.dumps(result))
+                else:
+                    print("%-20s%10d%10.3f%10d%14.1f%10d%10d" % (
+                        result.get("case"), result.get("size"), result.get("elapsed"), result.get("items"),
+                        result.get("items_per_second"), result.get("api_calls"), result.get("retries")))
+                sys.stdout.flush()
+    finally:
+        if hasattr(client, "close"):
+            client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
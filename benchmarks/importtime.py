@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+# coding: utf-8
+# 基于 python -X importtime 的启动耗时基准, 防止 alidns, tls-secret-helper 的 --help 与轻量操作重新变慢
+# 用法: python3 benchmarks/importtime.py [-n 5] [--budget-ms 80]
+# 任一用例导入了不需要的重量级模块, 或启动耗时的中位数超过预算时以非 0 状态退出
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+
+# 这些模块只应在实际请求 API, 解析证书或发送通知时导入
+HEAVY_MODULES = ("aliyunsdkcore", "aliyunsdkalidns", "httpx", "cryptography")
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$")
+
+
+def prepare_alidns_cache(tmp_dir):
+    # 准备一个未过期的本地快照, 使 search 操作完全在本地完成, 不会请求 API
+    config_file = os.path.join(tmp_dir, "config.json")
+    with open(config_file, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"ak": "ak", "secret": "secret", "region": "cn-hangzhou"}))
+    os.makedirs(os.path.join(tmp_dir, "cache", "zones"))
+    with open(os.path.join(tmp_dir, "cache", "zones", "example.com.json"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"domain": "example.com", "time": time.time() + 86400, "records": [
+            {"RecordId": "1", "Type": "A", "RR": "www", "Value": "1.1.1.1",
+             "TTL": 600, "Status": "ENABLE", "Remark": ""},
+        ]}))
+    return config_file
+
+
+def build_cases(tmp_dir):
+    config_file = prepare_alidns_cache(tmp_dir)
+    return {
+        "alidns --help": ["opscat.alidns.alidns", "--help"],
+        "alidns -a search (cached)": ["opscat.alidns.alidns", "-c", config_file, "-d", "example.com",
+                                      "-a", "search", "-k", "www", "--cache-ttl", "86400"],
+        "tls-secret-helper --help": ["opscat.tls_secret_helper.tls_secret_helper", "--help"],
+    }
+
+
+def run_case(argv):
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-m"] + argv,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    total_us, modules = 0, set()
+    for line in proc.stderr.decode().splitlines():
+        matched = IMPORTTIME_RE.match(line)
+        if not matched:
+            continue
+        modules.add(matched.group(4))
+        # 缩进为 1 个空格的是顶层导入, 其 cumulative 已包含所有子模块
+        if len(matched.group(3)) == 1:
+            total_us += int(matched.group(2))
+    return proc.returncode, total_us / 1000, modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="每个用例的执行次数, 取中位数, 默认值为 5")
+    parser.add_argument("--budget-ms", type=float, default=80,
+                        help="每个用例导入耗时中位数的上限(毫秒), 默认值为 80")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, argv in build_cases(tmp_dir).items():
+            results = [run_case(argv) for _ in range(args.repeat)]
+            median_ms = statistics.median(total_ms for _, total_ms, _ in results)
+            heavy = sorted({module.split(".")[0] for _, _, modules in results for module in modules
+                            if module.split(".")[0] in HEAVY_MODULES})
+            errors = [returncode for returncode, _, _ in results if returncode != 0]
+            status = "ok"
+            if heavy or errors or median_ms > args.budget_ms:
+                status, failed = "FAIL", True
+            print("%-32s%10.1f ms  %s" % (name, median_ms, status))
+            if heavy:
+                print("    imported: %s" % ", ".join(heavy))
+            if errors:
+                print("    exit status: %s" % errors[0])
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
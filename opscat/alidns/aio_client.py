@@ -0,0 +1,136 @@
+# coding: utf-8
+# 基于 asyncio + httpx.AsyncClient 的 Alidns RPC 客户端
+# 签名方式与 aliyunsdkcore 的 RPC 请求一致 (HMAC-SHA1, SignatureVersion 1.0),
+# 请求对象直接复用 aliyunsdkalidns.request.v20150109.*Request
+
+import json
+import uuid
+import hmac
+import base64
+import asyncio
+import hashlib
+import datetime
+import threading
+from urllib.parse import quote
+
+import httpx
+from aliyunsdkcore.acs_exception import error_code
+from aliyunsdkcore.acs_exception.exceptions import ClientException, ServerException
+
+
+DEFAULT_ENDPOINT = "https://alidns.aliyuncs.com"
+
+
+def percent_encode(value):
+    # RFC 3986, 与 SDK 中 __pop_standard_urlencode 的结果一致
+    return quote(str(value), safe="~")
+
+
+def sign_params(params, ak, secret, method="GET"):
+    params = dict(params)
+    params.update({
+        "Format": "JSON",
+        "AccessKeyId": ak,
+        "SignatureMethod": "HMAC-SHA1",
+        "SignatureVersion": "1.0",
+        "SignatureNonce": uuid.uuid4().hex,
+        "Timestamp": datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    })
+    params.pop("Signature", None)
+    canonicalized_query_string = "&".join(
+        "%s=%s" % (percent_encode(key), percent_encode(value)) for key, value in sorted(params.items()))
+    string_to_sign = "%s&%s&%s" % (method, percent_encode("/"), percent_encode(canonicalized_query_string))
+    digest = hmac.new((secret + "&").encode(), string_to_sign.encode(), hashlib.sha1).digest()
+    params["Signature"] = base64.b64encode(digest).decode()
+    return params
+
+
+class AsyncAlidnsClient:
+    def __init__(self, ak, secret, region="cn-hangzhou", endpoint=DEFAULT_ENDPOINT,
+                 max_connections=100, timeout=10):
+        self.ak = ak
+        self.secret = secret
+        self.region = region
+        self.endpoint = endpoint.rstrip("/")
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.http = None
+
+    def get_http_client(self):
+        # httpx.AsyncClient 需要在事件循环内创建, 连接池内的连接会被 keep-alive 复用
+        if self.http is None:
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            self.http = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        return self.http
+
+    def build_url(self, req):
+        params = dict(req.get_query_params() or {})
+        params.update({
+            "Action": req.get_action_name(),
+            "Version": req.get_version(),
+            "RegionId": params.get("RegionId") or self.region,
+        })
+        params = sign_params(params, self.ak, self.secret, req.get_method() or "GET")
+        query_string = "&".join("%s=%s" % (percent_encode(key), percent_encode(value))
+                                for key, value in params.items())
+        return "%s/?%s" % (self.endpoint, query_string)
+
+    async def do_action(self, req):
+        # 返回值与 AcsClient.do_action_with_exception 一致, 为响应 body 的 bytes
+        # 与 SDK 一致, RPC 请求参数全部放在 URL 中, alidns 的请求类默认使用 POST 方法
+        try:
+            resp = await self.get_http_client().request(req.get_method() or "GET", self.build_url(req))
+        except httpx.HTTPError as e:
+            raise ClientException(error_code.SDK_HTTP_ERROR, str(e))
+
+        if resp.status_code < 200 or resp.status_code >= 300:
+            try:
+                body = json.loads(resp.content.decode())
+            except ValueError:
+                body = {}
+            raise ServerException(
+                body.get("Code", error_code.SDK_UNKNOWN_SERVER_ERROR),
+                body.get("Message", "ServerResponseBody: %s" % resp.text),
+                http_status=resp.status_code,
+                request_id=body.get("RequestId"))
+        return resp.content
+
+    async def do_actions(self, reqs, concurrency=100):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def do_action(req):
+            async with semaphore:
+                return await self.do_action(req)
+
+        return await asyncio.gather(*(do_action(req) for req in reqs))
+
+    async def aclose(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+
+class AsyncTransportClient:
+    # 为同步代码提供与 AcsClient 相同的 do_action_with_exception 接口,
+    # 所有请求都在同一个后台事件循环中通过共享的连接池发送
+    def __init__(self, aio_client: AsyncAlidnsClient):
+        self.aio_client = aio_client
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="alidns-aio", daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def do_action_with_exception(self, req):
+        return self.run(self.aio_client.do_action(req))
+
+    def do_actions(self, reqs):
+        # 批量请求在事件循环内并发执行, 不需要为每个请求占用一个线程
+        return self.run(self.aio_client.do_actions(reqs, self.aio_client.max_connections))
+
+    def close(self):
+        self.run(self.aio_client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
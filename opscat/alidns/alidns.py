@@ -4,34 +4,56 @@
 # date: 2021-10-13
 # a helper script to search/add/update/delete aliyun DNS records
 
+from __future__ import annotations
+
 import io
 import os
 import re
+import csv
 import sys
 import json
+import math
+import atexit
+import time
 import datetime
 import argparse
+import functools
+import itertools
+import threading
+import contextlib
+import contextvars
+import collections
+import concurrent.futures
+import urllib.parse
+from typing import TYPE_CHECKING
+
+# aliyunsdkcore, aliyunsdkalidns 以及 httpx 的导入耗时远大于脚本本身, 均在实际用到时才导入,
+# --help, 命中本地快照缓存的查询等不需要请求 API 的操作不会加载这些模块
+from opscat.alidns.client_pool import ClientPool, LazyClient
+from opscat.alidns.rate_limit import RequestLimiter, error_code_of
+from opscat.alidns.stats import ApiStats
+from opscat.alidns.value_index import ValueIndex
+from opscat.alidns.zone_cache import ZoneCache, filter_records
+
+if TYPE_CHECKING:
+    from aliyunsdkcore.client import AcsClient
+    from aliyunsdkcore.request import AcsRequest
+
+    from opscat.alidns.log_store import LogStore
+
 
-from aliyunsdkcore.client import AcsClient
-from aliyunsdkcore.request import AcsRequest
-from aliyunsdkalidns.request.v20150109.DescribeDomainsRequest import DescribeDomainsRequest
-from aliyunsdkalidns.request.v20150109.DescribeDomainRecordsRequest import DescribeDomainRecordsRequest
-from aliyunsdkalidns.request.v20150109.DescribeDomainRecordInfoRequest import DescribeDomainRecordInfoRequest
-from aliyunsdkalidns.request.v20150109.DescribeDomainLogsRequest import DescribeDomainLogsRequest
-from aliyunsdkalidns.request.v20150109.DescribeRecordLogsRequest import DescribeRecordLogsRequest
-from aliyunsdkalidns.request.v20150109.AddDomainRecordRequest import AddDomainRecordRequest
-from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRequest import UpdateDomainRecordRequest
-from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRemarkRequest import UpdateDomainRecordRemarkRequest
-from aliyunsdkalidns.request.v20150109.DeleteDomainRecordRequest import DeleteDomainRecordRequest
-from aliyunsdkalidns.request.v20150109.DeleteSubDomainRecordsRequest import DeleteSubDomainRecordsRequest
-from aliyunsdkalidns.request.v20150109.SetDomainRecordStatusRequest import SetDomainRecordStatusRequest
+# 批量并发执行时, 多个线程的多行输出与交互式输入需要互斥, 避免内容交错
+output_lock = threading.RLock()
+
+# 按域名保存完整解析记录的本地快照缓存, 由 main() 根据 --cache-ttl 初始化, 为 None 时不使用缓存
+zone_cache = None
 
 
 def print_json(json_obj):
     if isinstance(json_obj, str):
-        print(json.dumps(json.loads(json_obj), ensure_ascii=False, indent=4))
-    else:
-        print(json.dumps(json_obj, ensure_ascii=False, indent=4))
+        json_obj = json.loads(json_obj)
+    json.dump(json_obj, sys.stdout, ensure_ascii=False, indent=4)
+    sys.stdout.write("\n")
 
 
 def save_json(filename, data, mode='w', encoding="utf-8"):
@@ -43,123 +65,537 @@ def save_json(filename, data, mode='w', encoding="utf-8"):
         f.write(json.dumps(data, ensure_ascii=False, indent=4))
 
 
+RESULTS_HEADERS = {
+    "records": ["RecordId", "Type", "RR", "Value", "TTL", "Status", "Remark"],
+    "logs": ["ActionTime", "Action", "Message"],
+    "global": ["DomainName", "RecordId", "Type", "RR", "Value", "TTL", "Status", "Remark"],
+    "plan": ["Op", "RecordId", "Type", "RR", "Value", "TTL", "Status", "Remark"],
+    "batch": ["Row", "Action", "Domain", "Type", "RR", "Result", "RecordId", "Elapsed", "Calls", "Error"],
+    "propagation": ["Domain", "RR", "Type", "Value", "Nameserver", "Result", "Elapsed", "Answer"],
+}
+
+# 结果的输出格式, 由 main() 根据 --output 设置, table 为原有的 tab 分隔加分隔线的格式
+# jsonl/csv/tsv 供 jq, CMDB 导入等程序读取, 此时提示信息与交互时展示的记录改为输出到 stderr
+output_format = "table"
+
+
+# 批量执行时, 工作线程中的提示信息 (更新前后的记录等) 先写入该行的缓冲,
+# 由 iter_batch_execute() 与该行的执行结果一起按行的顺序输出, 避免并发执行的多行输出互相穿插
+row_output = threading.local()
+
+
+def info_stream():
+    buffer = getattr(row_output, "buffer", None)
+    if buffer is not None:
+        return buffer
+    return sys.stdout if output_format == "table" else sys.stderr
+
+
+def write_info(text):
+    # 将缓冲的提示信息写到实际的输出
+    if not text:
+        return
+    stream = sys.stdout if output_format == "table" else sys.stderr
+    with output_lock:
+        stream.write(text)
+        stream.flush()
+
+
+def print_info(message):
+    with output_lock:
+        print(message, file=info_stream())
+
+
 def print_kv_list_results(results, results_type="records",
-                          sep="\t", results_break="=", results_break_len=120):
-    if results_type == "records":
-        headers = ["RecordId", "Type", "RR",
-                   "Value", "TTL", "Status", "Remark"]
-    if results_type == "logs":
-        headers = ["ActionTime", "Action", "Message"]
-    results_joined = [sep.join(headers)]
+                          sep="\t", results_break="=", results_break_len=120, info=False):
+    headers = RESULTS_HEADERS[results_type]
+    fmt, stream = output_format, sys.stdout
+    if info:
+        # 更新前后的记录, 待确认的记录等仅供交互时查看, 不混入 stdout 的机器可读输出
+        fmt, stream = "table", info_stream()
+
+    # results 可以是生成器, 逐行写入同一个带缓冲的 stream, 而不是拼接成一个完整字符串后再输出
+    # 只按行加锁, results 为批量执行结果的生成器时, 工作线程在此期间仍需要输出
+    if fmt == "jsonl":
+        def write_row(result):
+            stream.write(json.dumps({header: result.get(header) for header in headers}, ensure_ascii=False))
+            stream.write("\n")
+    elif fmt in ("csv", "tsv"):
+        writer = csv.writer(stream, delimiter="," if fmt == "csv" else "\t", lineterminator="\n")
+
+        def write_row(result):
+            writer.writerow(["" if result.get(header) is None else result.get(header) for header in headers])
+    else:
+        def write_row(result):
+            stream.write(sep.join(str(result.get(header)) for header in headers))
+            stream.write("\n")
+
+    with output_lock:
+        if fmt == "table":
+            stream.write(sep.join(headers) + "\n")
+        elif fmt in ("csv", "tsv"):
+            writer.writerow(headers)
     for result in results:
-        results_joined.append(
-            sep.join(str(result.get(header)) for header in headers)
-        )
+        with output_lock:
+            write_row(result)
+
+    with output_lock:
+        if fmt == "table":
+            stream.write(results_break * results_break_len + "\n")
+        stream.flush()
+
 
-    print("\n".join(results_joined))
-    print(results_break * results_break_len)
+# 批量 .csv 从标准输入读取时, 交互式输入改为从终端读取, 避免读走 .csv 中的行
+prompt_stream = None
 
 
 def read_input(prompt, default=""):
-    try:
-        choice = input(prompt)
-    except EOFError:
-        choice = default
+    # 批量执行中需要交互时, 先输出该行已缓冲的待确认记录
+    buffer = getattr(row_output, "buffer", None)
+    if buffer is not None:
+        write_info(buffer.getvalue())
+        buffer.seek(0)
+        buffer.truncate()
+    with output_lock:
+        try:
+            if prompt_stream is None:
+                choice = input(prompt)
+            else:
+                sys.stderr.write(prompt)
+                sys.stderr.flush()
+                choice = prompt_stream.readline() or default
+        except EOFError:
+            choice = default
     return choice.strip()
 
 
-def csv_to_kv_list(csv_file, headers=[], sep=","):
+def init_prompt_stream(batch_file):
+    global prompt_stream
+    if batch_file is not sys.stdin:
+        return
+    try:
+        prompt_stream = open("/dev/tty", encoding="utf-8")
+    except OSError:
+        # 没有终端时 (如 cron 中执行) 交互式输入均使用默认值
+        prompt_stream = io.StringIO()
+
+
+def iter_csv_rows(csv_file, headers=[], report=True):
+    # 基于 csv 模块逐行解析, 支持带引号, 含逗号的字段 (如 TXT/SPF 记录值), 不会一次性读入整个文件
+    # 每行附带 line_number 字段, 列数多于 headers 的行会被报告并跳过, 不会中断后续行的处理
+    # 同一文件读取多遍时, 只在 report 为 True 的一遍报告跳过的行
     if isinstance(csv_file, io.TextIOWrapper):
         # argparse.FileType: io.TextIOWrapper 已经是一个 open 状态的文件
-        with csv_file as f:
-            csv_lines = [line.strip()
-                         for line in f.readlines() if line.strip()]
-    else:
-        with open(csv_file, encoding="utf-8") as f:
-            csv_lines = [line.strip()
-                         for line in f.readlines() if line.strip()]
-
-    if not headers:
-        headers = [header.strip() for header in csv_lines.pop(0).split(sep)]
+        f = csv_file
     else:
-        csv_lines.pop(0)
-
-    csv_kv_list = []
-    for csv_line in csv_lines:
-        item_list = [item.strip() for item in csv_line.split(sep)]
-        csv_kv_list.append(
-            {key: value for key, value in zip(headers, item_list)}
-        )
-
-    return csv_kv_list
-
-
-def init_client(config_file):
+        f = open(csv_file, encoding="utf-8", newline="")
+
+    with f:
+        reader = csv.reader(f)
+        header_row = None
+        while True:
+            try:
+                item_list = next(reader)
+            except StopIteration:
+                break
+            except csv.Error as e:
+                if report:
+                    sys.stderr.write("line %d: 无法解析的 csv 行, 已跳过: %s\n" % (reader.line_num, e))
+                continue
+            if not any(item.strip() for item in item_list):
+                continue
+            if header_row is None:
+                header_row = [header.strip() for header in item_list]
+                headers = headers or header_row
+                continue
+            if len(item_list) > len(headers):
+                if report:
+                    sys.stderr.write("line %d: 期望 %d 列, 实际为 %d 列, 已跳过 (含逗号的字段需要使用双引号)\n"
+                                     % (reader.line_num, len(headers), len(item_list)))
+                continue
+            # 末尾缺少的列 (如 remark) 视为空字符串
+            row = {key: "" for key in headers}
+            row.update((key, value.strip()) for key, value in zip(headers, item_list))
+            row["line_number"] = reader.line_num
+            yield row
+
+
+def csv_to_kv_list(csv_file, headers=[]):
+    return list(iter_csv_rows(csv_file, headers))
+
+
+def load_config(config_file):
     try:
         with open(os.path.expanduser(config_file), encoding="utf-8") as f:
             config = json.loads(f.read())
     except IOError:
             config = {}
+    return config
+
+
+def cache_dir_of(config_file):
+    # 缓存目录与配置文件位于同一目录下, 即默认为 ~/.config/opscat/alidns/cache
+    return os.path.join(os.path.dirname(os.path.expanduser(config_file)), "cache")
+
+
+def socket_path_of(config_file):
+    # 常驻服务的 socket 默认与配置文件位于同一目录下, 即 ~/.config/opscat/alidns/alidns.sock
+    return os.path.join(os.path.dirname(os.path.expanduser(config_file)), "alidns.sock")
+
+
+def local_only_options(args):
+    # 常驻服务按启动时的选项创建 client, 快照缓存与统计, 转发的请求无法应用以下选项, 指定时在当前进程中执行
+    options = (("--refresh", args.refresh), ("--cache-ttl", args.cache_ttl != 0),
+               ("--minimal-calls", args.minimal_calls), ("--transport", args.transport != "sync"),
+               ("--endpoint", args.endpoint), ("--workers", args.workers != 8),
+               ("--qps", args.qps != 0), ("--retries", args.retries != 5),
+               ("--stats", args.stats), ("--stats-file", args.stats_file))
+    return [name for name, value in options if value]
+
+
+def forward_to_daemon(socket_path, args):
+    # 常驻服务正在运行时由其执行请求, 返回 False 时调用方在当前进程中执行
+    from opscat.alidns import daemon
+
+    payload = {key: getattr(args, key) for key in daemon.REQUEST_FIELDS}
+    # 常驻服务中等待 DNS 生效时, 响应最多晚到 --propagation-timeout 秒
+    response = daemon.request(socket_path, payload, 60 + (args.propagation_timeout if args.wait_propagation else 0))
+    if response is None:
+        return False
+    if not response.get("ok"):
+        sys.stderr.write("%s\n" % response.get("error"))
+        sys.exit(1)
+    if "records" in response:
+        print_kv_list_results(response.get("records"), results_type="records")
+    else:
+        if response.get("record_id") is not None:
+            print_info("RecordId: %s" % response.get("record_id"))
+        if response.get("api_calls"):
+            print_info("API 调用次数: %s" % format_api_calls(response.get("api_calls")))
+        if not print_propagation_results(response.get("propagation")):
+            sys.exit(1)
+    return True
+
+
+def init_client(config_file, pool_size=10, transport="sync", endpoint=None):
+    config = load_config(config_file)
     ak = os.environ.get("ACS_ACCESS_KEY") or config.get("ak")
     secret = os.environ.get("ACS_SECRET") or config.get("secret")
     region = os.environ.get("ACS_REGION") or config.get("region")
-    return AcsClient(ak, secret, region)
-
-
-def paging_request(client: AcsClient, req: AcsRequest):
-    resp_list = []
+    # endpoint 默认由 SDK 解析, 可指向本地的 Alidns 替身服务用于测试, 如 http://127.0.0.1:8053
+    endpoint = endpoint or os.environ.get("ACS_ENDPOINT") or config.get("endpoint")
+    return build_client(ak, secret, region, pool_size, transport, endpoint)
+
+
+def init_client_pool(config_file, pool_size=10, transport="sync", endpoint=None, refresh=False):
+    # 配置文件中的 profiles 字段为多个账号的凭证, 顶层的 ak, secret, region 视为名为 default 的账号
+    # 各账号的 client 在第一次发起请求时才创建, 不需要请求 API 的操作不会导入 SDK
+    config = load_config(config_file)
+    clients = {}
+    if os.environ.get("ACS_ACCESS_KEY") or config.get("ak"):
+        clients["default"] = LazyClient(functools.partial(init_client, config_file, pool_size, transport, endpoint))
+    for profile, profile_config in config.get("profiles", {}).items():
+        clients[profile] = LazyClient(functools.partial(
+            build_client, profile_config.get("ak"), profile_config.get("secret"), profile_config.get("region"),
+            pool_size, transport, endpoint or profile_config.get("endpoint")))
+    if not clients:
+        clients["default"] = LazyClient(functools.partial(init_client, config_file, pool_size, transport, endpoint))
+
+    route_file = os.path.join(cache_dir_of(config_file), "domain-profiles.json")
+    return ClientPool(clients, get_domains, route_file, route_ttl=0 if refresh else 86400)
+
+
+def client_for(client, domain=None, profile=None):
+    # 兼容单个 client 与 ClientPool, 按域名取得对应账号的 client
+    if isinstance(client, ClientPool):
+        return client.get(domain, profile)
+    return client
+
+
+def build_client(ak, secret, region, pool_size=10, transport="sync", endpoint=None):
+    if transport == "async":
+        from opscat.alidns.aio_client import DEFAULT_ENDPOINT, AsyncAlidnsClient, AsyncTransportClient
+
+        aio_client = AsyncAlidnsClient(ak, secret, region or "cn-hangzhou",
+                                       endpoint=endpoint or DEFAULT_ENDPOINT,
+                                       max_connections=pool_size)
+        return AsyncTransportClient(aio_client)
+
+    from aliyunsdkcore.client import AcsClient
+    from aliyunsdkcore.request import set_default_protocol_type
+
+    # 并发分页时每个 worker 线程都需要一个连接, 连接池大小不应小于 worker 数量
+    if not endpoint:
+        return AcsClient(ak, secret, region, pool_size=pool_size)
+    url = urllib.parse.urlsplit(endpoint if "://" in endpoint else "http://%s" % endpoint)
+    if url.scheme == "https":
+        set_default_protocol_type("https")
+    client = AcsClient(ak, secret, region, pool_size=pool_size,
+                       port=url.port or (443 if url.scheme == "https" else 80))
+    client.add_endpoint(region, "Alidns", url.hostname)
+    return client
+
+
+# 当前操作 (单条 add/update/delete 命令或 batch 中的一行) 的 API 调用计数, 由 count_api_calls() 设置
+api_call_counter = contextvars.ContextVar("api_call_counter", default=None)
+api_call_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def count_api_calls():
+    counter = collections.Counter()
+    token = api_call_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        api_call_counter.reset(token)
+
+
+# 所有 API 请求共用的限速与重试层, 由 main() 根据 --qps, --retries 初始化, 为 None 时直接发送请求
+request_limiter = None
+
+# API 调用的统计信息, 指定 --stats 或 --stats-file 时由 main() 初始化, 为 None 时不统计
+api_stats = None
+
+
+def do_action(client: AcsClient, req: AcsRequest, recover=None):
+    # 所有 API 请求都经由此函数发出, 按 Action 计数, 重试的请求也计入调用次数
+    # recover: 非幂等请求在结果未知的失败后用于确认之前的请求是否已生效, 见 RequestLimiter.call()
+    action = req.get_action_name()
+    attempts = 0
+
+    def send():
+        nonlocal attempts
+        attempts += 1
+        if attempts > 1 and api_stats is not None:
+            api_stats.record_retry(action)
+        count_api_call(action)
+        start = time.monotonic()
+        try:
+            resp = client.do_action_with_exception(req)
+        except Exception as e:
+            if api_stats is not None:
+                api_stats.record_call(action, time.monotonic() - start, error_code=error_code_of(e) or type(e).__name__)
+            raise
+        if api_stats is not None:
+            api_stats.record_call(action, time.monotonic() - start, len(resp))
+        return resp
+
+    if request_limiter is None:
+        return send()
+    return request_limiter.call(send, recover)
+
+
+def do_actions(client: AcsClient, reqs):
+    # 异步传输层批量发送只读请求, 其中任一请求被限流时整批重试
+    # 批量请求并发执行, 每个请求的延迟按整批的耗时计
+    attempts = 0
+
+    def send():
+        nonlocal attempts
+        attempts += 1
+        for req in reqs:
+            count_api_call(req.get_action_name())
+            if attempts > 1 and api_stats is not None:
+                api_stats.record_retry(req.get_action_name())
+        start = time.monotonic()
+        try:
+            resps = client.do_actions(reqs)
+        except Exception as e:
+            # 整批失败时每个请求都计为一次失败的调用
+            if api_stats is not None:
+                for req in reqs:
+                    api_stats.record_call(req.get_action_name(), time.monotonic() - start,
+                                          error_code=error_code_of(e) or type(e).__name__)
+            raise
+        if api_stats is not None:
+            for req, resp in zip(reqs, resps):
+                api_stats.record_call(req.get_action_name(), time.monotonic() - start, len(resp))
+        return resps
+
+    if request_limiter is None:
+        return send()
+    return request_limiter.call(send, cost=len(reqs))
+
+
+def count_api_call(action):
+    counter = api_call_counter.get()
+    if counter is not None:
+        with api_call_lock:
+            counter[action] += 1
+
+
+def format_api_calls(counter):
+    return "%d (%s)" % (sum(counter.values()), ", ".join(
+        "%s: %d" % (action, count) for action, count in sorted(counter.items())))
+
+
+def copy_request(req: AcsRequest):
+    # AcsRequest 中引用了 module 对象, 无法使用 copy.deepcopy, 这里重新构造同类请求并复制查询参数
+    new_req = type(req)()
+    for key, value in req.get_query_params().items():
+        new_req.add_query_param(key, value)
+    return new_req
+
+
+def iter_sequential_paging_request(client: AcsClient, req: AcsRequest):
     page_number = 1
     total_count = sys.maxsize
-    while (page_number * req.get_PageSize()) <= total_count:
-        req.set_PageNumber(page_number)
-        resp = client.do_action_with_exception(req)
+    while ((page_number - 1) * req.get_PageSize()) < total_count:
+        # SDK 每次发送请求都会在请求对象的 User-Agent 头后追加内容, 同一个请求对象反复发送数百次后
+        # User-Agent 会超过服务端的请求头长度限制, 因此每一页都使用新的请求对象
+        page_req = copy_request(req)
+        page_req.set_PageNumber(page_number)
+        resp = do_action(client, page_req)
         resp_json = json.loads(resp.decode())
         total_count = resp_json.get("TotalCount")
         page_number += 1
-        resp_list.append(resp_json)
-    return resp_list
+        yield resp_json
+
+
+def iter_paging_request(client: AcsClient, req: AcsRequest, workers=8):
+    # 统计每次列表请求实际拉取的分页数, 生成器未被消费完时只计入已拉取的分页
+    pages = 0
+    try:
+        for resp_json in iter_concurrent_paging_request(client, req, workers):
+            pages += 1
+            yield resp_json
+    finally:
+        if api_stats is not None:
+            api_stats.record_listing(req.get_action_name(), pages)
+
+
+def iter_concurrent_paging_request(client: AcsClient, req: AcsRequest, workers=8):
+    if workers <= 1:
+        yield from iter_sequential_paging_request(client, req)
+        return
+
+    # 先请求第 1 页, 根据返回的 TotalCount 计算出总页数后再并发请求剩余页
+    req.set_PageNumber(1)
+    resp = do_action(client, req)
+    first_resp_json = json.loads(resp.decode())
+    page_count = math.ceil(first_resp_json.get("TotalCount", 0) / req.get_PageSize())
+    yield first_resp_json
+    if page_count <= 1:
+        return
+
+    def request_page(page_number):
+        # AcsRequest 对象是有状态的, 每个线程需要使用各自的副本
+        page_req = copy_request(req)
+        page_req.set_PageNumber(page_number)
+        resp = do_action(client, page_req)
+        return json.loads(resp.decode())
+
+    # 异步传输层可以在单个事件循环内并发发送请求, 每次并发请求 workers 页, 不占用额外线程
+    if hasattr(client, "do_actions"):
+        page_numbers = list(range(2, page_count + 1))
+        for i in range(0, len(page_numbers), workers):
+            page_reqs = []
+            for page_number in page_numbers[i:i + workers]:
+                page_req = copy_request(req)
+                page_req.set_PageNumber(page_number)
+                page_reqs.append(page_req)
+            for resp in do_actions(client, page_reqs):
+                yield json.loads(resp.decode())
+        return
+
+    # 同时在途的分页请求不超过 workers 个, 按页序逐个 yield,
+    # 这样内存占用只与 page_size * workers 相关, 而与记录总数无关
+    pending = collections.deque()
+    page_numbers = iter(range(2, page_count + 1))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, page_count - 1)) as executor:
+        for page_number in itertools.islice(page_numbers, workers):
+            pending.append(executor.submit(contextvars.copy_context().run, request_page, page_number))
+        while pending:
+            resp_json = pending.popleft().result()
+            for page_number in itertools.islice(page_numbers, 1):
+                pending.append(executor.submit(contextvars.copy_context().run, request_page, page_number))
+            yield resp_json
+
+
+def paging_request(client: AcsClient, req: AcsRequest, workers=8):
+    return list(iter_paging_request(client, req, workers))
 
 
 # 对 aliyunsdkalidns.request.v*.*Request 方法的封装
-def get_domains(client: AcsClient, page_size=100):
+def get_domains(client: AcsClient, page_size=100, workers=8):
+    from aliyunsdkalidns.request.v20150109.DescribeDomainsRequest import DescribeDomainsRequest
     req = DescribeDomainsRequest()
     req.set_PageSize(page_size)
     domains = []
-    for resp in paging_request(client, req):
+    for resp in iter_paging_request(client, req, workers):
         domains.extend(resp.get("Domains").get("Domain"))
 
     return domains
 
 
-def get_domain_logs(client: AcsClient, start_date, end_date=None, page_size=100):
+def iter_domain_logs(client: AcsClient, start_date, end_date=None, page_size=100, workers=8):
+    from aliyunsdkalidns.request.v20150109.DescribeDomainLogsRequest import DescribeDomainLogsRequest
     req = DescribeDomainLogsRequest()
     req.set_StartDate(start_date)
     if end_date:
         req.set_endDate(end_date)
     req.set_PageSize(page_size)
-    domain_logs = []
-    for resp in paging_request(client, req):
-        domain_logs.extend(resp.get("DomainLogs").get("DomainLog"))
+    for resp in iter_paging_request(client, req, workers):
+        yield from resp.get("DomainLogs").get("DomainLog")
 
-    return domain_logs
 
+def get_domain_logs(client: AcsClient, start_date, end_date=None, page_size=100, workers=8):
+    return list(iter_domain_logs(client, start_date, end_date, page_size, workers))
 
-def get_record_logs(client: AcsClient, domain, start_date, end_date=None, page_size=100):
+
+def iter_record_logs(client: AcsClient, domain, start_date, end_date=None, page_size=100, workers=8):
+    from aliyunsdkalidns.request.v20150109.DescribeRecordLogsRequest import DescribeRecordLogsRequest
     req = DescribeRecordLogsRequest()
     req.set_DomainName(domain)
     req.set_StartDate(start_date)
     if end_date:
         req.set_endDate(end_date)
     req.set_PageSize(page_size)
-    record_logs = []
-    for resp in paging_request(client, req):
-        record_logs.extend(resp.get("RecordLogs").get("RecordLog"))
+    for resp in iter_paging_request(client, req, workers):
+        yield from resp.get("RecordLogs").get("RecordLog")
 
-    return record_logs
 
+def get_record_logs(client: AcsClient, domain, start_date, end_date=None, page_size=100, workers=8):
+    return list(iter_record_logs(client, domain, start_date, end_date, page_size, workers))
 
-def get_domain_records(client: AcsClient, domain, mode="LIKE",
-                       keyword="", rr_keyword="", type_keyword="", value_keyword="", page_size=100):
+
+def sync_logs(client: AcsClient, log_store: LogStore, account, scope, domain="", start_date=None, workers=8):
+    # 增量同步操作日志到本地存储: 已同步过时以高水位 (最新一条日志的 ActionTime) 所在日期作为 StartDate,
+    # 接口的 StartDate 只精确到日期, 高水位当天已存在的日志由存储的唯一约束去重
+    high_water_mark = log_store.high_water_mark(account, scope, domain)
+    if high_water_mark:
+        start_date = high_water_mark[:10]
+    if scope == "domain":
+        logs = iter_domain_logs(client, start_date, workers=workers)
+    else:
+        logs = iter_record_logs(client, domain, start_date, workers=workers)
+    return log_store.append(account, scope, domain, logs)
+
+
+def iter_domain_records(client: AcsClient, domain, mode="LIKE",
+                        keyword="", rr_keyword="", type_keyword="", value_keyword="", page_size=100, workers=8):
+    if zone_cache is None:
+        yield from iter_domain_records_from_api(
+            client, domain, mode, keyword, rr_keyword, type_keyword, value_keyword, page_size, workers)
+        return
+
+    # 启用缓存时, 快照有效则直接在本地过滤; 否则拉取完整记录集, 每页到达后立即过滤输出, 全部拉取完毕后再保存快照
+    records = zone_cache.load(domain)
+    if records is not None:
+        yield from filter_records(records, mode, keyword, rr_keyword, type_keyword, value_keyword)
+        return
+    records = []
+    for record in iter_domain_records_from_api(client, domain, page_size=page_size, workers=workers):
+        records.append(record)
+        yield from filter_records((record,), mode, keyword, rr_keyword, type_keyword, value_keyword)
+    zone_cache.save(domain, records)
+
+
+def iter_domain_records_from_api(client: AcsClient, domain, mode="LIKE",
+                                 keyword="", rr_keyword="", type_keyword="", value_keyword="",
+                                 page_size=100, workers=8):
+    from aliyunsdkalidns.request.v20150109.DescribeDomainRecordsRequest import DescribeDomainRecordsRequest
     req = DescribeDomainRecordsRequest()
 
     if keyword:
@@ -177,22 +613,73 @@ def get_domain_records(client: AcsClient, domain, mode="LIKE",
     req.set_PageSize(page_size)
     req.set_SearchMode(mode)
 
-    records = []
-    for resp in paging_request(client, req):
-        records.extend(resp.get("DomainRecords").get("Record"))
+    for resp in iter_paging_request(client, req, workers):
+        yield from resp.get("DomainRecords").get("Record")
+
+
+def get_domain_records(client: AcsClient, domain, mode="LIKE",
+                       keyword="", rr_keyword="", type_keyword="", value_keyword="", page_size=100, workers=8):
+    return list(iter_domain_records(
+        client, domain, mode, keyword, rr_keyword, type_keyword, value_keyword, page_size, workers))
 
-    return records
+
+def get_nameservers(client: AcsClient, domain):
+    # 域名的权威 DNS 服务器, 如 dns9.hichina.com, dns10.hichina.com
+    from aliyunsdkalidns.request.v20150109.DescribeDomainInfoRequest import DescribeDomainInfoRequest
+    req = DescribeDomainInfoRequest()
+    req.set_DomainName(domain)
+    resp = json.loads(do_action(client, req).decode())
+    return resp.get("DnsServers", {}).get("DnsServer", [])
 
 
 def get_domain_record_info(client: AcsClient, record_id):
+    from aliyunsdkalidns.request.v20150109.DescribeDomainRecordInfoRequest import DescribeDomainRecordInfoRequest
     req = DescribeDomainRecordInfoRequest()
     req.set_RecordId(record_id)
-    resp = client.do_action_with_exception(req)
+    resp = do_action(client, req)
     return json.loads(resp.decode())
 
 
+def find_record_info(client: AcsClient, record_id):
+    # 直接查询线上记录 (不使用本地快照), 记录不存在时返回 None
+    try:
+        return get_domain_record_info(client, record_id)
+    except Exception as e:
+        if error_code_of(e) == "DomainRecordNotBelongToUser":
+            return None
+        raise
+
+
+def recover_applied(client: AcsClient, record_id, fields, resp):
+    # 返回 do_action() 的 recover: 写请求在超时等结果未知的失败后, 重试之前先查询线上记录,
+    # 已与 fields 一致 (fields 为 None 时为记录已删除) 说明之前的请求已经生效, 以 resp 作为结果不再重试,
+    # 避免重试的请求因记录已变更而以 DomainRecordDuplicate, DomainRecordNotBelongToUser 等错误失败
+    def recover():
+        info = find_record_info(client, record_id)
+        if fields is None:
+            applied = info is None
+        else:
+            applied = info is not None and all(
+                normalize_value(info.get("Type"), info.get(key)) == normalize_value(info.get("Type"), value)
+                if key == "Value" else str(info.get(key) or "").lower() == str(value).lower()
+                for key, value in fields.items())
+        if applied:
+            return json.dumps(dict(resp, RecordId=record_id)).encode()
+
+    return recover
+
+
+def find_added_record_id(client: AcsClient, domain, resolv_type, resolv_record, value):
+    # 按 RR 精确查询线上记录 (不使用本地快照), 返回 Type, Value 一致的记录的 RecordId
+    for record in iter_domain_records_from_api(client, domain, mode="EXACT", keyword=resolv_record, workers=1):
+        if record.get("Type") == resolv_type and \
+                normalize_value(resolv_type, record.get("Value")) == normalize_value(resolv_type, value):
+            return record.get("RecordId")
+
+
 def add_domain_record(client: AcsClient, domain,
                       resolv_type, resolv_record, value, ttl=600, priority=1):
+    from aliyunsdkalidns.request.v20150109.AddDomainRecordRequest import AddDomainRecordRequest
     req = AddDomainRecordRequest()
     req.set_DomainName(domain)
     req.set_RR(resolv_record)
@@ -201,14 +688,28 @@ def add_domain_record(client: AcsClient, domain,
     req.set_TTL(ttl)
     if resolv_type == "MX":
         req.set_Priority(priority)
-    resp = client.do_action_with_exception(req)
+
+    def recover():
+        # AddDomainRecord 不是幂等的, 超时等结果未知的失败后先确认之前的请求是否已经生效, 已生效时不再重复添加
+        record_id = find_added_record_id(client, domain, resolv_type, resolv_record, value)
+        if record_id is not None:
+            return json.dumps({"RecordId": record_id}).encode()
+
+    resp = do_action(client, req, recover)
     record_id = json.loads(resp.decode()).get("RecordId")
+    if zone_cache is not None:
+        record = {"DomainName": domain, "RecordId": record_id, "RR": resolv_record, "Type": resolv_type,
+                  "Value": value, "TTL": int(ttl), "Line": "default", "Status": "ENABLE", "Locked": False}
+        if resolv_type == "MX":
+            record["Priority"] = int(priority)
+        zone_cache.add_record(domain, record)
     return record_id
 
 
 def update_domain_record(client: AcsClient, record_id,
                          resolv_type, resolv_record, value, ttl=600, priority=1):
     # https://help.aliyun.com/document_detail/29774.html
+    from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRequest import UpdateDomainRecordRequest
     req = UpdateDomainRecordRequest()
     req.set_RecordId(record_id)
     req.set_RR(resolv_record)
@@ -219,73 +720,116 @@ def update_domain_record(client: AcsClient, record_id,
         req.set_TTL(ttl)
     if resolv_type == "MX":
         req.set_Priority(priority)
-    resp = client.do_action_with_exception(req)
+    fields = {"RR": resolv_record, "Type": resolv_type}
+    if value:
+        fields["Value"] = value
+    if ttl:
+        fields["TTL"] = int(ttl)
+    if resolv_type == "MX":
+        fields["Priority"] = int(priority)
+    resp = do_action(client, req, recover_applied(client, record_id, fields, {}))
+    if zone_cache is not None:
+        zone_cache.patch_record(record_id, **fields)
     return json.loads(resp.decode())
 
 
-def update_domain_record_remark(client: AcsClient, record_id, remark=""):
-    # https://help.aliyun.com/document_detail/143569.html
-    req = UpdateDomainRecordRemarkRequest()
+def normalize_remark(remark):
     # Error:InvalidRemark.Format 50 characters long,
     # It can only contain numbers,Chinese,English and special characters: _ - , . ，。
     remark_pattern = re.compile(r"[\u4e00-\u9fa5，。a-zA-Z0-9_,.-]+")
-    remark_strip = "".join(re.findall(remark_pattern, remark))[:50]
+    return "".join(re.findall(remark_pattern, remark or ""))[:50]
+
+
+def update_domain_record_remark(client: AcsClient, record_id, remark=""):
+    # https://help.aliyun.com/document_detail/143569.html
+    from aliyunsdkalidns.request.v20150109.UpdateDomainRecordRemarkRequest import UpdateDomainRecordRemarkRequest
+    req = UpdateDomainRecordRemarkRequest()
+    remark_strip = normalize_remark(remark)
 
     req.set_RecordId(record_id)
     req.set_Remark(remark_strip)
-    resp = client.do_action_with_exception(req)
+    resp = do_action(client, req, recover_applied(client, record_id, {"Remark": remark_strip}, {}))
+    if zone_cache is not None:
+        zone_cache.patch_record(record_id, Remark=remark_strip)
     return json.loads(resp.decode())
 
 
 def delete_domain_record(client: AcsClient, record_id):
+    from aliyunsdkalidns.request.v20150109.DeleteDomainRecordRequest import DeleteDomainRecordRequest
     req = DeleteDomainRecordRequest()
     req.set_RecordId(record_id)
-    resp = client.do_action_with_exception(req)
+    resp = do_action(client, req, recover_applied(client, record_id, None, {}))
+    if zone_cache is not None:
+        zone_cache.remove_record(record_id)
     return json.loads(resp.decode())
 
 
 def delete_subdomain_records(client: AcsClient, domain, resolv_type, resolv_record):
     # 这个方法太危险了! 尽量避免调用这个函数
+    from aliyunsdkalidns.request.v20150109.DeleteSubDomainRecordsRequest import DeleteSubDomainRecordsRequest
     req = DeleteSubDomainRecordsRequest()
     req.set_DomainName(domain)
     req.set_RR(resolv_record)
     req.set_Type(resolv_type)
-    resp = client.do_action_with_exception(req)
+    resp = do_action(client, req)
+    if zone_cache is not None:
+        zone_cache.invalidate(domain)
     return json.loads(resp.decode())
 
 
 def set_domain_record_status(client: AcsClient, record_id, status="Enable"):
+    from aliyunsdkalidns.request.v20150109.SetDomainRecordStatusRequest import SetDomainRecordStatusRequest
     req = SetDomainRecordStatusRequest()
     req.set_RecordId(record_id)
     req.set_Status(status)
-    resp = client.do_action_with_exception(req)
+    resp = do_action(client, req, recover_applied(client, record_id, {"Status": status}, {"Status": status.upper()}))
+    if zone_cache is not None:
+        zone_cache.patch_record(record_id, Status=status.upper())
     return json.loads(resp.decode())
 
 
 # 以下函数为对上述封装函数的组合调用
-def get_record_id_by_record(client: AcsClient, **kwargs):
-    if not kwargs.get("record_id"):
-        keyword = kwargs.get("record")
-        records = get_domain_records(
-            client=client,
-            domain=kwargs.get("domain"),
-            mode="EXACT",
-            keyword=keyword
-        )
-        if len(records) <= 0:
-            return
-        if len(records) > 1:
-            print_kv_list_results(records, results_type="records")
+# 由 main() 根据 --minimal-calls 设置, 为 True 时 update 直接使用按 RR 查找时 (或本地快照中) 得到的现有记录,
+# 不再调用 DescribeDomainRecordInfo, 更新后也不再重新读取记录, 而是在本地推算更新后的记录用于展示
+minimal_calls = False
+
+
+def get_record_by_record(client: AcsClient, **kwargs):
+    # 返回按 RR 精确查找到的记录, 已指定 record_id 或手动输入的 RecordId 不在查询结果中时只包含 RecordId
+    # record_id 为 "" 时表示已在 plan_batch() 中放弃选择, 不再重复查询
+    if kwargs.get("record_id") is not None:
+        record_id = kwargs.get("record_id")
+        if record_id and minimal_calls and zone_cache is not None:
+            return zone_cache.find_record(record_id)[1] or {"RecordId": record_id}
+        return {"RecordId": record_id}
+
+    keyword = kwargs.get("record")
+    records = get_domain_records(
+        client=client,
+        domain=kwargs.get("domain"),
+        mode="EXACT",
+        keyword=keyword
+    )
+    if len(records) <= 0:
+        return
+    if len(records) > 1:
+        with output_lock:
+            print_kv_list_results(records, results_type="records", info=True)
             record_id = read_input(
                 prompt="按 RR:%s 条件查询到多条记录, 请输入需要执行 %s 操作的 RecordId: "
                 % (keyword, kwargs.get("action"))
             )
-        else:
-            record_id = records[0].get("RecordId")
-    else:
-        record_id = kwargs.get("record_id")
+        for record in records:
+            if str(record.get("RecordId")) == record_id:
+                return record
+        return {"RecordId": record_id}
+    return records[0]
 
-    return record_id
+
+def get_record_id_by_record(client: AcsClient, **kwargs):
+    record = get_record_by_record(client, **kwargs)
+    if record:
+        return record.get("RecordId")
 
 
 def add_domain_record_with_remark(client: AcsClient, **kwargs):
@@ -298,18 +842,26 @@ def add_domain_record_with_remark(client: AcsClient, **kwargs):
         ttl=kwargs.get("ttl"),
         priority=kwargs.get("priority")
     )
-    update_domain_record_remark(client, record_id, kwargs.get("remark"))
+    # 新增的记录没有备注, 备注为空时无需再调用 UpdateDomainRecordRemark
+    if normalize_remark(kwargs.get("remark")):
+        update_domain_record_remark(client, record_id, kwargs.get("remark"))
     if kwargs.get("status").lower() in ["disable", "暂停"]:
         set_domain_record_status(client, record_id, kwargs.get("status"))
     return record_id
 
 
 def update_domain_record_with_remark(client: AcsClient, **kwargs):
-    record_id = get_record_id_by_record(client, **kwargs)
+    found = get_record_by_record(client, **kwargs)
+    record_id = found.get("RecordId") if found else None
     if not record_id:
         return
     # 根据 record_id 获取现有值, 避免每次都需要传递完整参数
-    record = get_domain_record_info(client, record_id)
+    # 批量模式下 plan_batch() 已预先从索引中取得了现有记录, 此时无需再次请求
+    record = kwargs.get("record_info")
+    if not record and minimal_calls and found.get("Value") is not None:
+        record = found
+    if not record:
+        record = get_domain_record_info(client, record_id)
 
     # 传入 UpdateDomainRecord 接口的参数完全一致时会出现 Error:DomainRecordDuplicate, 此时需避免调用
     resolv_record = kwargs.get("record") or record.get("RR")
@@ -332,22 +884,34 @@ def update_domain_record_with_remark(client: AcsClient, **kwargs):
     if resolv_type == "MX":
         record_info_eq.append(priority == str(record.get("Priority")))
 
-    print("子域名更新前记录信息:")
-    print_kv_list_results([record], results_type="records")
+    remark_eq = normalize_remark(remark) == (record.get("Remark") or "")
+    # 启用, 正常与 ENABLE 等价, 避免因写法不同而多调用一次 SetDomainRecordStatus
+    status_eq = normalize_status(status) == normalize_status(record.get("Status"))
+    with output_lock:
+        print_info("子域名更新前记录信息:")
+        print_kv_list_results([record], results_type="records", info=True)
+        if all(record_info_eq) and remark_eq and status_eq:
+            print_info("子域名记录信息无变更, 跳过更新")
+            return record_id
+    updated = dict(record)
     if not all(record_info_eq):
         update_domain_record(client, record_id, resolv_type,
                              resolv_record, value, ttl, priority)
-    if remark != record.get("Remark"):
+        updated.update({"RR": resolv_record, "Type": resolv_type, "Value": value, "TTL": ttl})
+    if not remark_eq:
         update_domain_record_remark(client, record_id, remark)
-    if status.lower() != record.get("Status").lower():
-        if status.lower() in ["enable", "启用", "正常"]:
+        updated["Remark"] = normalize_remark(remark)
+    if not status_eq:
+        if normalize_status(status) == "ENABLE":
             set_domain_record_status(client, record_id, "Enable")
         else:
             set_domain_record_status(client, record_id, "Disable")
+        updated["Status"] = normalize_status(status)
 
-    print("子域名更新后记录信息:")
-    print_kv_list_results([get_domain_record_info(
-        client, record_id)], results_type="records")
+    record = updated if minimal_calls else get_domain_record_info(client, record_id)
+    with output_lock:
+        print_info("子域名更新后记录信息:")
+        print_kv_list_results([record], results_type="records", info=True)
 
     return record_id
 
@@ -363,12 +927,13 @@ def delete_domain_record_by_delete_type(client: AcsClient, delete_type="id", **k
         )
         if len(records) <= 0:
             return
-        print_kv_list_results(records, results_type="records")
-        choice = read_input(
-            prompt="确认按 (Type:%s, RR:%s) 条件查询并删除所有解析记录? [y/N]: "
-            % (kwargs.get("type"), kwargs.get("record")),
-            default="N"
-        )
+        with output_lock:
+            print_kv_list_results(records, results_type="records", info=True)
+            choice = read_input(
+                prompt="确认按 (Type:%s, RR:%s) 条件查询并删除所有解析记录? [y/N]: "
+                % (kwargs.get("type"), kwargs.get("record")),
+                default="N"
+            )
         if choice.lower() == "y" or choice.lower() == "yes":
             delete_subdomain_records(
                 client=client,
@@ -376,22 +941,25 @@ def delete_domain_record_by_delete_type(client: AcsClient, delete_type="id", **k
                 resolv_type=kwargs.get("type"),
                 resolv_record=kwargs.get("record")
             )
+            return ",".join(record.get("RecordId") for record in records)
     else:
         record_id = get_record_id_by_record(client, **kwargs)
         if record_id:
             delete_domain_record(client, record_id)
+        return record_id
 
 
 def add_update_delete(client: AcsClient, **kwargs):
+    # 返回被操作记录的 RecordId, 未执行任何操作时返回 None
     action = kwargs.get("action", "")
 
     # add
     if action == "add":
-        add_domain_record_with_remark(client, **kwargs)
+        return add_domain_record_with_remark(client, **kwargs)
 
     # update
     if action == "update":
-        update_domain_record_with_remark(client, **kwargs)
+        return update_domain_record_with_remark(client, **kwargs)
 
     # delete, delete:subdomain
     if action.startswith("delete"):
@@ -399,14 +967,431 @@ def add_update_delete(client: AcsClient, **kwargs):
             delete_type = "subdomain"
         else:
             delete_type = "id"
-        delete_domain_record_by_delete_type(client, delete_type, **kwargs)
+        return delete_domain_record_by_delete_type(client, delete_type, **kwargs)
+
+
+class RecordIndex:
+    # 域名下完整记录集的内存索引, 按 (RR, Type), RR 以及 RecordId 查找记录
+    def __init__(self, records):
+        self.by_id = {}
+        self.by_rr = collections.defaultdict(list)
+        self.by_rr_type = collections.defaultdict(list)
+        for record in records:
+            rr = str(record.get("RR")).lower()
+            self.by_id[str(record.get("RecordId"))] = record
+            self.by_rr[rr].append(record)
+            self.by_rr_type[(rr, record.get("Type"))].append(record)
+
+    def lookup(self, resolv_record, resolv_type=None):
+        rr = str(resolv_record).lower()
+        # 优先按 (RR, Type) 匹配, 匹配不到时 (比如 update 修改了记录类型) 退回到只按 RR 匹配
+        if resolv_type and self.by_rr_type.get((rr, resolv_type)):
+            return self.by_rr_type.get((rr, resolv_type))
+        return self.by_rr.get(rr, [])
+
+
+def plan_batch(client: AcsClient, iter_rows, jobs=4, workers=8):
+    # 执行前的规划阶段, 仅用于普通文件, iter_rows() 每次调用都从头流式读取全部行:
+    # 第一遍只保留需要解析 RecordId 的 update/delete 行, 每个涉及的域名只拉取一次完整记录集并建立索引,
+    # 预先解析每一行的 RecordId 及现有记录, 多条匹配时的交互式选择也在此统一完成;
+    # 返回第二遍读取的行生成器, 其中已规划的行替换为规划结果, 无法解析的行只在第一遍报告
+    planned_rows = {kwargs.get("line_number"): kwargs for kwargs in iter_rows()
+                    if kwargs.get("action") in ("update", "delete") and batch_row_pending(kwargs)}
+    domains = sorted({kwargs.get("domain") for kwargs in planned_rows.values()})
+    indexes = {}
+    if domains:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(jobs, len(domains)), 1)) as executor:
+            zone_records = executor.map(
+                lambda domain: get_domain_records(client_for(client, domain), domain, workers=workers), domains)
+            indexes = {domain: RecordIndex(records) for domain, records in zip(domains, zone_records)}
+
+    planned_record_ids = set()
+    for kwargs in planned_rows.values():
+        plan_batch_row(client, kwargs, indexes, planned_record_ids, workers)
+    return (planned_rows.get(kwargs.get("line_number"), kwargs) for kwargs in iter_rows(report=False))
+
+
+def iter_plan_batch(client: AcsClient, batch_kwargs, workers=8, indexes=None):
+    # 流式规划: 逐行解析 RecordId, 某个域名第一次出现时才拉取其记录集并建立索引
+    indexes = {} if indexes is None else indexes
+    planned_record_ids = set()
+    for kwargs in batch_kwargs:
+        if batch_row_pending(kwargs):
+            plan_batch_row(client, kwargs, indexes, planned_record_ids, workers)
+        yield kwargs
+
+
+def batch_row_pending(kwargs):
+    # --resume 时已完成的行不再规划, 避免为其拉取记录集或交互式选择记录
+    return batch_journal is None or batch_journal.completed(kwargs.get("line_number")) is None
+
+
+def plan_batch_row(client: AcsClient, kwargs, indexes, planned_record_ids, workers=8):
+    # delete:subdomain 按 (Type, RR) 删除, 不需要解析 RecordId
+    if kwargs.get("action") not in ("update", "delete"):
+        return
+    domain = kwargs.get("domain")
+    if domain not in indexes:
+        indexes[domain] = RecordIndex(get_domain_records(client_for(client, domain), domain, workers=workers))
+    index = indexes.get(domain)
+    if kwargs.get("record_id"):
+        record = index.by_id.get(str(kwargs.get("record_id")))
+    else:
+        records = index.lookup(kwargs.get("record"), kwargs.get("type"))
+        # 匹配不到时该记录可能由 csv 中更早的 add 行创建, 留到执行时再查询
+        if len(records) <= 0:
+            return
+        if len(records) > 1:
+            with output_lock:
+                print_kv_list_results(records, results_type="records", info=True)
+                record_id = read_input(
+                    prompt="按 RR:%s 条件查询到多条记录, 请输入需要执行 %s 操作的 RecordId: "
+                    % (kwargs.get("record"), kwargs.get("action"))
+                )
+            record = index.by_id.get(record_id)
+            if not record:
+                kwargs["record_id"] = record_id
+                return
+        else:
+            record = records[0]
+        kwargs["record_id"] = record.get("RecordId")
+    # 同一条记录被多行引用时只有第一行可以使用预取的现有值, 后续行执行时其值可能已被前面的行修改
+    if record and record.get("RecordId") not in planned_record_ids:
+        kwargs["record_info"] = record
+        planned_record_ids.add(record.get("RecordId"))
+
+
+def build_value_index(client, jobs=4, workers=8):
+    # 遍历所有账号下的全部域名, 并发拉取记录集后构建 Value -> 记录 的倒排索引
+    if isinstance(client, ClientPool):
+        domains = sorted(client.domains())
+    else:
+        domains = sorted(domain.get("DomainName") for domain in get_domains(client, workers=workers))
+
+    def domain_records(domain):
+        records = get_domain_records(client_for(client, domain), domain, workers=workers)
+        for record in records:
+            record.setdefault("DomainName", domain)
+        return records
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        return ValueIndex.build(itertools.chain.from_iterable(executor.map(domain_records, domains)))
+
+
+def normalize_status(status):
+    return "ENABLE" if str(status).lower() in ["enable", "启用", "正常"] else "DISABLE"
+
+
+def normalize_value(resolv_type, value):
+    # 域名类型的记录值不区分大小写, 末尾的 . 可有可无
+    if resolv_type in ("CNAME", "MX", "NS"):
+        return str(value).lower().rstrip(".")
+    return str(value)
+
+
+def normalize_domain(domain):
+    return str(domain).lower().rstrip(".")
+
+
+def record_identity(resolv_record, resolv_type, value):
+    return (str(resolv_record).lower(), resolv_type, normalize_value(resolv_type, value))
+
+
+def diff_zone(domain, desired_records, live_records):
+    # 计算期望记录集与线上记录集之间的最小变更, 均按 (RR, Type, Value) 做哈希匹配, 时间复杂度与两者大小成线性关系
+    # 期望记录中 ttl, priority, status, remark 为空时表示不关心该字段, 与 update 动作的语义一致
+    live_by_identity = {}
+    for record in live_records:
+        live_by_identity[record_identity(record.get("RR"), record.get("Type"), record.get("Value"))] = record
+
+    changes = []
+    unmatched_desired = collections.defaultdict(list)
+    for desired in desired_records:
+        identity = record_identity(desired.get("record"), desired.get("type"), desired.get("value"))
+        record = live_by_identity.pop(identity, None)
+        if record is None:
+            unmatched_desired[identity[:2]].append(desired)
+            continue
+        if record_attrs_changed(desired, record):
+            changes.append(sync_row("update", domain, desired, record))
+
+    # 同一 (RR, Type) 下线上多余的记录与期望中缺少的记录一一配对, 用一次 update 修改记录值代替 delete + add
+    # 按 (RR, Type) 排序, 同一 key 下的线上记录按记录值排序, 相同输入每次得到相同顺序的计划与 API 调用
+    unmatched_live = collections.defaultdict(list)
+    for identity, record in sorted(live_by_identity.items(), key=lambda item: item[0]):
+        unmatched_live[identity[:2]].append(record)
+    for key in sorted(set(unmatched_desired) | set(unmatched_live), key=lambda key: (key[0], key[1] or "")):
+        desired_list = unmatched_desired.get(key, [])
+        live_list = unmatched_live.get(key, [])
+        for desired, record in zip(desired_list, live_list):
+            changes.append(sync_row("update", domain, desired, record))
+        for desired in desired_list[len(live_list):]:
+            changes.append(sync_row("add", domain, desired))
+        for record in live_list[len(desired_list):]:
+            changes.append(sync_row("delete", domain, None, record))
+
+    return changes
+
+
+def record_attrs_changed(desired, record):
+    if desired.get("ttl") and str(desired.get("ttl")) != str(record.get("TTL")):
+        return True
+    if desired.get("type") == "MX" and desired.get("priority") \
+            and str(desired.get("priority")) != str(record.get("Priority")):
+        return True
+    if desired.get("status") and normalize_status(desired.get("status")) != str(record.get("Status")).upper():
+        return True
+    if desired.get("remark") and normalize_remark(desired.get("remark")) != (record.get("Remark") or ""):
+        return True
+    return False
+
+
+def sync_row(action, domain, desired=None, record=None):
+    # 将 sync 计划中的一项变更转换为 add_update_delete() 可执行的批量行
+    if action == "delete":
+        return {"action": "delete", "domain": domain, "type": record.get("Type"), "record": record.get("RR"),
+                "value": record.get("Value"), "ttl": record.get("TTL"), "status": record.get("Status"),
+                "remark": record.get("Remark"), "record_id": record.get("RecordId")}
+
+    row = {
+        "action": action,
+        "domain": domain,
+        "type": desired.get("type"),
+        "record": desired.get("record"),
+        "value": desired.get("value"),
+        "ttl": desired.get("ttl") or (str(record.get("TTL")) if record else "600"),
+        "priority": desired.get("priority") or (str(record.get("Priority") or 1) if record else "1"),
+        "status": desired.get("status") or (record.get("Status") if record else "Enable"),
+        "remark": normalize_remark(desired.get("remark")),
+    }
+    if record:
+        row["record_id"] = record.get("RecordId")
+        row["record_info"] = record
+    return row
+
+
+def print_sync_plan(changes):
+    plan = []
+    for change in changes:
+        value = change.get("value")
+        record = change.get("record_info")
+        if record and normalize_value(record.get("Type"), record.get("Value")) \
+                != normalize_value(change.get("type"), value):
+            value = "%s -> %s" % (record.get("Value"), value)
+        plan.append({
+            "Op": change.get("action"),
+            "RecordId": change.get("record_id"),
+            "Type": change.get("type"),
+            "RR": change.get("record"),
+            "Value": value,
+            "TTL": change.get("ttl"),
+            "Status": change.get("status"),
+            "Remark": change.get("remark"),
+        })
+    print_kv_list_results(plan, results_type="plan")
+    counter = collections.Counter(change.get("action") for change in changes)
+    print_info("add: %d, update: %d, delete: %d" % (
+        counter.get("add", 0), counter.get("update", 0), counter.get("delete", 0)))
+
+
+def sync_zone(client: AcsClient, domain, desired_records, jobs=4, workers=8, assume_yes=False):
+    live_records = get_domain_records(client, domain, workers=workers)
+    changes = diff_zone(domain, desired_records, live_records)
+    if not changes:
+        print_info("域名 %s 的解析记录与期望状态一致, 无需变更" % domain)
+        return []
+
+    print_sync_plan(changes)
+    if not assume_yes:
+        choice = read_input(prompt="确认按以上计划同步域名 %s 的解析记录? [y/N]: " % domain, default="N")
+        if choice.lower() not in ("y", "yes"):
+            return []
+
+    # 先执行 delete, 避免新增记录与待删除记录冲突 (比如同一 RR 的 A 记录改为 CNAME 记录)
+    deletes = [change for change in changes if change.get("action") == "delete"]
+    others = [change for change in changes if change.get("action") != "delete"]
+    results = batch_execute(client, deletes, jobs) + batch_execute(client, others, jobs)
+    for row_number, result in enumerate(results, start=1):
+        result["Row"] = row_number
+    return results
+
+
+def batch_row_key(kwargs):
+    # 同一 (domain, RR, Type) 上的操作必须按 csv 中的顺序执行, 比如先 add 再 update
+    return (kwargs.get("domain"), kwargs.get("record"), kwargs.get("type"))
+
+
+def run_batch_row(client: AcsClient, row_number, kwargs, previous=None):
+    # 该行执行过程中的提示信息保存在结果的 Output 中, 不直接输出
+    row_output.buffer = io.StringIO()
+    try:
+        result = execute_batch_row(client, row_number, kwargs, previous)
+        result["Output"] = row_output.buffer.getvalue()
+        return result
+    finally:
+        row_output.buffer = None
+
+
+def execute_batch_row(client: AcsClient, row_number, kwargs, previous=None):
+    result = {
+        "Row": row_number,
+        "Action": kwargs.get("action"),
+        "Domain": kwargs.get("domain"),
+        "Type": kwargs.get("type"),
+        "RR": kwargs.get("record"),
+        "Result": "ok",
+        "RecordId": None,
+        "Elapsed": "0.000",
+        "Calls": 0,
+        "Error": "",
+    }
+    # --resume 时上一次执行中已完成的行直接使用日志中的结果
+    entry = batch_journal.completed(row_number) if batch_journal is not None else None
+    if entry is not None:
+        result["Result"] = "done"
+        result["RecordId"] = entry.get("record_id")
+        return result
+
+    # 等待同一 key 上的前一行执行完毕, 前一行失败 (或因更早的行失败而被跳过) 时跳过本行
+    if previous is not None and previous.result().get("Error"):
+        result["Result"] = "skipped"
+        result["Error"] = "row %s failed" % previous.result().get("Row")
+        if batch_journal is not None:
+            batch_journal.finish(row_number, result)
+        return result
+
+    start = time.monotonic()
+    with count_api_calls() as calls:
+        try:
+            row_client = client_for(client, kwargs.get("domain"))
+            # 上一次执行在 add 请求发出后中断, 请求可能已经生效, 先确认线上是否已有该记录
+            if batch_journal is not None and batch_journal.pending(row_number) and kwargs.get("action") == "add":
+                result["RecordId"] = find_added_record_id(row_client, kwargs.get("domain"), kwargs.get("type"),
+                                                          kwargs.get("record"), kwargs.get("value"))
+            if batch_journal is not None:
+                batch_journal.begin(row_number, kwargs)
+            if not result["RecordId"]:
+                result["RecordId"] = add_update_delete(row_client, **kwargs)
+            if not result["RecordId"]:
+                result["Result"] = "skipped"
+            elif propagation_checks is not None:
+                propagation_checks.append(propagation_check_of(kwargs))
+        except Exception as e:
+            result["Result"] = "failed"
+            result["Error"] = str(e)
+    result["Elapsed"] = "%.3f" % (time.monotonic() - start)
+    result["Calls"] = sum(calls.values())
+    if batch_journal is not None:
+        batch_journal.finish(row_number, result)
+    return result
+
+
+def iter_batch_execute(client: AcsClient, batch_kwargs, jobs=4):
+    # 不同 key 的行并发执行, 同一 key 的行按 csv 顺序串行执行
+    # ThreadPoolExecutor 按提交顺序取任务, 前一行总是先于后一行开始执行, 因此不会因互相等待而死锁
+    # batch_kwargs 可以是流式的生成器, 在途的行不超过 jobs * 4 个, 结果按行的顺序 yield
+    max_pending = max(jobs, 1) * 4
+    pending = collections.deque()
+    key_futures = {}
+
+    def pop_result():
+        key, future = pending.popleft()
+        # 已执行完毕的 key 不再需要用于串行等待, 及时释放
+        if key_futures.get(key) is future:
+            del key_futures[key]
+        result = future.result()
+        write_info(result.pop("Output", ""))
+        return result
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+        for row_number, kwargs in enumerate(batch_kwargs, start=1):
+            key = batch_row_key(kwargs)
+            future = executor.submit(run_batch_row, client, kwargs.get("line_number", row_number),
+                                     kwargs, key_futures.get(key))
+            key_futures[key] = future
+            pending.append((key, future))
+            # 队首的行执行完毕即输出, 不必等到在途的行达到上限
+            while pending and (len(pending) >= max_pending or pending[0][1].done()):
+                yield pop_result()
+        while pending:
+            yield pop_result()
+
+
+def batch_execute(client: AcsClient, batch_kwargs, jobs=4):
+    return list(iter_batch_execute(client, batch_kwargs, jobs))
+
+
+def print_batch_summary(results):
+    # results 可以是 iter_batch_execute() 的生成器, 每一行执行完毕即输出, 返回各结果的计数
+    counter = collections.Counter()
+    calls = 0
+
+    def count_results():
+        nonlocal calls
+        for result in results:
+            counter[result.get("Result")] += 1
+            calls += result.get("Calls") or 0
+            yield result
+
+    print_kv_list_results(count_results(), results_type="batch")
+    summary = "total: %d, ok: %d, failed: %d, skipped: %d" % (
+        sum(counter.values()), counter.get("ok", 0), counter.get("failed", 0), counter.get("skipped", 0))
+    # done 为 --resume 时上一次执行中已完成的行
+    if counter.get("done"):
+        summary += ", done: %d" % counter.get("done")
+    print_info("%s, api calls: %d" % (summary, calls))
+    return counter
+
+
+# 批量执行的预写日志, 由 main() 在 -b 为普通文件时初始化, 为 None 时不记录 (如读取标准输入, 管道时)
+batch_journal = None
+
+
+# 指定 --wait-propagation 时由 main() 初始化为空列表, batch/sync 中执行成功的 add/update 行在此登记,
+# 全部执行完毕后一次性并发检查, 为 None 时不登记
+propagation_checks = None
+
+
+def propagation_check_of(kwargs):
+    # add/update 之后需要在权威 DNS 服务器上确认的 (domain, RR, Type, Value), 返回 None 时不检查
+    # 禁用的记录不会被解析, URL 转发记录解析为转发服务器的地址, 均无法按记录值确认
+    from opscat.alidns.propagation import UNCHECKABLE_TYPES
+
+    if kwargs.get("action") not in ("add", "update") or not kwargs.get("type") or not kwargs.get("value"):
+        return None
+    if str(kwargs.get("status") or "Enable").upper() == "DISABLE" or kwargs.get("type") in UNCHECKABLE_TYPES:
+        return None
+    return kwargs.get("domain"), kwargs.get("record"), kwargs.get("type"), kwargs.get("value")
+
+
+def check_propagation(client: AcsClient, checks, timeout=300, nameservers=None):
+    # 所有记录在各自域名的所有权威服务器上并发检查, nameservers 为空时通过 DescribeDomainInfo 获取
+    from opscat.alidns.propagation import wait_for_propagation
+
+    checks = list(dict.fromkeys(check for check in checks if check))
+    if not checks:
+        return []
+    domain_nameservers = {domain: nameservers or get_nameservers(client_for(client, domain), domain)
+                          for domain in dict.fromkeys(check[0] for check in checks)}
+    print_info("等待 %d 条记录在权威 DNS 服务器上生效, 最长 %d 秒..." % (len(checks), timeout))
+    return wait_for_propagation(checks, domain_nameservers, timeout)
+
+
+def print_propagation_results(results):
+    # 返回是否所有记录都已在所有权威服务器上生效
+    if not results:
+        return True
+    print_kv_list_results(results, results_type="propagation")
+    ok = sum(1 for result in results if result.get("Result") == "ok")
+    print_info("propagation: %d/%d ok" % (ok, len(results)))
+    return ok == len(results)
 
 
 def parse_args():
     parser = argparse.ArgumentParser()
     action_choices = (
         "batch", "search", "search:exact", "logs:domain", "logs:record",
-        "add", "update", "delete", "delete:subdomain"
+        "add", "update", "delete", "delete:subdomain", "sync", "search:global", "daemon"
     )
     type_choices = (
         "A", "NS", "MX", "TXT", "CNAME",
@@ -417,13 +1402,23 @@ def parse_args():
 
     parser.add_argument("-c", "--config", default=config_default,
                         help="保存 ak, secret, region 值的配置文件, 默认值 %s" % config_default)
+    parser.add_argument("-p", "--profile",
+                        help="使用配置文件 profiles 中指定名称的账号, 默认按域名自动选择所属账号")
     parser.add_argument("-b", "--batch", type=argparse.FileType("r", encoding="utf-8"),
-                        help="执行批量 add/update/delete 动作的 .csv 文件输入, 可使用 - 读取标准输入")
+                        help="执行批量 add/update/delete 动作或 sync 动作的 .csv 文件输入, 可使用 - 读取标准输入")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="执行 sync 动作时不再确认, 直接按计划执行变更")
+    parser.add_argument("--allow-empty", action="store_true",
+                        help="执行 sync 动作时允许期望状态文件为空, 即删除该域名下的全部解析记录")
+    parser.add_argument("--resume", action="store_true",
+                        help="按预写日志跳过同一 .csv 文件上一次批量执行中已完成的行, 只执行剩余的行")
 
     parser.add_argument("-a", "--action", choices=action_choices, default="search",
                         help="执行本脚本的动作, 默认值为 search")
     parser.add_argument("-d", "--domain", help="域名操作对象, 如 example.com")
-    parser.add_argument("-k", "--keyword", help="执行 search 动作时的关键字")
+    parser.add_argument("-k", "--keyword", help="执行 search 动作时的关键字, search:global 时为要反查的记录值")
+    parser.add_argument("--index-ttl", type=int, default=3600,
+                        help="search:global 记录值倒排索引的有效期(秒), 默认值为 3600")
     parser.add_argument("-t", "--type", choices=type_choices,
                         help="执行 add/update 动作时的记录类型, see: https://tg.pe/G9u")
     parser.add_argument("-r", "--record", help="执行 add/update/delete 动作时的主机记录")
@@ -441,33 +1436,153 @@ def parse_args():
                                  start_date_default).strftime("%Y-%m-%d"),
                         help="执行日志搜索时的起始日期(格式 YYYY-mm-dd, 默认值当前日期的 %d 天前)" % start_date_default.days)
     parser.add_argument("-E", "--end-date", help="执行日志搜索时的截止日期(格式 YYYY-mm-dd)")
+    parser.add_argument("--log-store", action="store_true",
+                        help="执行日志搜索时先增量同步到本地日志存储, 再从本地存储中查询")
+    parser.add_argument("--log-action", help="从本地日志存储中查询时按操作类型过滤, 如 ADD, DEL")
 
     parser.add_argument("-I", "--record-id",
                         help="执行 update/delete 动作时的 recordID")
 
-    return parser.parse_args()
+    parser.add_argument("--transport", choices=("sync", "async"), default="sync",
+                        help="API 请求的传输层, sync 为 aliyunsdkcore 的 AcsClient, "
+                             "async 为基于 httpx.AsyncClient 的连接池, 默认值为 sync")
+    parser.add_argument("--endpoint",
+                        help="Alidns API 地址, 如 http://127.0.0.1:8053, 也可通过环境变量 ACS_ENDPOINT 或配置文件设置")
+    parser.add_argument("-w", "--workers", type=int, default=8,
+                        help="分页查询时的并发请求数, 默认值为 8, 设置为 1 时按页顺序请求")
+    parser.add_argument("--cache-ttl", type=int, default=0,
+                        help="域名解析记录本地快照缓存的有效期(秒), 默认值为 0 即不使用缓存; 启用后缓存未命中时需要拉取完整记录集")
+    parser.add_argument("--refresh", action="store_true",
+                        help="忽略本地快照缓存, 强制从 API 重新获取解析记录")
+    parser.add_argument("-j", "--jobs", type=int, default=4,
+                        help="执行 batch 动作时的并发行数, 默认值为 4, 设置为 1 时按 csv 顺序逐行执行")
+    parser.add_argument("-o", "--output", choices=("table", "jsonl", "csv", "tsv"), default="table",
+                        help="结果的输出格式, 默认值为 table, jsonl/csv/tsv 适合通过管道交给其他程序处理")
+    parser.add_argument("--qps", type=float, default=0,
+                        help="API 请求的 QPS 上限, 应不超过账号的 QPS 配额, 默认值为 0 即不限速")
+    parser.add_argument("--retries", type=int, default=5,
+                        help="遇到限流 (Throttling) 或临时性错误时的最大重试次数, 默认值为 5, 设置为 0 时不重试")
+    parser.add_argument("--stats", action="store_true",
+                        help="执行完毕后在 stderr 输出按 Action 分类的 API 调用次数, 延迟, 重试次数等统计信息")
+    parser.add_argument("--stats-file",
+                        help="执行完毕后将统计信息写入该文件, .prom 结尾时为 Prometheus 文本格式 (可供 node_exporter 读取), 否则为 JSON")
+    parser.add_argument("--minimal-calls", action="store_true",
+                        help="update 时直接使用查找 RecordId 时得到的现有记录, 且更新后不再重新读取记录, 以减少 API 调用")
+    parser.add_argument("--wait-propagation", action="store_true",
+                        help="add/update 成功后并发查询域名的所有权威 DNS 服务器, 直到都返回新的记录值, 超时则以状态码 1 退出")
+    parser.add_argument("--propagation-timeout", type=int, default=300,
+                        help="--wait-propagation 的最长等待时间(秒), 默认值为 300")
+    parser.add_argument("--nameservers", type=lambda value: value.split(","),
+                        help="逗号分隔的权威 DNS 服务器, 格式为 host[:port], 默认通过 DescribeDomainInfo 获取")
+    parser.add_argument("--socket",
+                        help="常驻服务 (-a daemon) 的 Unix socket 路径, 默认为配置文件所在目录下的 alidns.sock")
+    parser.add_argument("--no-daemon", action="store_true",
+                        help="常驻服务正在运行时也不转发 search/add/update/delete, 在当前进程中直接请求 API")
+
+    args = parser.parse_args()
+    # sync 按 -b 中的期望记录集调整 -d 指定的域名, batch 逐行执行 -b 中的操作, 缺少时在请求 API 之前退出
+    if args.action in ("batch", "sync") and args.batch is None:
+        parser.error("-a %s 需要通过 -b 指定 .csv 文件" % args.action)
+    if args.action == "sync" and not args.domain:
+        parser.error("-a sync 需要通过 -d 指定域名")
+    return args
+
+
+def init_zone_cache(config_file, ttl=0, refresh=False):
+    global zone_cache
+    if ttl <= 0:
+        zone_cache = None
+        return
+    # 快照单独保存在 cache/zones/ 下, 与 cache/ 下的账号路由, 值索引等文件分开
+    zone_cache = ZoneCache(os.path.join(cache_dir_of(config_file), "zones"), ttl, refresh)
+    atexit.register(zone_cache.flush)
+    return zone_cache
+
+
+def init_api_stats(print_summary=False, stats_file=None):
+    global api_stats
+    api_stats = ApiStats()
+
+    # 批量执行存在失败行时以 sys.exit(1) 退出, 统计信息同样需要输出
+    def report():
+        if print_summary:
+            sys.stderr.write(api_stats.summary())
+        if stats_file:
+            api_stats.dump(stats_file)
+
+    atexit.register(report)
+    return api_stats
 
 
 def main():
+    global output_format, minimal_calls, request_limiter, propagation_checks, batch_journal
     args = parse_args()
-    client = init_client(args.config)
+    output_format = args.output
+    minimal_calls = args.minimal_calls
+    propagation_checks = [] if args.wait_propagation else None
+    # 并发数从 --workers, --jobs 中的较大值开始, 遇到限流时减半, 之后逐步恢复
+    request_limiter = RequestLimiter(args.qps, max(args.workers, args.jobs), args.retries)
+    if args.stats or args.stats_file:
+        init_api_stats(args.stats, args.stats_file)
+    socket_path = args.socket or socket_path_of(args.config)
+    # 单条记录的 search/add/update/delete 优先交给常驻服务, 省去导入 SDK, 建立连接与拉取记录集的开销
+    if (args.action in ("search", "search:exact", "add", "update", "delete") and not args.batch
+            and not args.no_daemon and not local_only_options(args) and forward_to_daemon(socket_path, args)):
+        return
+    client_pool = init_client_pool(args.config, pool_size=max(args.workers, args.jobs, 10),
+                                   transport=args.transport, endpoint=args.endpoint, refresh=args.refresh)
+    # 批量模式下每一行按各自的域名路由到对应账号, 其余动作只涉及 -d 指定的单个域名
+    client = client_pool.get(args.domain, args.profile)
+    init_zone_cache(args.config, args.cache_ttl, args.refresh)
+
+    # daemon, 常驻服务, 保持已创建的 client, 连接池与本地快照, 直到收到 SIGTERM 或 Ctrl-C
+    if args.action == "daemon":
+        from opscat.alidns import daemon
+
+        # 以 python -m 运行时本模块为 __main__, 将已初始化的模块本身交给常驻服务
+        daemon.serve(socket_path, sys.modules[__name__], client if args.profile else client_pool, args.workers)
+        return
 
     # search, search:exact
     if args.action in ["search", "search:exact"]:
         mode = "EXACT" if args.action.endswith(":exact") else "LIKE"
-        records = get_domain_records(
-            client=client, domain=args.domain, mode=mode, keyword=args.keyword
+        records = iter_domain_records(
+            client=client, domain=args.domain, mode=mode, keyword=args.keyword, workers=args.workers
         )
         print_kv_list_results(records, results_type="records")
 
+    # search:global, 按记录值反查所有账号下所有域名中指向该值的记录
+    if args.action == "search:global":
+        index_file = os.path.join(cache_dir_of(args.config), "value-index.json")
+        value_index = None if args.refresh else ValueIndex.load(index_file, args.index_ttl)
+        if value_index is None:
+            value_index = build_value_index(client if args.profile else client_pool, args.jobs, args.workers)
+            value_index.save(index_file)
+        print_kv_list_results(value_index.lookup(args.keyword), results_type="global")
+
     # logs:domain, logs:record
-    if args.action == "logs:domain":
-        domain_logs = get_domain_logs(client, args.start_date, args.end_date)
+    if args.action in ["logs:domain", "logs:record"] and args.log_store:
+        # 增量同步到本地日志存储后, 按时间范围和操作类型在本地查询
+        scope = args.action.split(":")[1]
+        domain = args.domain if scope == "record" else ""
+        # 日志按 client 所属的账号分开保存, 与 client_pool.get() 的路由一致
+        account = client_pool.profile_of(args.domain, args.profile)
+        from opscat.alidns.log_store import LogStore
+
+        log_store = LogStore(os.path.join(cache_dir_of(args.config), "logs.sqlite3"))
+        inserted = sync_logs(client, log_store, account, scope, domain, args.start_date, args.workers)
+        sys.stderr.write("本次同步新增 %d 条操作日志\n" % inserted)
+        logs = log_store.query(account, scope, domain, args.start_date, args.end_date, args.log_action)
+        print_kv_list_results(logs, results_type="logs")
+        log_store.close()
+
+    elif args.action == "logs:domain":
+        domain_logs = iter_domain_logs(client, args.start_date, args.end_date, workers=args.workers)
         print_kv_list_results(domain_logs, results_type="logs")
 
-    if args.action == "logs:record":
-        record_logs = get_record_logs(
-            client, args.domain, args.start_date, args.end_date)
+    elif args.action == "logs:record":
+        record_logs = iter_record_logs(
+            client, args.domain, args.start_date, args.end_date, workers=args.workers)
         print_kv_list_results(record_logs, results_type="logs")
 
     # action batch and -b, --batch
@@ -477,12 +1592,72 @@ def main():
         batch_csv_headers = [
             "action", "domain", "type", "record", "line", "value", "priority", "ttl", "status", "remark"
         ]
-        batch_kwargs = csv_to_kv_list(args.batch, batch_csv_headers)
-    else:
-        batch_kwargs = [args.__dict__]
+        init_prompt_stream(args.batch)
+        # 标准输入, 管道, FIFO 等只能读取一次, 无法在执行前计算哈希, 也无法重新打开, 只有普通文件记录预写日志
+        regular_file = os.path.isfile(args.batch.name)
+        # 预写日志按输入文件内容的哈希命名
+        if regular_file:
+            from opscat.alidns.batch_journal import BatchJournal
+
+            batch_journal = BatchJournal.for_file(
+                os.path.join(cache_dir_of(args.config), "journals"), args.batch.name, args.resume)
+            if not args.resume and batch_journal.previous_completed:
+                print_info("该文件上一次批量执行中已完成 %d 行, 本次重新执行全部行; 可使用 --resume 跳过已完成的行"
+                           % batch_journal.previous_completed)
+        elif args.resume:
+            sys.stderr.write("从标准输入或管道读取时不记录预写日志, 无法使用 --resume, 将执行全部行\n")
+        batch_client = client if args.profile else client_pool
+        if regular_file:
+            # 普通文件流式读取两遍, 第一遍完成规划, 多条匹配时的交互式选择不会出现在执行过程中,
+            # 第二遍边读边执行, 内存中只保留 update/delete 行的规划结果而不是全部行
+            args.batch.close()
+            batch_kwargs = plan_batch(
+                batch_client, functools.partial(iter_csv_rows, args.batch.name, batch_csv_headers),
+                args.jobs, args.workers)
+        else:
+            # 标准输入, 管道等流式规划与执行, 上游仍在写入时已读到的行即可开始执行
+            batch_kwargs = iter_plan_batch(batch_client, iter_csv_rows(args.batch, batch_csv_headers), args.workers)
+        counter = print_batch_summary(iter_batch_execute(batch_client, batch_kwargs, args.jobs))
+        if batch_journal is not None:
+            batch_journal.close()
+        propagated = not args.wait_propagation or print_propagation_results(check_propagation(
+            batch_client, propagation_checks, args.propagation_timeout, args.nameservers))
+        if counter.get("failed") or not propagated:
+            sys.exit(1)
+        return
 
-    for kwargs in batch_kwargs:
-        add_update_delete(client, **kwargs)
+    # action sync, -b 为该域名的期望记录集 .csv 文件
+    if args.action == "sync":
+        desired_records = csv_to_kv_list(args.batch)
+        # 期望状态是 -d 指定域名的完整记录集, 混入其他域名的行多半是选错了文件, 不能忽略后继续同步
+        other_domains = [record for record in desired_records if record.get("domain")
+                         and normalize_domain(record.get("domain")) != normalize_domain(args.domain)]
+        if other_domains:
+            sys.stderr.write("期望状态文件中存在与 -d %s 不一致的域名, 已停止同步: %s\n" % (args.domain, ", ".join(
+                "line %s: %s" % (record.get("line_number"), record.get("domain")) for record in other_domains[:10])))
+            sys.exit(1)
+        # 空的期望状态会删除该域名下的全部记录
+        if not desired_records and not args.allow_empty:
+            sys.stderr.write("期望状态文件中没有任何记录, 同步将删除域名 %s 下的全部解析记录; "
+                             "确认需要时请指定 --allow-empty\n" % args.domain)
+            sys.exit(1)
+        init_prompt_stream(args.batch)
+        results = sync_zone(client, args.domain, desired_records, args.jobs, args.workers, args.yes)
+        if results:
+            print_batch_summary(results)
+        propagated = not args.wait_propagation or print_propagation_results(check_propagation(
+            client, propagation_checks, args.propagation_timeout, args.nameservers))
+        if any(result.get("Result") == "failed" for result in results) or not propagated:
+            sys.exit(1)
+        return
+
+    with count_api_calls() as calls:
+        record_id = add_update_delete(client, **args.__dict__)
+    if calls:
+        print_info("API 调用次数: %s" % format_api_calls(calls))
+    if args.wait_propagation and record_id and not print_propagation_results(check_propagation(
+            client, [propagation_check_of(args.__dict__)], args.propagation_timeout, args.nameservers)):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
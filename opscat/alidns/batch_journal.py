@@ -0,0 +1,85 @@
+# coding: utf-8
+# 批量执行的预写日志 (write-ahead journal): 每行执行前记录 pending, 执行后记录结果与 RecordId,
+# 以 JSON Lines 追加写入并 fsync, 进程被中断 (API 错误, Ctrl-C) 后可通过 --resume 跳过已完成的行
+# 日志文件按输入文件内容的 sha256 命名, 行以 csv 中的行号标识, 输入文件被修改后不会误用旧的日志
+
+import os
+import json
+import time
+import hashlib
+import threading
+
+
+def file_digest(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_completed(entry):
+    # 执行成功, 或无需执行而跳过 (不是因为前面的行失败而跳过) 的行
+    return entry.get("state") == "ok" or (entry.get("state") == "skipped" and not entry.get("error"))
+
+
+class BatchJournal:
+    def __init__(self, journal_file, resume=False):
+        self.journal_file = os.path.expanduser(journal_file)
+        if not os.path.exists(os.path.dirname(self.journal_file)):
+            os.makedirs(os.path.dirname(self.journal_file))
+        existing = self.load(self.journal_file)
+        # {行号: 该行最后一条日志}, 未指定 resume 时重新开始, 只统计上一次执行中已完成的行数用于提示
+        self.rows = existing if resume else {}
+        self.previous_completed = sum(1 for entry in existing.values() if is_completed(entry))
+        self.file = open(self.journal_file, "a" if resume else "w", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    @classmethod
+    def for_file(cls, journal_dir, input_file, resume=False):
+        return cls(os.path.join(journal_dir, "%s.jsonl" % file_digest(input_file)), resume)
+
+    @staticmethod
+    def load(journal_file):
+        rows = {}
+        try:
+            with open(journal_file, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 写入一半时被中断的最后一行
+                        continue
+                    rows[entry.get("row")] = entry
+        except IOError:
+            pass
+        return rows
+
+    def write(self, entry):
+        entry["time"] = round(time.time(), 3)
+        with self.lock:
+            self.rows[entry.get("row")] = entry
+            self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def begin(self, row, kwargs):
+        self.write({"row": row, "state": "pending", "action": kwargs.get("action"), "domain": kwargs.get("domain"),
+                    "type": kwargs.get("type"), "record": kwargs.get("record")})
+
+    def finish(self, row, result):
+        self.write({"row": row, "state": result.get("Result"), "record_id": result.get("RecordId"),
+                    "error": result.get("Error")})
+
+    def completed(self, row):
+        entry = self.rows.get(row)
+        if entry is not None and is_completed(entry):
+            return entry
+
+    def pending(self, row):
+        # 已发出请求但没有记录结果的行, 请求可能已经生效
+        entry = self.rows.get(row)
+        return entry is not None and entry.get("state") == "pending"
+
+    def close(self):
+        self.file.close()
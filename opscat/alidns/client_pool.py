@@ -0,0 +1,106 @@
+# coding: utf-8
+# 多账号 (profile) 的 Alidns client 池, 按域名自动路由到所属账号的 client
+
+import os
+import json
+import time
+import threading
+import concurrent.futures
+
+
+class LazyClient:
+    # 第一次访问 do_action_with_exception 等属性时才调用 factory 创建真正的 client
+    def __init__(self, factory):
+        self.factory = factory
+        self.client = None
+        self.lock = threading.Lock()
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client = self.factory()
+            return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+class ClientPool:
+    def __init__(self, clients, list_domains, route_file=None, route_ttl=86400, default_profile=None):
+        # clients: {profile: client}, client 可以是延迟创建的 LazyClient
+        # list_domains: 列出某个 client 所属账号下全部域名的函数, 返回 DescribeDomains 中的 Domain 列表
+        self.clients = clients
+        self.list_domains = list_domains
+        self.route_file = os.path.expanduser(route_file) if route_file else None
+        self.route_ttl = route_ttl
+        self.default_profile = default_profile or next(iter(clients))
+        self.routes = None
+        self.rebuilt = False
+        self.lock = threading.Lock()
+
+    def load_routes(self):
+        if not self.route_file or self.route_ttl <= 0:
+            return
+        try:
+            with open(self.route_file, encoding="utf-8") as f:
+                cached = json.loads(f.read())
+        except (IOError, ValueError):
+            return
+        # 配置文件中的 profile 有变化时路由表失效
+        if time.time() - cached.get("time", 0) > self.route_ttl \
+                or sorted(cached.get("profiles", [])) != sorted(self.clients):
+            return
+        return cached.get("routes")
+
+    def save_routes(self, routes):
+        if not self.route_file:
+            return
+        if not os.path.exists(os.path.dirname(self.route_file)):
+            os.makedirs(os.path.dirname(self.route_file))
+        with open("%s.tmp.%d" % (self.route_file, os.getpid()), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"time": time.time(), "profiles": sorted(self.clients), "routes": routes},
+                               ensure_ascii=False))
+        os.replace("%s.tmp.%d" % (self.route_file, os.getpid()), self.route_file)
+
+    def build_routes(self):
+        # 并发调用每个账号的 DescribeDomains, 构建 domain -> profile 映射
+        routes = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.clients)) as executor:
+            profiles = list(self.clients)
+            for profile, domains in zip(profiles, executor.map(
+                    lambda profile: self.list_domains(self.clients[profile]), profiles)):
+                for domain in domains:
+                    routes.setdefault(domain.get("DomainName"), profile)
+        self.save_routes(routes)
+        return routes
+
+    def route(self, domain):
+        with self.lock:
+            if self.routes is None:
+                self.routes = self.load_routes()
+            # 路由表中没有该域名时可能是新添加的域名, 每个进程最多重新构建一次路由表
+            if self.routes is None or (domain not in self.routes and not self.rebuilt):
+                self.routes = self.build_routes()
+                self.rebuilt = True
+            return self.routes.get(domain)
+
+    def domains(self):
+        # 返回全部账号下的 domain -> profile 映射
+        with self.lock:
+            if self.routes is None:
+                self.routes = self.load_routes()
+            if self.routes is None:
+                self.routes = self.build_routes()
+                self.rebuilt = True
+            return dict(self.routes)
+
+    def profile_of(self, domain=None, profile=None):
+        if profile:
+            return profile
+        # 只有一个账号时无需路由
+        if not domain or len(self.clients) == 1:
+            return self.default_profile
+        return self.route(domain) or self.default_profile
+
+    def get(self, domain=None, profile=None):
+        return self.clients[self.profile_of(domain, profile)]
@@ -0,0 +1,192 @@
+# coding: utf-8
+# 常驻的 alidns 服务: 保持已初始化的 client 与连接池, 通过 Unix socket 接收 JSON 请求,
+# 供 ACME DNS-01 hook, 部署脚本等频繁调用 alidns 的场景使用, 避免每次都启动新进程
+# 协议: 每行一个 JSON 请求, 每个请求对应一行 JSON 响应, 同一连接上可以发送多个请求
+#   请求: {"action": "search", "domain": "example.com", "keyword": "www"}
+#   响应: {"ok": true, "records": [...]} 或 {"ok": true, "record_id": "...", "api_calls": {...}}
+#         或 {"ok": false, "error": "..."}
+
+import os
+import sys
+import json
+import socket
+import signal
+import threading
+import socketserver
+import concurrent.futures
+
+from opscat.alidns.zone_cache import filter_records
+
+
+# 可以转发给常驻服务的动作, 其余动作 (batch, sync 等) 需要交互或读取本地文件, 仍在当前进程中执行
+FORWARD_ACTIONS = ("search", "search:exact", "add", "update", "delete")
+REQUEST_FIELDS = ("action", "domain", "keyword", "type", "record", "value", "remark", "status", "ttl",
+                  "priority", "record_id", "profile", "wait_propagation", "propagation_timeout", "nameservers")
+
+
+class SingleFlight:
+    # 相同 key 的并发调用只执行一次, 其余调用等待并共享同一个结果
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = concurrent.futures.Future()
+        if not leader:
+            return future.result()
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self.lock:
+                del self.calls[key]
+        return future.result()
+
+
+class AlidnsDaemon:
+    def __init__(self, alidns, client, workers=8):
+        # alidns: 已由 main() 完成初始化 (本地快照缓存, 限速等) 的 alidns 模块,
+        # 以 python -m opscat.alidns.alidns 运行时该模块为 __main__, 不能在这里重新 import
+        # client: ClientPool 或单个 client, 按请求中的 domain, profile 取得对应账号的 client
+        self.alidns = alidns
+        self.client = client
+        self.workers = workers
+        self.reads = SingleFlight()
+
+    def domain_records(self, client, domain, mode="LIKE", keyword=""):
+        # 启用本地快照 (--cache-ttl > 0) 时, 同一域名的并发读请求合并为一次完整记录集的拉取 (命中快照时不请求 API),
+        # 再各自在本地过滤; 否则按关键字在服务端查询, 不为一次查询拉取整个记录集, 相同条件的并发查询只请求一次
+        if self.alidns.zone_cache is None:
+            return self.reads.do((domain, mode, keyword), lambda: self.alidns.get_domain_records(
+                client, domain, mode, keyword, workers=self.workers))
+        records = self.reads.do(domain, lambda: self.alidns.get_domain_records(client, domain, workers=self.workers))
+        return list(filter_records(records, mode, keyword))
+
+    def handle(self, request):
+        action = request.get("action") or "search"
+        domain = request.get("domain")
+        if action not in FORWARD_ACTIONS:
+            raise ValueError("unsupported action: %s" % action)
+        if not domain:
+            raise ValueError("domain is required")
+        client = self.alidns.client_for(self.client, domain, request.get("profile"))
+
+        if action in ("search", "search:exact"):
+            mode = "EXACT" if action.endswith(":exact") else "LIKE"
+            return {"records": self.domain_records(client, domain, mode, request.get("keyword"))}
+
+        kwargs = {"ttl": 600, "priority": 1, "status": "Enable"}
+        kwargs.update((key, request.get(key)) for key in REQUEST_FIELDS if request.get(key) is not None)
+        # 查找记录的请求同样计入响应中的 api_calls
+        with self.alidns.count_api_calls() as calls:
+            # 常驻服务中无法交互式选择, 按 RR 匹配到多条记录时需要在请求中指定 record_id
+            if action in ("update", "delete") and kwargs.get("record_id") is None:
+                # EXACT 模式的 KeyWord 精确匹配 RR 或 Value, 查询结果在本地再按 RR (delete 时还有 Type) 比较
+                record_type = kwargs.get("type") if action == "delete" else None
+                matched = [record for record in self.domain_records(client, domain, "EXACT", kwargs.get("record"))
+                           if str(record.get("RR")).lower() == str(kwargs.get("record")).lower()
+                           and (not record_type or record.get("Type") == record_type)]
+                if len(matched) > 1:
+                    raise ValueError("按 RR:%s 条件查询到多条记录, 请指定 record_id: %s" % (
+                        kwargs.get("record"), ", ".join(str(record.get("RecordId")) for record in matched)))
+                # 唯一匹配的记录直接使用, add_update_delete() 不再按 RR 重复查询
+                if matched:
+                    kwargs["record_id"] = matched[0].get("RecordId")
+                    if self.alidns.minimal_calls:
+                        kwargs["record_info"] = matched[0]
+            record_id = self.alidns.add_update_delete(client, **kwargs)
+        if self.alidns.zone_cache is not None:
+            self.alidns.zone_cache.flush()
+        response = {"record_id": record_id, "api_calls": dict(calls)}
+        if kwargs.get("wait_propagation") and record_id:
+            response["propagation"] = self.alidns.check_propagation(
+                client, [self.alidns.propagation_check_of(kwargs)], kwargs.get("propagation_timeout") or 300,
+                kwargs.get("nameservers"))
+        return response
+
+
+class AlidnsRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = {"ok": True}
+                response.update(self.server.daemon.handle(json.loads(line.decode())))
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode())
+            self.wfile.flush()
+
+
+class AlidnsDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # 默认的 listen backlog 为 5, 并发的客户端较多时 connect 会失败并退回到在各自进程中执行
+    request_queue_size = 128
+
+    def __init__(self, socket_path, daemon):
+        self.daemon = daemon
+        self.socket_path = socket_path
+        if os.path.exists(socket_path):
+            # 上一次未正常退出时残留的 socket 文件
+            if ping(socket_path):
+                raise RuntimeError("alidns daemon is already running on %s" % socket_path)
+            os.remove(socket_path)
+        # socket 文件只允许当前用户访问, 与配置文件中的凭证权限保持一致
+        old_umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, socket_path, AlidnsRequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def serve(socket_path, alidns, client, workers=8):
+    socket_path = os.path.expanduser(socket_path)
+    if not os.path.exists(os.path.dirname(socket_path)):
+        os.makedirs(os.path.dirname(socket_path))
+    server = AlidnsDaemonServer(socket_path, AlidnsDaemon(alidns, client, workers))
+    # 收到 SIGTERM 时与 Ctrl-C 一样正常退出, 删除 socket 文件并写回本地快照
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write("alidns daemon listening on %s\n" % socket_path)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def request(socket_path, payload, timeout=60):
+    # 常驻服务未运行时返回 None, 调用方应退回到在当前进程中执行
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(os.path.expanduser(socket_path))
+    except OSError:
+        sock.close()
+        return
+    with sock, sock.makefile("rwb") as f:
+        f.write((json.dumps(payload, ensure_ascii=False) + "\n").encode())
+        f.flush()
+        line = f.readline()
+    return json.loads(line.decode()) if line else None
+
+
+def ping(socket_path):
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        sock.close()
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,465 @@
+#! /usr/bin/env python3
+# coding: utf-8
+# 本地的 Alidns API 替身服务, 用于在没有阿里云账号的环境 (如 CI) 中测试和压测 alidns
+# 实现了 alidns 用到的 RPC 接口, 支持注入延迟和限流错误, 不校验签名
+# 可选的替身权威 DNS 服务按设定的延迟发布解析记录, 用于测试 --wait-propagation
+# 用法: python3 -m opscat.alidns.fakeserver --port 8053 --zone example.com:10000 --latency 20 --qps 50
+#       alidns --endpoint http://127.0.0.1:8053 -d example.com -a search
+
+import json
+import time
+import uuid
+import random
+import struct
+import argparse
+import datetime
+import threading
+import collections
+import http.server
+import socketserver
+import urllib.parse
+
+from opscat.alidns import propagation
+from opscat.alidns.rate_limit import TokenBucket
+from opscat.alidns.zone_cache import filter_records
+
+
+def identity_of(record):
+    return record.get("DomainName"), record.get("RR"), record.get("Type"), record.get("Value")
+
+
+class FakeAlidnsError(Exception):
+    def __init__(self, code, message, http_status=400):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.http_status = http_status
+
+
+class FakeAlidns:
+    # 内存中的域名与解析记录, 接口的返回结构与 Alidns API 一致
+    def __init__(self):
+        # {domain: {RecordId: record}}, dict 保持插入顺序, 删除记录为 O(1)
+        self.zones = {}
+        self.records = {}
+        # (domain, RR, Type, Value) 的计数, 用于 O(1) 判断 DomainRecordDuplicate
+        self.identities = collections.Counter()
+        # 列表类请求使用的按插入顺序排列的记录列表, 有写操作时失效, 避免大量分页请求反复复制整个记录集
+        self.ordered = {}
+        self.logs = []
+        self.next_record_id = 1000000
+        # DescribeDomainInfo 返回的权威 DNS 服务器, 启动替身 DNS 服务时改为其地址
+        self.dns_servers = ["dns1.hichina.com", "dns2.hichina.com"]
+        # 域名下的记录变更后的回调, 如替身 DNS 服务重新发布该域名的记录
+        self.listeners = []
+        self.lock = threading.RLock()
+
+    def add_zone(self, domain, record_count=0, record_type="A"):
+        with self.lock:
+            self.zones.setdefault(domain, {})
+            for i in range(record_count):
+                self.insert_record(domain, "host-%d" % i, record_type, "10.%d.%d.%d" % (
+                    i // 65536 % 256, i // 256 % 256, i % 256), 600)
+        self.notify(domain)
+
+    def notify(self, domain):
+        for listener in self.listeners:
+            listener(domain)
+
+    def insert_record(self, domain, rr, resolv_type, value, ttl=600, priority=None):
+        with self.lock:
+            record = {
+                "DomainName": domain, "RecordId": str(self.next_record_id), "RR": rr, "Type": resolv_type,
+                "Value": value, "TTL": int(ttl), "Line": "default", "Status": "ENABLE", "Locked": False,
+                "Weight": 1, "Remark": "",
+            }
+            if resolv_type == "MX":
+                record["Priority"] = int(priority or 1)
+            self.next_record_id += 1
+            self.zones[domain][record.get("RecordId")] = record
+            self.records[record.get("RecordId")] = record
+            self.identities[identity_of(record)] += 1
+            self.ordered.pop(domain, None)
+            return record
+
+    def remove_record(self, record):
+        with self.lock:
+            del self.zones[record.get("DomainName")][record.get("RecordId")]
+            del self.records[record.get("RecordId")]
+            self.identities[identity_of(record)] -= 1
+            self.ordered.pop(record.get("DomainName"), None)
+
+    def log(self, domain, action, message):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.logs.append({"DomainName": domain, "ActionTime": now.strftime("%Y-%m-%dT%H:%MZ"),
+                          "ActionTimestamp": int(now.timestamp() * 1000), "Action": action,
+                          "Message": message, "ClientIp": "127.0.0.1"})
+
+    def zone_of(self, domain):
+        if domain not in self.zones:
+            raise FakeAlidnsError("InvalidDomainName.NoExist", "The specified domain name does not exist.")
+        if domain not in self.ordered:
+            self.ordered[domain] = list(self.zones[domain].values())
+        return self.ordered[domain]
+
+    def record_of(self, record_id):
+        if str(record_id) not in self.records:
+            raise FakeAlidnsError("DomainRecordNotBelongToUser", "The DNS record does not exist.")
+        return self.records[str(record_id)]
+
+    def check_duplicate(self, domain, rr, resolv_type, value):
+        self.zone_of(domain)
+        if self.identities[(domain, rr, resolv_type, value)] > 0:
+            raise FakeAlidnsError("DomainRecordDuplicate", "The DNS record already exists.")
+
+    @staticmethod
+    def page(items, params):
+        page_number = int(params.get("PageNumber") or 1)
+        page_size = int(params.get("PageSize") or 20)
+        if page_size > 500:
+            raise FakeAlidnsError("InvalidPageSize", "The specified PageSize is invalid.")
+        return page_number, page_size, items[(page_number - 1) * page_size:page_number * page_size]
+
+    def DescribeDomains(self, params):
+        with self.lock:
+            domains = [{"DomainName": domain, "DomainId": domain, "RecordCount": len(records)}
+                       for domain, records in sorted(self.zones.items())]
+        page_number, page_size, page = self.page(domains, params)
+        return {"TotalCount": len(domains), "PageNumber": page_number, "PageSize": page_size,
+                "Domains": {"Domain": page}}
+
+    def DescribeDomainRecords(self, params):
+        with self.lock:
+            records = self.zone_of(params.get("DomainName"))
+            if params.get("KeyWord") or params.get("RRKeyWord") or params.get("TypeKeyWord") \
+                    or params.get("ValueKeyWord"):
+                records = list(filter_records(
+                    records, params.get("SearchMode") or "LIKE", params.get("KeyWord"), params.get("RRKeyWord"),
+                    params.get("TypeKeyWord"), params.get("ValueKeyWord")))
+        if params.get("Type"):
+            records = [record for record in records if record.get("Type") == params.get("Type")]
+        page_number, page_size, page = self.page(records, params)
+        return {"TotalCount": len(records), "PageNumber": page_number, "PageSize": page_size,
+                "DomainRecords": {"Record": [dict(record) for record in page]}}
+
+    def DescribeDomainInfo(self, params):
+        with self.lock:
+            records = self.zone_of(params.get("DomainName"))
+            return {"DomainName": params.get("DomainName"), "DomainId": params.get("DomainName"),
+                    "RecordCount": len(records), "DnsServers": {"DnsServer": list(self.dns_servers)}}
+
+    def DescribeDomainRecordInfo(self, params):
+        with self.lock:
+            return dict(self.record_of(params.get("RecordId")))
+
+    def AddDomainRecord(self, params):
+        domain = params.get("DomainName")
+        with self.lock:
+            self.check_duplicate(domain, params.get("RR"), params.get("Type"), params.get("Value"))
+            record = self.insert_record(domain, params.get("RR"), params.get("Type"), params.get("Value"),
+                                        params.get("TTL") or 600, params.get("Priority"))
+            self.log(domain, "ADD", "Add resolution record. %s %s %s" % (
+                record.get("Type"), record.get("RR"), record.get("Value")))
+        self.notify(domain)
+        return {"RecordId": record.get("RecordId")}
+
+    def UpdateDomainRecord(self, params):
+        with self.lock:
+            record = self.record_of(params.get("RecordId"))
+            fields = {"RR": params.get("RR"), "Type": params.get("Type"),
+                      "Value": params.get("Value") or record.get("Value"),
+                      "TTL": int(params.get("TTL") or record.get("TTL"))}
+            if params.get("Priority"):
+                fields["Priority"] = int(params.get("Priority"))
+            if all(record.get(key) == value for key, value in fields.items()):
+                raise FakeAlidnsError("DomainRecordDuplicate", "The DNS record already exists.")
+            if (fields.get("RR"), fields.get("Type"), fields.get("Value")) != identity_of(record)[1:]:
+                self.check_duplicate(record.get("DomainName"), fields.get("RR"), fields.get("Type"),
+                                     fields.get("Value"))
+            self.identities[identity_of(record)] -= 1
+            record.update(fields)
+            self.identities[identity_of(record)] += 1
+            self.ordered.pop(record.get("DomainName"), None)
+            self.log(record.get("DomainName"), "UPDATE", "Modify resolution record. %s %s %s" % (
+                record.get("Type"), record.get("RR"), record.get("Value")))
+        self.notify(record.get("DomainName"))
+        return {"RecordId": record.get("RecordId")}
+
+    def UpdateDomainRecordRemark(self, params):
+        with self.lock:
+            self.record_of(params.get("RecordId"))["Remark"] = params.get("Remark") or ""
+        return {}
+
+    def SetDomainRecordStatus(self, params):
+        status = (params.get("Status") or "").upper()
+        if status not in ("ENABLE", "DISABLE"):
+            raise FakeAlidnsError("InvalidStatus", "The specified Status is invalid.")
+        with self.lock:
+            record = self.record_of(params.get("RecordId"))
+            record["Status"] = status
+            self.log(record.get("DomainName"), status, "%s resolution record. %s %s %s" % (
+                status.capitalize(), record.get("Type"), record.get("RR"), record.get("Value")))
+        self.notify(record.get("DomainName"))
+        return {"RecordId": record.get("RecordId"), "Status": params.get("Status")}
+
+    def DeleteDomainRecord(self, params):
+        with self.lock:
+            record = self.record_of(params.get("RecordId"))
+            self.remove_record(record)
+            self.log(record.get("DomainName"), "DEL", "Delete resolution record. %s %s %s" % (
+                record.get("Type"), record.get("RR"), record.get("Value")))
+        self.notify(record.get("DomainName"))
+        return {"RecordId": record.get("RecordId")}
+
+    def DeleteSubDomainRecords(self, params):
+        domain = params.get("DomainName")
+        with self.lock:
+            deleted = [record for record in self.zone_of(domain) if record.get("RR") == params.get("RR")
+                       and (not params.get("Type") or record.get("Type") == params.get("Type"))]
+            for record in deleted:
+                self.remove_record(record)
+                self.log(domain, "DEL", "Delete resolution record. %s %s %s" % (
+                    record.get("Type"), record.get("RR"), record.get("Value")))
+        self.notify(domain)
+        return {"RR": params.get("RR"), "TotalCount": len(deleted)}
+
+    def describe_logs(self, params, domain=None):
+        with self.lock:
+            logs = [log for log in reversed(self.logs) if domain is None or log.get("DomainName") == domain]
+        start_date, end_date = params.get("StartDate"), params.get("endDate") or params.get("EndDate")
+        logs = [log for log in logs if (not start_date or log.get("ActionTime")[:10] >= start_date)
+                and (not end_date or log.get("ActionTime")[:10] <= end_date)]
+        # 与真实接口一致, TotalCount 为按日期过滤后的日志数
+        return (len(logs),) + self.page(logs, params)
+
+    def DescribeDomainLogs(self, params):
+        total_count, page_number, page_size, page = self.describe_logs(params)
+        logs = [{key: log.get(key) for key in ("ActionTime", "ActionTimestamp", "DomainName",
+                                               "Action", "Message", "ClientIp")} for log in page]
+        return {"TotalCount": total_count, "PageNumber": page_number, "PageSize": page_size,
+                "DomainLogs": {"DomainLog": logs}}
+
+    def DescribeRecordLogs(self, params):
+        domain = params.get("DomainName")
+        self.zone_of(domain)
+        total_count, page_number, page_size, page = self.describe_logs(params, domain)
+        logs = [{key: log.get(key) for key in ("ActionTime", "ActionTimestamp", "Action", "Message", "ClientIp")}
+                for log in page]
+        return {"TotalCount": total_count, "PageNumber": page_number, "PageSize": page_size,
+                "RecordLogs": {"RecordLog": logs}}
+
+    def handle(self, params):
+        action = params.get("Action")
+        if action not in ACTIONS:
+            raise FakeAlidnsError("InvalidAction.NotFound", "Specified api is not found, please check your url.",
+                                  http_status=404)
+        return getattr(self, action)(params)
+
+
+ACTIONS = (
+    "DescribeDomains", "DescribeDomainInfo", "DescribeDomainRecords", "DescribeDomainRecordInfo",
+    "DescribeDomainLogs", "DescribeRecordLogs", "AddDomainRecord", "UpdateDomainRecord", "UpdateDomainRecordRemark",
+    "SetDomainRecordStatus", "DeleteDomainRecord", "DeleteSubDomainRecords",
+)
+
+
+class FakeAlidnsHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与 body 分两次写入, 不关闭 Nagle 算法时 keep-alive 连接上的每个请求都会额外等待 delayed ACK (约 40ms)
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query, keep_blank_values=True))
+        # SDK 的 RPC 请求参数在 URL 中, 这里同时兼容放在 form body 中的参数
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            params.update(urllib.parse.parse_qsl(self.rfile.read(length).decode(), keep_blank_values=True))
+        request_id = str(uuid.uuid4()).upper()
+
+        server = self.server
+        if server.latency > 0:
+            time.sleep(max(0, random.gauss(server.latency, server.latency * server.jitter)) / 1000)
+        try:
+            if server.bucket is not None and not server.try_acquire():
+                raise FakeAlidnsError("Throttling.User", "Request was denied due to user flow control.")
+            if server.throttle_rate > 0 and random.random() < server.throttle_rate:
+                raise FakeAlidnsError("Throttling.User", "Request was denied due to user flow control.")
+            body = server.alidns.handle(params)
+            body["RequestId"] = request_id
+            status = 200
+        except FakeAlidnsError as e:
+            body = {"RequestId": request_id, "HostId": "alidns.aliyuncs.com", "Code": e.code, "Message": e.message}
+            status = e.http_status
+        with server.lock:
+            server.requests[params.get("Action")] += 1
+
+        content = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeAlidnsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), alidns=None, latency=0, jitter=0.2,
+                 qps=0, throttle_rate=0, verbose=False):
+        # latency: 每个请求的平均延迟(毫秒), jitter 为其标准差与平均值之比
+        # qps: 超过该 QPS 的请求返回 Throttling.User; throttle_rate: 按该比例随机返回 Throttling.User
+        http.server.ThreadingHTTPServer.__init__(self, address, FakeAlidnsHandler)
+        self.alidns = alidns or FakeAlidns()
+        self.latency = latency
+        self.jitter = jitter
+        self.bucket = TokenBucket(qps) if qps > 0 else None
+        self.throttle_rate = throttle_rate
+        self.verbose = verbose
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def try_acquire(self):
+        # 与 TokenBucket.acquire() 不同, 令牌不足时不等待而是直接拒绝
+        bucket = self.bucket
+        with bucket.lock:
+            now = time.monotonic()
+            bucket.tokens = min(bucket.capacity, bucket.tokens + (now - bucket.updated) * bucket.rate)
+            bucket.updated = now
+            if bucket.tokens < 1:
+                return False
+            bucket.tokens -= 1
+            return True
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-alidns", daemon=True).start()
+        return self
+
+
+class FakeDnsHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        query, sock = self.request
+        try:
+            message = propagation.parse_message(query)
+            name, type_code = message.get("questions")[0]
+        except (ValueError, IndexError, struct.error):
+            return
+        sock.sendto(self.server.answer(query, name, propagation.TYPE_NAMES.get(type_code)), self.client_address)
+
+
+class FakeDnsServer(socketserver.ThreadingUDPServer):
+    # 替身权威 DNS 服务: 按 FakeAlidns 中启用状态的记录应答, 记录变更 delay 秒后才对外可见,
+    # 多个 delay 不同的实例可以模拟各个权威服务器生效时间不一致的情况
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), alidns=None, delay=0):
+        socketserver.ThreadingUDPServer.__init__(self, address, FakeDnsHandler)
+        self.alidns = alidns or FakeAlidns()
+        self.delay = delay
+        # {domain: {name: [(Type, TTL, rdata)]}}, 已对外发布的记录
+        self.published = {}
+        self.queries = collections.Counter()
+        self.lock = threading.Lock()
+        for domain in list(self.alidns.zones):
+            self.publish(domain)
+        self.alidns.listeners.append(self.changed)
+
+    @property
+    def nameserver(self):
+        return "%s:%d" % self.server_address[:2]
+
+    def changed(self, domain):
+        if self.delay <= 0:
+            self.publish(domain)
+            return
+        # 发布时读取的是当时的记录, 延迟期间的后续变更会随之提前发布, 作为替身已足够
+        timer = threading.Timer(self.delay, self.publish, (domain,))
+        timer.daemon = True
+        timer.start()
+
+    def publish(self, domain):
+        names = collections.defaultdict(list)
+        with self.alidns.lock:
+            records = list(self.alidns.zones.get(domain, {}).values())
+        for record in records:
+            if record.get("Status") != "ENABLE" or record.get("Type") in propagation.UNCHECKABLE_TYPES:
+                continue
+            name = propagation.fqdn_of(domain, record.get("RR")).lower()
+            names[name].append((record.get("Type"), record.get("TTL"), propagation.encode_rdata(
+                record.get("Type"), record.get("Value"), record.get("Priority"))))
+        with self.lock:
+            self.published[domain] = dict(names)
+
+    def answer(self, query, name, resolv_type):
+        with self.lock:
+            self.queries[resolv_type] += 1
+            zones = [domain for domain in self.published if name == domain or name.endswith("." + domain)]
+            if not zones:
+                return propagation.build_response(query, propagation.RCODE_REFUSED)
+            names = self.published.get(max(zones, key=len))
+        if name not in names:
+            return propagation.build_response(query, propagation.RCODE_NXDOMAIN)
+        # 同名的 CNAME 记录优先于其他类型, 与权威服务器的行为一致
+        answers = [answer for answer in names.get(name) if answer[0] == resolv_type] or \
+                  [answer for answer in names.get(name) if answer[0] == "CNAME"]
+        return propagation.build_response(query, answers=answers)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-dns", daemon=True).start()
+        return self
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地的 Alidns API 替身服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址, 默认值为 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8053, help="监听端口, 默认值为 8053")
+    parser.add_argument("-z", "--zone", action="append", default=[],
+                        help="预置的域名及记录数, 格式为 domain[:count], 可多次指定, 如 -z example.com:10000")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的平均延迟(毫秒), 默认值为 0")
+    parser.add_argument("--jitter", type=float, default=0.2, help="延迟的标准差与平均值之比, 默认值为 0.2")
+    parser.add_argument("--qps", type=float, default=0,
+                        help="超过该 QPS 的请求返回 Throttling.User 错误, 默认值为 0 即不限流")
+    parser.add_argument("--throttle-rate", type=float, default=0,
+                        help="按该比例随机返回 Throttling.User 错误, 如 0.05, 默认值为 0")
+    parser.add_argument("--dns-port", type=int, default=0,
+                        help="同时启动替身权威 DNS 服务 (UDP) 的起始端口, 默认值为 0 即不启动")
+    parser.add_argument("--dns-delay", default="0",
+                        help="逗号分隔的各个替身 DNS 服务的记录生效延迟(秒), 每个值启动一个实例, "
+                             "端口从 --dns-port 起依次递增, 如 0,2,5")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每个请求的访问日志")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    alidns = FakeAlidns()
+    for zone in args.zone or ["example.com:100"]:
+        domain, _, count = zone.partition(":")
+        alidns.add_zone(domain, int(count or 0))
+    if args.dns_port:
+        # DescribeDomainInfo 返回替身 DNS 服务的地址, alidns --wait-propagation 会直接查询这些地址
+        dns_servers = [FakeDnsServer((args.host, args.dns_port + i), alidns, float(delay)).start()
+                       for i, delay in enumerate(args.dns_delay.split(","))]
+        alidns.dns_servers = [dns_server.nameserver for dns_server in dns_servers]
+        print("fake dns listening on %s" % ", ".join(alidns.dns_servers))
+    server = FakeAlidnsServer((args.host, args.port), alidns, args.latency, args.jitter,
+                              args.qps, args.throttle_rate, args.verbose)
+    print("fake alidns listening on %s, zones: %s" % (server.endpoint, ", ".join(
+        "%s(%d)" % (domain, len(records)) for domain, records in sorted(alidns.zones.items()))))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
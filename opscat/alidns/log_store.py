@@ -0,0 +1,88 @@
+# coding: utf-8
+# 域名/解析记录操作日志的本地 SQLite 存储, 支持按高水位增量同步
+
+import os
+import sqlite3
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    action_time TEXT NOT NULL,
+    action_timestamp INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    message TEXT NOT NULL,
+    client_ip TEXT NOT NULL,
+    UNIQUE (account, scope, domain, action_timestamp, action_time, action, message, client_ip)
+);
+CREATE INDEX IF NOT EXISTS logs_domain_time ON logs (account, scope, domain, action_time);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    high_water_mark TEXT NOT NULL,
+    PRIMARY KEY (account, scope, domain)
+);
+"""
+
+
+class LogStore:
+    # scope 为 domain 时对应 DescribeDomainLogs, 为 record 时对应 DescribeRecordLogs
+    # account 为配置文件中的账号 (profile), 不同账号下同名域名的日志与高水位分开保存
+    def __init__(self, db_file):
+        db_file = os.path.expanduser(db_file)
+        if not os.path.exists(os.path.dirname(db_file)):
+            os.makedirs(os.path.dirname(db_file))
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(SCHEMA)
+
+    def high_water_mark(self, account, scope, domain=""):
+        row = self.conn.execute(
+            "SELECT high_water_mark FROM sync_state WHERE account = ? AND scope = ? AND domain = ?",
+            (account, scope, domain)).fetchone()
+        return row[0] if row else None
+
+    def append(self, account, scope, domain, logs):
+        # 只追加, 已存在的日志会被忽略, 返回新写入的条数
+        # ActionTime 只精确到分钟, 以毫秒级的 ActionTimestamp 加上整行内容判断是否重复
+        high_water_mark = self.high_water_mark(account, scope, domain) or ""
+        inserted = 0
+        with self.conn:
+            for log in logs:
+                cursor = self.conn.execute(
+                    "INSERT OR IGNORE INTO logs "
+                    "(account, scope, domain, action_time, action_timestamp, action, message, client_ip) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (account, scope, domain, log.get("ActionTime"), log.get("ActionTimestamp") or 0,
+                     log.get("Action") or "", log.get("Message") or "", log.get("ClientIp") or ""))
+                inserted += cursor.rowcount
+                high_water_mark = max(high_water_mark, log.get("ActionTime") or "")
+            if high_water_mark:
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO sync_state (account, scope, domain, high_water_mark) VALUES (?, ?, ?, ?)",
+                    (account, scope, domain, high_water_mark))
+        return inserted
+
+    def query(self, account, scope, domain="", start_date=None, end_date=None, action=None):
+        # ActionTime 格式为 2015-12-12T09:23Z, 与 YYYY-mm-dd 格式的日期可以直接按字符串比较
+        sql = ("SELECT action_time, action, message, client_ip FROM logs "
+               "WHERE account = ? AND scope = ? AND domain = ?")
+        params = [account, scope, domain]
+        if start_date:
+            sql += " AND substr(action_time, 1, 10) >= ?"
+            params.append(start_date)
+        if end_date:
+            sql += " AND substr(action_time, 1, 10) <= ?"
+            params.append(end_date)
+        if action:
+            sql += " AND lower(action) = lower(?)"
+            params.append(action)
+        sql += " ORDER BY action_time DESC, action_timestamp DESC, id DESC"
+        for action_time, action, message, client_ip in self.conn.execute(sql, params):
+            yield {"ActionTime": action_time, "Action": action, "Message": message, "ClientIp": client_ip}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,280 @@
+# coding: utf-8
+# 写操作后的 DNS 生效检查: 直接向域名的各个权威 DNS 服务器并发发送 UDP 查询 (asyncio),
+# 直到所有服务器都返回新的记录值或超时, 代替固定时长的 sleep
+# 同时提供最小的 DNS 报文编解码, 本地的替身 DNS 服务 (opscat.alidns.fakeserver) 也使用这里的编码函数
+
+import random
+import socket
+import struct
+import asyncio
+import ipaddress
+
+
+TYPE_CODES = {"A": 1, "NS": 2, "CNAME": 5, "MX": 15, "TXT": 16, "AAAA": 28, "SRV": 33, "CAA": 257}
+TYPE_NAMES = {code: name for name, code in TYPE_CODES.items()}
+# 显性/隐性 URL 转发记录在 DNS 上表现为转发服务器的 A 记录, 无法按记录值检查
+UNCHECKABLE_TYPES = ("REDIRECT_URL", "FORWARD_URL")
+CLASS_IN = 1
+TYPE_OPT = 41
+RCODE_NOERROR, RCODE_NXDOMAIN, RCODE_REFUSED = 0, 3, 5
+FLAG_QR, FLAG_AA, FLAG_RD = 0x8000, 0x0400, 0x0100
+
+
+def fqdn_of(domain, resolv_record):
+    return domain if resolv_record in ("@", "", None) else "%s.%s" % (resolv_record, domain)
+
+
+def encode_name(name):
+    name = name.rstrip(".")
+    if not name:
+        return b"\x00"
+    data = name.encode("ascii") if name.isascii() else name.encode("idna")
+    return b"".join(struct.pack("B", len(label)) + label for label in data.split(b".")) + b"\x00"
+
+
+def decode_name(message, offset):
+    # 返回 (name, 名称之后的偏移), 支持压缩指针
+    labels, end = [], None
+    for _ in range(128):
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack(">H", message[offset:offset + 2])[0] & 0x3FFF
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset + length].decode("ascii", "replace"))
+        offset += length
+    else:
+        raise ValueError("DNS name compression loop")
+    return ".".join(labels).lower(), end if end is not None else offset
+
+
+def build_query(query_id, name, resolv_type):
+    # 权威服务器不做递归, RD 置 0; 附带 EDNS0 OPT 记录声明 4096 字节的 UDP 报文, 避免较长的 TXT 记录被截断
+    header = struct.pack(">HHHHHH", query_id, 0, 1, 0, 0, 1)
+    question = encode_name(name) + struct.pack(">HH", TYPE_CODES[resolv_type], CLASS_IN)
+    opt = b"\x00" + struct.pack(">HHIH", TYPE_OPT, 4096, 0, 0)
+    return header + question + opt
+
+
+def encode_rdata(resolv_type, value, priority=None):
+    value = str(value)
+    if resolv_type == "A":
+        return socket.inet_pton(socket.AF_INET, value)
+    if resolv_type == "AAAA":
+        return socket.inet_pton(socket.AF_INET6, value)
+    if resolv_type in ("CNAME", "NS"):
+        return encode_name(value)
+    if resolv_type == "MX":
+        return struct.pack(">H", int(priority or 1)) + encode_name(value)
+    if resolv_type == "TXT":
+        data = value.encode()
+        return b"".join(struct.pack("B", len(data[i:i + 255])) + data[i:i + 255]
+                        for i in range(0, max(len(data), 1), 255))
+    if resolv_type == "SRV":
+        srv_priority, weight, port, target = value.split()
+        return struct.pack(">HHH", int(srv_priority), int(weight), int(port)) + encode_name(target)
+    if resolv_type == "CAA":
+        flags, tag, caa_value = value.split(None, 2)
+        return struct.pack("BB", int(flags), len(tag)) + tag.encode() + caa_value.strip('"').encode()
+    raise ValueError("unsupported record type: %s" % resolv_type)
+
+
+def decode_rdata(message, offset, length, type_code):
+    # 解码为与 Alidns 记录值相同的文本格式
+    rdata = message[offset:offset + length]
+    if type_code == TYPE_CODES["A"]:
+        return socket.inet_ntop(socket.AF_INET, rdata)
+    if type_code == TYPE_CODES["AAAA"]:
+        return socket.inet_ntop(socket.AF_INET6, rdata)
+    if type_code in (TYPE_CODES["CNAME"], TYPE_CODES["NS"]):
+        return decode_name(message, offset)[0]
+    if type_code == TYPE_CODES["MX"]:
+        return decode_name(message, offset + 2)[0]
+    if type_code == TYPE_CODES["TXT"]:
+        chunks, i = [], 0
+        while i < len(rdata):
+            chunks.append(rdata[i + 1:i + 1 + rdata[i]])
+            i += 1 + rdata[i]
+        return b"".join(chunks).decode("utf-8", "replace")
+    if type_code == TYPE_CODES["SRV"]:
+        srv_priority, weight, port = struct.unpack(">HHH", rdata[:6])
+        return "%d %d %d %s" % (srv_priority, weight, port, decode_name(message, offset + 6)[0])
+    if type_code == TYPE_CODES["CAA"]:
+        flags, tag_length = rdata[0], rdata[1]
+        return '%d %s "%s"' % (flags, rdata[2:2 + tag_length].decode(), rdata[2 + tag_length:].decode())
+    return rdata.hex()
+
+
+def parse_message(message):
+    query_id, flags, qdcount, ancount = struct.unpack(">HHHH", message[:8])
+    offset = 12
+    questions, answers = [], []
+    for _ in range(qdcount):
+        name, offset = decode_name(message, offset)
+        type_code = struct.unpack(">H", message[offset:offset + 2])[0]
+        questions.append((name, type_code))
+        offset += 4
+    for _ in range(ancount):
+        name, offset = decode_name(message, offset)
+        type_code, _, ttl, length = struct.unpack(">HHIH", message[offset:offset + 10])
+        offset += 10
+        answers.append((name, TYPE_NAMES.get(type_code, str(type_code)), ttl,
+                        decode_rdata(message, offset, length, type_code)))
+        offset += length
+    return {"id": query_id, "flags": flags, "rcode": flags & 0x0F, "questions": questions, "answers": answers}
+
+
+def build_response(query, rcode=RCODE_NOERROR, answers=()):
+    # answers: [(type, ttl, rdata)], 名称均以压缩指针指向问题中的名称
+    query_id, flags = struct.unpack(">HH", query[:4])
+    _, question_end = decode_name(query, 12)
+    question = query[12:question_end + 4]
+    flags = FLAG_QR | FLAG_AA | (flags & FLAG_RD) | rcode
+    records = b"".join(b"\xc0\x0c" + struct.pack(">HHIH", TYPE_CODES[resolv_type], CLASS_IN, ttl, len(rdata)) + rdata
+                       for resolv_type, ttl, rdata in answers)
+    return struct.pack(">HHHHHH", query_id, flags, 1, len(answers), 0, 0) + question + records
+
+
+def normalize_answer(resolv_type, value):
+    value = str(value).strip()
+    if resolv_type in ("A", "AAAA"):
+        try:
+            return str(ipaddress.ip_address(value))
+        except ValueError:
+            return value
+    if resolv_type in ("CNAME", "NS", "MX"):
+        return value.lower().rstrip(".")
+    if resolv_type == "SRV":
+        return " ".join(value.lower().rstrip(".").split())
+    if resolv_type == "CAA":
+        flags, tag, caa_value = (value.split(None, 2) + ["", ""])[:3]
+        return "%s %s %s" % (flags, tag.lower(), caa_value.strip('"'))
+    return value
+
+
+def parse_nameserver(nameserver):
+    # 权威服务器可以写作 host 或 host:port, 如 dns9.hichina.com, 127.0.0.1:5353
+    host, sep, port = nameserver.rpartition(":")
+    if sep and port.isdigit() and ":" not in host:
+        return host, int(port)
+    return nameserver, 53
+
+
+class DnsClientProtocol(asyncio.DatagramProtocol):
+    # 每个权威服务器地址一个 UDP socket, 按报文 ID 将响应分发给对应的查询
+    def __init__(self):
+        self.transport = None
+        self.waiters = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        waiter = self.waiters.pop(struct.unpack(">H", data[:2])[0], None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(data)
+
+    def error_received(self, exc):
+        # 如 ICMP 端口不可达, 无法确定对应哪个查询, 让在途的查询都失败, 下一轮重新查询
+        for waiter in self.waiters.values():
+            if not waiter.done():
+                waiter.set_exception(exc)
+        self.waiters.clear()
+
+    async def query(self, name, resolv_type, timeout=2):
+        query_id = random.getrandbits(16)
+        while query_id in self.waiters:
+            query_id = random.getrandbits(16)
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[query_id] = waiter
+        self.transport.sendto(build_query(query_id, name, resolv_type))
+        try:
+            response = parse_message(await asyncio.wait_for(waiter, timeout))
+        finally:
+            self.waiters.pop(query_id, None)
+        if response.get("questions")[:1] != [(name.lower().rstrip("."), TYPE_CODES[resolv_type])]:
+            raise ValueError("unexpected DNS response for %s" % name)
+        return response
+
+
+async def resolve_nameservers(nameservers):
+    # 返回 [(label, (ip, port), error)], 一个权威服务器域名解析出多个 IPv4 地址时分别检查
+    # 无法解析的权威服务器 address 为 None, error 为解析失败的原因, 不影响其余服务器的检查
+    loop = asyncio.get_running_loop()
+
+    async def resolve(nameserver):
+        host, port = parse_nameserver(nameserver)
+        try:
+            infos = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+        except socket.gaierror as e:
+            return [(nameserver, None, str(e))]
+        addresses = list(dict.fromkeys(info[4][:2] for info in infos))
+        return [(nameserver if len(addresses) == 1 and host == address[0] else "%s(%s)" % (nameserver, address[0]),
+                 address, "") for address in addresses]
+
+    resolved = await asyncio.gather(*(resolve(nameserver) for nameserver in nameservers))
+    return [server for servers in resolved for server in servers]
+
+
+async def check_propagation(checks, domain_nameservers, timeout=300, interval=2, query_timeout=2):
+    # checks: [(domain, RR, Type, Value)], domain_nameservers: {domain: [权威服务器]}
+    # 每一轮并发查询所有尚未生效的 (记录, 服务器) 组合, 返回每个组合的检查结果
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    deadline = start + timeout
+    servers = {domain: await resolve_nameservers(nameservers) for domain, nameservers in domain_nameservers.items()}
+    endpoints = {}
+    results = {}
+    pending = []
+    for check in checks:
+        domain, resolv_record, resolv_type, value = check
+        for label, address, error in servers.get(domain):
+            results[(check, label)] = {
+                "Domain": domain, "RR": resolv_record, "Type": resolv_type, "Value": value,
+                "Nameserver": label, "Result": "timeout", "Elapsed": "", "Answer": "",
+            }
+            if address is None:
+                results[(check, label)].update(Result="unresolvable", Answer=error)
+                continue
+            pending.append((check, label, address))
+
+    async def probe(check, label, address):
+        domain, resolv_record, resolv_type, value = check
+        result = results[(check, label)]
+        try:
+            response = await endpoints[address].query(fqdn_of(domain, resolv_record), resolv_type, query_timeout)
+        except (OSError, ValueError, asyncio.TimeoutError) as e:
+            result["Answer"] = str(e) or type(e).__name__
+            return False
+        answers = [answer for _, answer_type, _, answer in response.get("answers") if answer_type == resolv_type]
+        result["Answer"] = ", ".join(answers) or ("NXDOMAIN" if response.get("rcode") == RCODE_NXDOMAIN else "-")
+        if normalize_answer(resolv_type, value) in [normalize_answer(resolv_type, answer) for answer in answers]:
+            result["Result"] = "ok"
+            result["Elapsed"] = "%.3f" % (loop.time() - start)
+            return True
+        return False
+
+    try:
+        for address in dict.fromkeys(address for _, _, address in pending):
+            endpoints[address] = (await loop.create_datagram_endpoint(DnsClientProtocol, remote_addr=address))[1]
+        while pending:
+            done = await asyncio.gather(*(probe(*item) for item in pending))
+            pending = [item for item, ok in zip(pending, done) if not ok]
+            remaining = deadline - loop.time()
+            if not pending or remaining <= 0:
+                break
+            await asyncio.sleep(min(interval, remaining))
+    finally:
+        for endpoint in endpoints.values():
+            endpoint.transport.close()
+    return list(results.values())
+
+
+def wait_for_propagation(checks, domain_nameservers, timeout=300, interval=2):
+    return asyncio.run(check_propagation(checks, domain_nameservers, timeout, interval))
@@ -0,0 +1,130 @@
+# coding: utf-8
+# 所有 Alidns API 请求共用的限速与重试层:
+# 令牌桶限制 QPS, AIMD 方式自适应调整并发数, 仅对限流和临时性错误按带抖动的指数退避重试
+
+import time
+import random
+import threading
+
+
+# 限流错误码, 如 Throttling, Throttling.User, Throttling.Api
+THROTTLING_PREFIX = "Throttling"
+# 服务端临时性错误, 以及 SDK 的网络错误 (连接失败, 超时等)
+TRANSIENT_ERROR_CODES = ("ServiceUnavailable", "InternalError", "UnknownError", "SDK.HttpError")
+
+
+def error_code_of(e):
+    # aliyunsdkcore 的 ClientException, ServerException 均有 get_error_code(), 这里不直接导入 SDK
+    get_error_code = getattr(e, "get_error_code", None)
+    return str(get_error_code()) if get_error_code else ""
+
+
+def is_throttling_error(e):
+    return error_code_of(e).startswith(THROTTLING_PREFIX)
+
+
+def is_transient_error(e):
+    http_status = getattr(e, "http_status", None)
+    return error_code_of(e) in TRANSIENT_ERROR_CODES or (http_status is not None and int(http_status) >= 500)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        # rate: 每秒补充的令牌数, 即 QPS 上限; burst: 桶容量, 默认为 1 秒的令牌数
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    # AIMD: 每个成功的请求使上限增加 1/limit (约每轮增加 1), 遇到限流时上限减半,
+    # 同一轮在途请求先后返回的多个限流错误只减半一次
+    def __init__(self, limit, minimum=1, maximum=None):
+        self.maximum = maximum or limit
+        self.minimum = minimum
+        self.limit = float(min(max(limit, minimum), self.maximum))
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.cond = threading.Condition()
+
+    def acquire(self):
+        with self.cond:
+            while self.in_flight >= int(self.limit):
+                self.cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self.decreased_at > 1:
+                    self.limit = max(self.minimum, self.limit / 2)
+                    self.decreased_at = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+
+class RequestLimiter:
+    def __init__(self, qps=0, concurrency=10, retries=5, base_delay=0.2, max_delay=10):
+        # qps 为 0 时不限速, 只做自适应并发与重试
+        self.bucket = TokenBucket(qps) if qps > 0 else None
+        self.concurrency = AdaptiveConcurrency(concurrency)
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def backoff(self, attempt):
+        # full jitter: 在 [0, min(max_delay, base_delay * 2^attempt)] 内随机等待, 避免并发请求同时重试
+        time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def call(self, func, recover=None, cost=1):
+        # recover: 写请求 (AddDomainRecord, UpdateDomainRecord, DeleteDomainRecord 等) 不是幂等的,
+        # 在结果未知的失败后重试之前调用, 用于确认上一次请求是否已经生效, 返回非 None 时直接作为本次请求的结果;
+        # 没有 recover 的请求应当可以安全地重复执行
+        # cost: func 中实际发出的请求数, 如异步传输层一次并发发出的多个分页请求
+        uncertain = False
+        for attempt in range(self.retries + 1):
+            for _ in range(cost if self.bucket is not None else 0):
+                self.bucket.acquire()
+            self.concurrency.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                error = e
+            else:
+                self.concurrency.release()
+                return result
+            throttled = is_throttling_error(error)
+            self.concurrency.release(throttled)
+
+            # 限流错误说明请求未被执行, 临时性错误则无法确定请求是否已生效;
+            # 出现过临时性错误后, 重试时遇到的 DomainRecordDuplicate 等错误可能由之前已生效的请求导致, 也可能是其他原因,
+            # 不能据此判断, 之后的每次失败都由 recover 查询线上记录确认
+            uncertain = uncertain or is_transient_error(error)
+            if recover is not None and uncertain and not throttled:
+                result = recover()
+                if result is not None:
+                    return result
+            if attempt >= self.retries or not (throttled or is_transient_error(error)):
+                raise error
+            with self.lock:
+                self.retried += 1
+            self.backoff(attempt)
@@ -0,0 +1,156 @@
+# coding: utf-8
+# Alidns API 调用的统计信息: 按 Action 统计调用次数, 错误, 重试, 响应字节数, 延迟直方图以及列表类请求的分页数
+# 可输出为 stderr 上的汇总表, 供 node_exporter textfile collector 读取的 Prometheus 文本格式或 JSON
+
+import os
+import json
+import time
+import bisect
+import itertools
+import threading
+import collections
+
+
+# 延迟直方图的桶上限 (秒), 与 Prometheus 客户端库的默认值一致
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class ActionStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = collections.Counter()
+        self.retries = 0
+        self.bytes = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+        # 最后一个桶对应 +Inf
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.listings = 0
+        self.pages = 0
+
+    def quantile(self, q):
+        # 按直方图估算分位数, 返回所在桶的上限
+        target, seen = q * self.calls, 0
+        for upper, count in zip(LATENCY_BUCKETS + (self.latency_max,), self.latency_buckets):
+            seen += count
+            if count and seen >= target:
+                return min(upper, self.latency_max)
+        return self.latency_max
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": dict(self.errors),
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "latency_sum": round(self.latency_sum, 6),
+            "latency_max": round(self.latency_max, 6),
+            # 与 Prometheus 直方图一致, 各个桶为累计计数
+            "latency_buckets": dict(zip([str(upper) for upper in LATENCY_BUCKETS] + ["+Inf"],
+                                        itertools.accumulate(self.latency_buckets))),
+            "listings": self.listings,
+            "pages": self.pages,
+        }
+
+
+class ApiStats:
+    def __init__(self):
+        self.actions = collections.defaultdict(ActionStats)
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    def record_call(self, action, elapsed, size=0, error_code=None):
+        with self.lock:
+            stats = self.actions[action]
+            stats.calls += 1
+            stats.bytes += size
+            stats.latency_sum += elapsed
+            stats.latency_max = max(stats.latency_max, elapsed)
+            stats.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            if error_code is not None:
+                stats.errors[error_code] += 1
+
+    def record_retry(self, action):
+        with self.lock:
+            self.actions[action].retries += 1
+
+    def record_listing(self, action, pages):
+        with self.lock:
+            self.actions[action].listings += 1
+            self.actions[action].pages += pages
+
+    def summary(self):
+        lines = ["%-34s%8s%8s%8s%12s%10s%10s%10s%8s" % (
+            "Action", "Calls", "Errors", "Retries", "Bytes", "Avg(ms)", "P95(ms)", "Max(ms)", "Pages")]
+        with self.lock:
+            for action, stats in sorted(self.actions.items()):
+                lines.append("%-34s%8d%8d%8d%12d%10.1f%10.1f%10.1f%8s" % (
+                    action, stats.calls, sum(stats.errors.values()), stats.retries, stats.bytes,
+                    stats.latency_sum / stats.calls * 1000 if stats.calls else 0,
+                    stats.quantile(0.95) * 1000, stats.latency_max * 1000,
+                    "%d/%d" % (stats.pages, stats.listings) if stats.listings else "-"))
+            total_calls = sum(stats.calls for stats in self.actions.values())
+        lines.append("total api calls: %d, elapsed: %.3fs" % (total_calls, time.time() - self.started))
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "started": self.started,
+                "elapsed": round(time.time() - self.started, 6),
+                "actions": {action: stats.to_dict() for action, stats in sorted(self.actions.items())},
+            }
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for labels, value in samples:
+                label_str = ",".join('%s="%s"' % (key, str(val).replace("\\", "\\\\").replace('"', '\\"'))
+                                     for key, val in labels)
+                lines.append("%s{%s} %s" % (name, label_str, value) if label_str else "%s %s" % (name, value))
+
+        actions = data.get("actions")
+        metric("alidns_api_calls_total", "counter", "Alidns API calls, including retries",
+               [((("action", action),), stats.get("calls")) for action, stats in actions.items()])
+        metric("alidns_api_errors_total", "counter", "Alidns API calls that returned an error",
+               [((("action", action), ("code", code)), count)
+                for action, stats in actions.items() for code, count in stats.get("errors").items()])
+        metric("alidns_api_retries_total", "counter", "Alidns API calls retried after throttling or transient errors",
+               [((("action", action),), stats.get("retries")) for action, stats in actions.items()])
+        metric("alidns_api_response_bytes_total", "counter", "Bytes received in Alidns API responses",
+               [((("action", action),), stats.get("bytes")) for action, stats in actions.items()])
+        metric("alidns_listing_pages_total", "counter", "Pages fetched by paged listing requests",
+               [((("action", action),), stats.get("pages"))
+                for action, stats in actions.items() if stats.get("listings")])
+        metric("alidns_listings_total", "counter", "Paged listing requests",
+               [((("action", action),), stats.get("listings"))
+                for action, stats in actions.items() if stats.get("listings")])
+        lines.append("# HELP alidns_api_latency_seconds Alidns API call latency")
+        lines.append("# TYPE alidns_api_latency_seconds histogram")
+        for action, stats in actions.items():
+            for le, count in stats.get("latency_buckets").items():
+                lines.append('alidns_api_latency_seconds_bucket{action="%s",le="%s"} %s' % (action, le, count))
+            lines.append('alidns_api_latency_seconds_sum{action="%s"} %s' % (action, stats.get("latency_sum")))
+            lines.append('alidns_api_latency_seconds_count{action="%s"} %s' % (action, stats.get("calls")))
+        metric("alidns_run_duration_seconds", "gauge", "Duration of the last alidns run", [((), data.get("elapsed"))])
+        metric("alidns_last_run_timestamp_seconds", "gauge", "Start time of the last alidns run",
+               [((), data.get("started"))])
+        return "\n".join(lines) + "\n"
+
+    def dump(self, stats_file):
+        # .prom 结尾时输出 Prometheus 文本格式, 否则输出 JSON
+        # 先写临时文件再 rename, 避免 node_exporter 读到写了一半的文件
+        stats_file = os.path.expanduser(stats_file)
+        if os.path.dirname(stats_file) and not os.path.exists(os.path.dirname(stats_file)):
+            os.makedirs(os.path.dirname(stats_file))
+        if stats_file.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.to_dict(), ensure_ascii=False, indent=4)
+        with open("%s.tmp.%d" % (stats_file, os.getpid()), "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace("%s.tmp.%d" % (stats_file, os.getpid()), stats_file)
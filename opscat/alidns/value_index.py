@@ -0,0 +1,51 @@
+# coding: utf-8
+# 跨域名的记录值倒排索引, 用于查询 "哪些记录指向了某个 IP 或 CNAME 目标"
+
+import os
+import json
+import time
+import collections
+
+
+INDEX_FIELDS = ("DomainName", "RecordId", "Type", "RR", "Value", "TTL", "Status", "Remark")
+
+
+def normalize_index_value(value):
+    # CNAME, MX, NS 等域名类型的记录值不区分大小写且末尾的 . 可有可无, 统一规范化后作为索引的 key
+    return str(value).strip().lower().rstrip(".")
+
+
+class ValueIndex:
+    def __init__(self, index=None, built_at=None):
+        self.index = index or {}
+        self.built_at = built_at or time.time()
+
+    @classmethod
+    def build(cls, records):
+        index = collections.defaultdict(list)
+        for record in records:
+            index[normalize_index_value(record.get("Value"))].append(
+                {field: record.get(field) for field in INDEX_FIELDS})
+        return cls(dict(index))
+
+    @classmethod
+    def load(cls, index_file, ttl=3600):
+        try:
+            with open(os.path.expanduser(index_file), encoding="utf-8") as f:
+                cached = json.loads(f.read())
+        except (IOError, ValueError):
+            return
+        if time.time() - cached.get("time", 0) > ttl:
+            return
+        return cls(cached.get("index"), cached.get("time"))
+
+    def save(self, index_file):
+        index_file = os.path.expanduser(index_file)
+        if not os.path.exists(os.path.dirname(index_file)):
+            os.makedirs(os.path.dirname(index_file))
+        with open("%s.tmp.%d" % (index_file, os.getpid()), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"time": self.built_at, "index": self.index}, ensure_ascii=False))
+        os.replace("%s.tmp.%d" % (index_file, os.getpid()), index_file)
+
+    def lookup(self, value):
+        return self.index.get(normalize_index_value(value), [])
@@ -0,0 +1,142 @@
+# coding: utf-8
+# 按域名保存完整解析记录快照的本地缓存, 供 alidns 的只读查询直接使用
+
+import os
+import json
+import time
+import threading
+
+
+def filter_records(records, mode="LIKE",
+                   keyword="", rr_keyword="", type_keyword="", value_keyword=""):
+    # 在本地模拟 DescribeDomainRecords 的 SearchMode 语义, 均不区分大小写
+    # LIKE: KeyWord 按 %KeyWord% 模糊匹配 RR 或 Value
+    # EXACT: KeyWord 精确匹配 RR 或 Value
+    # ADVANCED: RRKeyWord, ValueKeyWord 模糊匹配, TypeKeyWord 精确匹配
+    if rr_keyword or type_keyword or value_keyword:
+        mode = "ADVANCED"
+    keyword = (keyword or "").lower()
+    rr_keyword = (rr_keyword or "").lower()
+    type_keyword = (type_keyword or "").lower()
+    value_keyword = (value_keyword or "").lower()
+
+    for record in records:
+        rr = str(record.get("RR", "")).lower()
+        value = str(record.get("Value", "")).lower()
+        if mode == "ADVANCED":
+            if rr_keyword and rr_keyword not in rr:
+                continue
+            if type_keyword and type_keyword != str(record.get("Type", "")).lower():
+                continue
+            if value_keyword and value_keyword not in value:
+                continue
+        elif keyword:
+            if mode == "EXACT" and keyword not in (rr, value):
+                continue
+            if mode != "EXACT" and keyword not in rr and keyword not in value:
+                continue
+        yield record
+
+
+class ZoneCache:
+    def __init__(self, cache_dir, ttl=60, refresh=False):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.ttl = ttl
+        self.refresh = refresh
+        # 内存中的快照 {domain: {"domain": domain, "time": timestamp, "records": [...]}}
+        # 写操作只修改内存中的快照并标记为 dirty, 由 flush() 统一落盘, 避免批量写入时反复重写整个文件
+        self.zones = {}
+        self.dirty = set()
+        self.lock = threading.RLock()
+
+    def snapshot_file(self, domain):
+        return os.path.join(self.cache_dir, "%s.json" % domain)
+
+    def read_snapshot(self, domain):
+        with self.lock:
+            if domain not in self.zones:
+                try:
+                    with open(self.snapshot_file(domain), encoding="utf-8") as f:
+                        self.zones[domain] = json.loads(f.read())
+                except (IOError, ValueError):
+                    return
+            return self.zones[domain]
+
+    def load(self, domain):
+        # 快照不存在, 已过期或指定了 --refresh 时返回 None, 调用方需重新请求 API
+        if self.refresh or self.ttl <= 0:
+            return
+        with self.lock:
+            snapshot = self.read_snapshot(domain)
+            if not snapshot or time.time() - snapshot.get("time", 0) > self.ttl:
+                return
+            return list(snapshot.get("records"))
+
+    def save(self, domain, records):
+        with self.lock:
+            self.zones[domain] = {"domain": domain, "time": time.time(), "records": list(records)}
+            self.dirty.add(domain)
+        # 同一进程内只需要强制刷新一次
+        self.refresh = False
+
+    def invalidate(self, domain):
+        with self.lock:
+            self.zones.pop(domain, None)
+            self.dirty.discard(domain)
+            try:
+                os.remove(self.snapshot_file(domain))
+            except FileNotFoundError:
+                pass
+
+    def find_record(self, record_id):
+        # 按 RecordId 查找记录所在的快照, 必要时读取缓存目录下的其他快照文件
+        record_id = str(record_id)
+        with self.lock:
+            domains = list(self.zones.keys())
+            if os.path.isdir(self.cache_dir):
+                domains.extend(f[:-len(".json")] for f in os.listdir(self.cache_dir)
+                               if f.endswith(".json") and f[:-len(".json")] not in self.zones)
+            for domain in domains:
+                snapshot = self.read_snapshot(domain)
+                if not snapshot:
+                    continue
+                for record in snapshot.get("records"):
+                    if str(record.get("RecordId")) == record_id:
+                        return domain, record
+        return None, None
+
+    def add_record(self, domain, record):
+        with self.lock:
+            snapshot = self.read_snapshot(domain)
+            if not snapshot:
+                return
+            snapshot.get("records").append(record)
+            self.dirty.add(domain)
+
+    def patch_record(self, record_id, **fields):
+        with self.lock:
+            domain, record = self.find_record(record_id)
+            if not record:
+                return
+            record.update(fields)
+            self.dirty.add(domain)
+
+    def remove_record(self, record_id):
+        with self.lock:
+            domain, record = self.find_record(record_id)
+            if not record:
+                return
+            self.zones[domain]["records"].remove(record)
+            self.dirty.add(domain)
+
+    def flush(self):
+        with self.lock:
+            if self.dirty and not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            for domain in self.dirty:
+                snapshot_file = self.snapshot_file(domain)
+                # 先写临时文件再 rename, 避免并发运行的其他进程读到写了一半的快照
+                with open("%s.tmp.%d" % (snapshot_file, os.getpid()), "w", encoding="utf-8") as f:
+                    f.write(json.dumps(self.zones[domain], ensure_ascii=False))
+                os.replace("%s.tmp.%d" % (snapshot_file, os.getpid()), snapshot_file)
+            self.dirty.clear()
@@ -0,0 +1,137 @@
+# coding: utf-8
+# check 操作使用的证书元数据缓存: 以文件路径为键, 记录 mtime, size, 内容的 sha256,
+# 以及 bundle 中每个证书 (含中间证书) 的 subject, CN, SANs 与有效期
+# mtime 与 size 未变化的文件不再读取; 变化了的文件先计算 sha256, 内容与已缓存的某个文件相同时直接复用,
+# 其余文件才需要解析, 数量较多时在进程池中并行解析
+
+import os
+import re
+import json
+import hashlib
+import datetime
+import collections
+import concurrent.futures
+
+
+CACHE_VERSION = 1
+PEM_CERT_RE = re.compile(rb"-----BEGIN CERTIFICATE-----\s.+?-----END CERTIFICATE-----", re.S)
+# 单个 bundle 的解析耗时在 0.1ms 以内, 需要解析的文件少于该数量时在当前进程内解析, 避免启动进程池的开销
+PARALLEL_THRESHOLD = 256
+
+
+def utc_of(cert, field):
+    # cryptography 42 起 not_valid_* 已废弃, 旧版本没有 not_valid_*_utc, 均转换为带时区的 UTC 时间
+    value = getattr(cert, "%s_utc" % field, None)
+    return value if value is not None else getattr(cert, field).replace(tzinfo=datetime.timezone.utc)
+
+
+def parse_bundle(content):
+    from cryptography import x509
+
+    certs = []
+    for block in PEM_CERT_RE.findall(content):
+        cert = x509.load_pem_x509_certificate(block)
+        cn = cert.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+        try:
+            sans = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value \
+                .get_values_for_type(x509.DNSName)
+        except x509.ExtensionNotFound:
+            sans = []
+        certs.append({"subject": cert.subject.rfc4514_string(), "cn": cn[0].value if cn else "", "sans": sans,
+                      "not_before": utc_of(cert, "not_valid_before").isoformat(),
+                      "not_after": utc_of(cert, "not_valid_after").isoformat()})
+    if not certs:
+        raise ValueError("没有找到 PEM 格式的证书")
+    return certs
+
+
+def parse_bundle_safe(content):
+    # 进程池中执行, 返回 (证书列表, 错误信息), 单个文件解析失败不影响其他文件
+    try:
+        return parse_bundle(content), None
+    except ValueError as e:
+        return [], str(e)
+
+
+def parse_bundles(contents, workers=None):
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(contents) < PARALLEL_THRESHOLD:
+        return [parse_bundle_safe(content) for content in contents]
+    workers = min(workers, len(contents))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return list(executor.map(parse_bundle_safe, contents, chunksize=max(1, len(contents) // (workers * 4))))
+
+
+class CertCache:
+    def __init__(self, cache_file=None):
+        # cache_file 为空时不读写缓存文件, 每次都重新解析
+        self.cache_file = os.path.expanduser(cache_file) if cache_file else None
+        # {path: {"mtime_ns", "size", "sha256", "certs", "error"}}
+        self.entries = self.load(self.cache_file)
+        self.dirty = False
+        # hit: mtime, size 未变化; reused: 内容与已缓存的文件相同; parsed: 重新解析
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def load(cache_file):
+        if not cache_file:
+            return {}
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                cached = json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+        if cached.get("version") != CACHE_VERSION:
+            return {}
+        return cached.get("entries") or {}
+
+    def save(self):
+        if not self.cache_file or not self.dirty:
+            return
+        if not os.path.exists(os.path.dirname(self.cache_file)):
+            os.makedirs(os.path.dirname(self.cache_file))
+        with open("%s.tmp.%d" % (self.cache_file, os.getpid()), "w", encoding="utf-8") as f:
+            f.write(json.dumps({"version": CACHE_VERSION, "entries": self.entries}, ensure_ascii=False))
+        os.replace("%s.tmp.%d" % (self.cache_file, os.getpid()), self.cache_file)
+        self.dirty = False
+
+    def lookup(self, paths, workers=None):
+        # 返回 {path: entry}, paths 应为绝对路径; 列出目录之后才被删除 (如证书轮换) 的文件不在结果中
+        by_sha256 = {entry.get("sha256"): entry for entry in self.entries.values() if not entry.get("error")}
+        results, misses = {}, {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                entry = self.entries.get(path)
+                if entry is not None and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+                    results[path] = entry
+                    self.stats["hit"] += 1
+                    continue
+                with open(path, "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            key = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "sha256": hashlib.sha256(content).hexdigest()}
+            if key.get("sha256") in by_sha256:
+                results[path] = dict(by_sha256.get(key.get("sha256")), **key)
+                self.stats["reused"] += 1
+            else:
+                misses[path] = (key, content)
+
+        parsed = parse_bundles([content for _, content in misses.values()], workers)
+        for (path, (key, _)), (certs, error) in zip(misses.items(), parsed):
+            results[path] = dict(key, certs=certs, error=error)
+            self.stats["parsed"] += 1
+
+        for path, entry in results.items():
+            if self.entries.get(path) is not entry:
+                self.entries[path] = entry
+                self.dirty = True
+        return results
+
+    def prune(self, directory, paths):
+        # 删除 directory 下已不存在的文件的缓存
+        paths = set(paths)
+        for path in [path for path in self.entries if os.path.dirname(path) == directory and path not in paths]:
+            self.entries.pop(path)
+            self.dirty = True
@@ -0,0 +1,73 @@
+# coding: utf-8
+# 多集群并发执行: 每个集群一个线程负责准备 (列出命名空间, secret 等) 并汇总结果, 集群内的 API 请求提交到共享线程池;
+# 集群线程自身的请求 (call) 与线程池中的请求 (map) 都需要获取全局与所在集群的信号量,
+# 全局同时进行的请求不超过 workers 个, 每个集群不超过 cluster_workers 个
+# 某个集群出错只记录该集群的异常, 不影响其他集群
+
+import threading
+import concurrent.futures
+
+
+class ClusterExecutor:
+    def __init__(self, workers=8, cluster_workers=4):
+        self.workers = max(1, workers)
+        self.cluster_workers = max(1, cluster_workers)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="tls-secret")
+        # 信号量在提交前获取, 请求完成后释放, 不会占用共享线程池中的线程等待
+        self.semaphore = threading.BoundedSemaphore(self.workers)
+        # {cluster: BoundedSemaphore}
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def semaphore_of(self, cluster):
+        with self.lock:
+            if cluster not in self.semaphores:
+                self.semaphores[cluster] = threading.BoundedSemaphore(self.cluster_workers)
+            return self.semaphores[cluster]
+
+    def acquire(self, cluster):
+        # 先获取集群的信号量再获取全局的, 持有者都是正在进行的请求, 完成后必然释放, 不会死锁
+        semaphore = self.semaphore_of(cluster)
+        semaphore.acquire()
+        self.semaphore.acquire()
+        return semaphore
+
+    def release(self, semaphore):
+        self.semaphore.release()
+        semaphore.release()
+
+    def call(self, cluster, func, *args):
+        # 在集群线程中直接执行一个请求
+        semaphore = self.acquire(cluster)
+        try:
+            return func(*args)
+        finally:
+            self.release(semaphore)
+
+    def map(self, cluster, func, items):
+        # 在 cluster 内并发执行 func(item), 按 items 的顺序返回结果, func 抛出的异常在此处重新抛出
+        futures = []
+        for item in items:
+            semaphore = self.acquire(cluster)
+            future = self.executor.submit(func, item)
+            future.add_done_callback(lambda _, semaphore=semaphore: self.release(semaphore))
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def run(self, clusters, func):
+        # 并发执行 func(cluster), 返回与 clusters 顺序一致的 [(结果, 异常)]
+        if not clusters:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(min(len(clusters), self.workers),
+                                                   thread_name_prefix="tls-cluster") as cluster_executor:
+            futures = [cluster_executor.submit(func, cluster) for cluster in clusters]
+        outcomes = []
+        for future in futures:
+            try:
+                outcomes.append((future.result(), None))
+            except Exception as e:
+                outcomes.append((None, e))
+        return outcomes
+
+    def shutdown(self):
+        self.executor.shutdown()
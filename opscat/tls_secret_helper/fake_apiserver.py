@@ -0,0 +1,294 @@
+#! /usr/bin/env python3
+# coding: utf-8
+# 本地的 Kubernetes API Server 替身, 用于在没有集群的环境 (如 CI) 中测试 tls-secret-helper
+# 只实现了 tls-secret-helper 用到的 namespace/secret 接口, 支持 Bearer Token 认证, HTTPS 与客户端证书校验
+# 用法: python3 -m opscat.tls_secret_helper.fake_apiserver --port 8443 -n default,prod --kubeconfig ~/.kube/fake.conf
+#       tls-secret-helper -a tls:list -k ~/.kube/fake.conf
+
+import os
+import re
+import ssl
+import json
+import time
+import random
+import argparse
+import threading
+import collections
+import http.server
+import urllib.parse
+
+
+class FakeKubeError(Exception):
+    REASONS = {400: "BadRequest", 401: "Unauthorized", 404: "NotFound", 405: "MethodNotAllowed",
+               409: "AlreadyExists", 422: "Invalid"}
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+
+    def status(self):
+        return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Failure",
+                "message": self.message, "reason": self.REASONS.get(self.code, ""), "code": self.code}
+
+
+class FakeKube:
+    # 内存中的 namespace 与 secret, 返回结构与 Kubernetes API 一致
+    def __init__(self, namespaces=("default",)):
+        self.namespaces = {}
+        # {(namespace, name): secret}
+        self.secrets = {}
+        self.resource_version = 1000
+        self.lock = threading.RLock()
+        for namespace in namespaces:
+            self.add_namespace(namespace)
+
+    def next_resource_version(self):
+        self.resource_version += 1
+        return str(self.resource_version)
+
+    def add_namespace(self, name):
+        with self.lock:
+            self.namespaces.setdefault(name, {"kind": "Namespace", "apiVersion": "v1", "metadata": {
+                "name": name, "resourceVersion": self.next_resource_version()}, "status": {"phase": "Active"}})
+
+    def check_namespace(self, namespace):
+        if namespace not in self.namespaces:
+            raise FakeKubeError(404, 'namespaces "%s" not found' % namespace)
+
+    def check_secret(self, namespace, secret):
+        metadata = secret.get("metadata") or {}
+        if not metadata.get("name"):
+            raise FakeKubeError(422, "Secret is invalid: metadata.name: Required value")
+        if metadata.get("namespace", namespace) != namespace:
+            raise FakeKubeError(400, "the namespace of the provided object does not match the namespace sent on "
+                                     "the request")
+
+    def stored(self, namespace, secret):
+        secret = dict(secret, kind="Secret", apiVersion="v1")
+        current = self.secrets.get((namespace, secret.get("metadata").get("name")))
+        created = current.get("metadata").get("creationTimestamp") if current else \
+            time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        secret["metadata"] = dict(secret.get("metadata"), namespace=namespace, creationTimestamp=created,
+                                  resourceVersion=self.next_resource_version())
+        secret.setdefault("type", "Opaque")
+        return secret
+
+    @staticmethod
+    def page(kind, items, params):
+        # 以偏移量作为 continue 令牌
+        start = int(params.get("continue") or 0)
+        limit = int(params.get("limit") or 0) or len(items)
+        metadata = {}
+        if start + limit < len(items):
+            metadata["continue"] = str(start + limit)
+        return {"kind": kind, "apiVersion": "v1", "metadata": metadata, "items": items[start:start + limit]}
+
+    @staticmethod
+    def field_matches(secret, field_selector):
+        # 只支持 tls-secret-helper 用到的 type=, metadata.name= 条件
+        for requirement in filter(None, (field_selector or "").split(",")):
+            field, _, value = requirement.partition("=")
+            actual = secret.get("type") if field == "type" else secret.get("metadata").get("name") \
+                if field == "metadata.name" else None
+            if actual != value.lstrip("="):
+                return False
+        return True
+
+    def list_namespaces(self, params):
+        with self.lock:
+            return self.page("NamespaceList", sorted(self.namespaces.values(), key=lambda ns: ns["metadata"]["name"]),
+                             params)
+
+    def list_secrets(self, params, namespace=None):
+        with self.lock:
+            if namespace is not None:
+                self.check_namespace(namespace)
+            items = [secret for (ns, _), secret in sorted(self.secrets.items())
+                     if namespace in (None, ns) and self.field_matches(secret, params.get("fieldSelector"))]
+        return self.page("SecretList", items, params)
+
+    def get_secret(self, namespace, name):
+        with self.lock:
+            self.check_namespace(namespace)
+            if (namespace, name) not in self.secrets:
+                raise FakeKubeError(404, 'secrets "%s" not found' % name)
+            return self.secrets.get((namespace, name))
+
+    def create_secret(self, namespace, secret):
+        with self.lock:
+            self.check_namespace(namespace)
+            self.check_secret(namespace, secret)
+            name = secret.get("metadata").get("name")
+            if (namespace, name) in self.secrets:
+                raise FakeKubeError(409, 'secrets "%s" already exists' % name)
+            self.secrets[(namespace, name)] = self.stored(namespace, secret)
+            return self.secrets.get((namespace, name))
+
+    def replace_secret(self, namespace, name, secret):
+        with self.lock:
+            self.check_secret(namespace, secret)
+            if secret.get("metadata").get("name") != name:
+                raise FakeKubeError(400, "the name of the object (%s) does not match the name on the URL (%s)" % (
+                    secret.get("metadata").get("name"), name))
+            current = self.get_secret(namespace, name)
+            resource_version = secret.get("metadata").get("resourceVersion")
+            if resource_version and resource_version != current.get("metadata").get("resourceVersion"):
+                raise FakeKubeError(409, 'Operation cannot be fulfilled on secrets "%s": the object has been '
+                                         'modified; please apply your changes to the latest version and try again'
+                                    % name)
+            self.secrets[(namespace, name)] = self.stored(namespace, secret)
+            return self.secrets.get((namespace, name))
+
+    def delete_secret(self, namespace, name):
+        with self.lock:
+            self.get_secret(namespace, name)
+            self.secrets.pop((namespace, name))
+            return {"kind": "Status", "apiVersion": "v1", "metadata": {}, "status": "Success",
+                    "details": {"name": name, "kind": "secrets"}}
+
+    def handle(self, method, path, params, body):
+        # 返回 (HTTP 状态码, 响应对象)
+        if path == "/api/v1/namespaces" and method == "GET":
+            return 200, self.list_namespaces(params)
+        if path == "/api/v1/secrets" and method == "GET":
+            return 200, self.list_secrets(params)
+        match = re.match(r"^/api/v1/namespaces/([^/]+)/secrets(?:/([^/]+))?$", path)
+        if match is None:
+            raise FakeKubeError(404, "the server could not find the requested resource")
+        namespace, name = [urllib.parse.unquote(group) if group else group for group in match.groups()]
+        if name is None and method == "GET":
+            return 200, self.list_secrets(params, namespace)
+        if name is None and method == "POST":
+            return 201, self.create_secret(namespace, body or {})
+        if name is not None and method == "GET":
+            return 200, self.get_secret(namespace, name)
+        if name is not None and method == "PUT":
+            return 200, self.replace_secret(namespace, name, body or {})
+        if name is not None and method == "DELETE":
+            return 200, self.delete_secret(namespace, name)
+        raise FakeKubeError(405, "the server does not allow this method on the requested resource")
+
+
+class FakeKubeHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def handle_request(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query, keep_blank_values=True))
+        length = int(self.headers.get("Content-Length") or 0)
+        content = self.rfile.read(length) if length else b""
+
+        server = self.server
+        if server.latency > 0:
+            time.sleep(max(0, random.gauss(server.latency, server.latency * 0.2)) / 1000)
+        try:
+            if server.token and self.headers.get("Authorization") != "Bearer %s" % server.token:
+                raise FakeKubeError(401, "Unauthorized")
+            try:
+                body = json.loads(content.decode()) if content else None
+            except ValueError:
+                raise FakeKubeError(400, "invalid JSON body")
+            status, body = server.kube.handle(self.command, url.path, params, body)
+        except FakeKubeError as e:
+            status, body = e.code, e.status()
+        with server.lock:
+            server.requests[self.command] += 1
+
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_request
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class FakeKubeServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), kube=None, token=None, latency=0,
+                 cert_file=None, key_file=None, client_ca_file=None, verbose=False):
+        # 指定 cert_file, key_file 时以 HTTPS 提供服务, 再指定 client_ca_file 时要求客户端证书
+        http.server.ThreadingHTTPServer.__init__(self, address, FakeKubeHandler)
+        self.kube = kube or FakeKube()
+        self.token = token
+        self.latency = latency
+        self.verbose = verbose
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+        self.tls = cert_file is not None
+        if self.tls:
+            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ssl_context.load_cert_chain(cert_file, key_file)
+            if client_ca_file:
+                ssl_context.load_verify_locations(cafile=client_ca_file)
+                ssl_context.verify_mode = ssl.CERT_REQUIRED
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def endpoint(self):
+        return "%s://%s:%d" % ("https" if self.tls else "http", self.server_address[0], self.server_address[1])
+
+    def kubeconfig(self, **user):
+        # 指向本服务的 kubeconfig, JSON 是合法的 YAML, kubectl 与 KubeClient 均可读取;
+        # user 为额外的认证字段, 如 client-certificate-data, cluster 的 CA 通过 certificate-authority 等字段传入
+        cluster = {"server": self.endpoint}
+        for field in ("certificate-authority", "certificate-authority-data", "insecure-skip-tls-verify"):
+            if field in user:
+                cluster[field] = user.pop(field)
+        if self.token:
+            user.setdefault("token", self.token)
+        return {"apiVersion": "v1", "kind": "Config", "current-context": "fake",
+                "clusters": [{"name": "fake", "cluster": cluster}],
+                "users": [{"name": "fake", "user": user}],
+                "contexts": [{"name": "fake", "context": {"cluster": "fake", "user": "fake"}}]}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-apiserver", daemon=True).start()
+        return self
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="本地的 Kubernetes API Server 替身服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址, 默认值为 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443, help="监听端口, 默认值为 8443")
+    parser.add_argument("-n", "--namespaces", default="default",
+                        help="逗号分隔的预置命名空间列表, 默认值为 default")
+    parser.add_argument("--token", default=None, help="要求请求携带的 Bearer Token, 默认为空即不认证")
+    parser.add_argument("--latency", type=float, default=0, help="每个请求的平均延迟(毫秒), 默认值为 0")
+    parser.add_argument("--tls-cert", default=None, help="服务端证书文件, 指定后以 HTTPS 提供服务")
+    parser.add_argument("--tls-key", default=None, help="服务端私钥文件")
+    parser.add_argument("--tls-ca", default=None,
+                        help="签发服务端证书的 CA 文件, 写入 --kubeconfig, 默认为 --tls-cert 即自签名证书")
+    parser.add_argument("--client-ca", default=None, help="校验客户端证书的 CA 文件, 指定后要求客户端证书")
+    parser.add_argument("--kubeconfig", default=None,
+                        help="写入指向本服务的 kubeconfig 文件, 不包含客户端证书")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每个请求的访问日志")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    kube = FakeKube([ns.strip() for ns in args.namespaces.split(",") if ns.strip()])
+    server = FakeKubeServer((args.host, args.port), kube, args.token, args.latency,
+                            args.tls_cert, args.tls_key, args.client_ca, args.verbose)
+    if args.kubeconfig:
+        user = {"certificate-authority": os.path.abspath(args.tls_ca or args.tls_cert)} if args.tls_cert else {}
+        with open(args.kubeconfig, "w", encoding="utf-8") as f:
+            json.dump(server.kubeconfig(**user), f, indent=2)
+    print("fake apiserver listening on %s, namespaces: %s" % (server.endpoint, ", ".join(sorted(kube.namespaces))))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+# coding: utf-8
+# tls-secret-helper 用到的 Kubernetes API 调用: namespace/secret 的 list, get, create, replace, delete
+# KubeClient 基于 httpx 直接请求 API Server, 每个集群复用一个连接池, 不再为每个操作启动 kubectl 进程;
+# 使用 exec 等 kubeconfig 认证插件时无法在进程内认证, 退回到参数相同的 KubectlClient
+
+import os
+import ssl
+import sys
+import json
+import base64
+import pathlib
+import tempfile
+import subprocess
+import urllib.parse
+
+
+class KubeConfigError(Exception):
+    pass
+
+
+class KubeApiError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, "%s %s" % (status, message) if status else message)
+        self.status = status
+        self.message = message
+
+
+def load_kubeconfig(kubeconfig):
+    # kubeconfig 通常为 YAML, PyYAML 不是必需的依赖, 没有安装时由 kubectl 转换为 JSON
+    try:
+        with open(kubeconfig, encoding="utf-8") as f:
+            content = f.read()
+    except OSError as e:
+        raise KubeConfigError("无法读取 kubeconfig: %s" % e.strerror)
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+    try:
+        import yaml
+    except ImportError:
+        yaml = None
+    if yaml is not None:
+        return yaml.safe_load(content)
+    try:
+        proc = subprocess.run(["kubectl", "config", "view", "--raw", "-o", "json", "--kubeconfig", str(kubeconfig)],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise KubeConfigError("kubeconfig 不是 JSON, 且没有安装 PyYAML 或 kubectl: %s" % e.strerror)
+    if proc.returncode != 0:
+        raise KubeConfigError("无法解析 kubeconfig: %s" % proc.stderr.decode().strip())
+    return json.loads(proc.stdout.decode())
+
+
+def resolve_context(config, context=None):
+    # 返回 current-context (或指定 context) 对应的 (cluster, user) 配置
+    def named(section, name):
+        for item in config.get(section) or []:
+            if item.get("name") == name:
+                return item.get(section[:-1]) or {}
+        raise KubeConfigError("kubeconfig 中不存在 %s %s" % (section[:-1], name))
+
+    context = named("contexts", context or config.get("current-context"))
+    return named("clusters", context.get("cluster")), named("users", context.get("user")) if context.get("user") else {}
+
+
+def build_ssl_context(cluster, user, base_dir):
+    # *-data 字段为 base64 编码的 PEM, 文件路径相对于 kubeconfig 所在目录
+    def path_of(value):
+        return str(pathlib.Path(base_dir, os.path.expanduser(value)))
+
+    ssl_context = ssl.create_default_context()
+    if cluster.get("insecure-skip-tls-verify"):
+        ssl_context.check_hostname = False
+        ssl_context.verify_mode = ssl.CERT_NONE
+    elif cluster.get("certificate-authority-data"):
+        ssl_context.load_verify_locations(cadata=base64.b64decode(cluster.get("certificate-authority-data")).decode())
+    elif cluster.get("certificate-authority"):
+        ssl_context.load_verify_locations(cafile=path_of(cluster.get("certificate-authority")))
+
+    if user.get("client-certificate-data") or user.get("client-certificate"):
+        # load_cert_chain 只接受文件路径, *-data 写入仅当前用户可读的临时目录, 加载后立即删除
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cert_file, key_file = [
+                write_pem(os.path.join(tmp_dir, name), user.get("%s-data" % field)) if user.get("%s-data" % field)
+                else path_of(user.get(field)) for name, field in (("tls.crt", "client-certificate"),
+                                                                  ("tls.key", "client-key"))]
+            ssl_context.load_cert_chain(cert_file, key_file)
+    return ssl_context
+
+
+def write_pem(path, data):
+    with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as f:
+        f.write(base64.b64decode(data))
+    return path
+
+
+class KubeClient:
+    def __init__(self, kubeconfig, timeout=30, max_connections=10):
+        import httpx
+
+        kubeconfig = pathlib.Path(kubeconfig).expanduser()
+        cluster, user = resolve_context(load_kubeconfig(kubeconfig))
+        if user.get("exec") or user.get("auth-provider"):
+            raise KubeConfigError("使用 exec/auth-provider 认证插件, 需要通过 kubectl 访问")
+        if not cluster.get("server"):
+            raise KubeConfigError("kubeconfig 中没有 API Server 地址")
+
+        headers, auth = {"Accept": "application/json"}, None
+        token = user.get("token")
+        if not token and user.get("tokenFile"):
+            with open(pathlib.Path(kubeconfig.parent, user.get("tokenFile")), encoding="utf-8") as f:
+                token = f.read().strip()
+        if token:
+            headers["Authorization"] = "Bearer %s" % token
+        elif user.get("username"):
+            auth = (user.get("username"), user.get("password") or "")
+
+        try:
+            verify = build_ssl_context(cluster, user, kubeconfig.parent) \
+                if cluster.get("server").startswith("https") else True
+        except (OSError, ssl.SSLError) as e:
+            raise KubeConfigError("kubeconfig 中的证书无法加载: %s" % e)
+
+        self.name = kubeconfig.name
+        self.client = httpx.Client(
+            base_url=cluster.get("server").rstrip("/"), verify=verify,
+            headers=headers, auth=auth, timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections))
+
+    def request(self, method, path, **kwargs):
+        import httpx
+
+        try:
+            resp = self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            raise KubeApiError(None, "%s %s: %s" % (method, path, e))
+        if resp.status_code >= 400:
+            # API Server 的错误响应为 Status 对象
+            try:
+                message = resp.json().get("message")
+            except ValueError:
+                message = resp.text.strip()
+            raise KubeApiError(resp.status_code, message)
+        return resp.json()
+
+    def list(self, path, **params):
+        # 按 limit/continue 分页, 避免大集群一次返回全部对象
+        items, params = [], dict(params, limit=500)
+        while True:
+            resp = self.request("GET", path, params={key: value for key, value in params.items() if value})
+            items.extend(resp.get("items") or [])
+            params["continue"] = resp.get("metadata", {}).get("continue")
+            if not params["continue"]:
+                return items
+
+    @staticmethod
+    def secrets_path(namespace, name=None):
+        path = "/api/v1/namespaces/%s/secrets" % urllib.parse.quote(namespace, safe="")
+        return path if name is None else "%s/%s" % (path, urllib.parse.quote(name, safe=""))
+
+    def list_namespaces(self):
+        return [item.get("metadata").get("name") for item in self.list("/api/v1/namespaces")]
+
+    def list_secrets(self, namespace=None, field_selector=None):
+        path = "/api/v1/secrets" if namespace is None else self.secrets_path(namespace)
+        return self.list(path, fieldSelector=field_selector)
+
+    def get_secret(self, namespace, name):
+        try:
+            return self.request("GET", self.secrets_path(namespace, name))
+        except KubeApiError as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def create_secret(self, namespace, secret):
+        return self.request("POST", self.secrets_path(namespace), json=secret)
+
+    def replace_secret(self, namespace, secret):
+        return self.request("PUT", self.secrets_path(namespace, secret.get("metadata").get("name")), json=secret)
+
+    def delete_secret(self, namespace, name):
+        # 与 kubectl delete --ignore-not-found 一致, 不存在时返回 False
+        try:
+            self.request("DELETE", self.secrets_path(namespace, name))
+        except KubeApiError as e:
+            if e.status == 404:
+                return False
+            raise
+        return True
+
+    def close(self):
+        self.client.close()
+
+
+class KubectlClient:
+    # 与 KubeClient 接口相同的 kubectl 后端, 参数以列表传递, 不经过 shell
+    def __init__(self, kubeconfig):
+        self.kubeconfig = pathlib.Path(kubeconfig).expanduser()
+        self.name = self.kubeconfig.name
+
+    def kubectl(self, *args, input=None):
+        cmd = ["kubectl", "--kubeconfig", str(self.kubeconfig)] + list(args)
+        sys.stderr.write("$ %s\n" % " ".join(cmd))
+        try:
+            proc = subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError as e:
+            raise KubeApiError(None, "无法执行 kubectl: %s" % e.strerror)
+        if proc.returncode != 0:
+            raise KubeApiError(None, proc.stderr.decode().strip())
+        return proc.stdout.decode()
+
+    def list_namespaces(self):
+        return [item.get("metadata").get("name")
+                for item in json.loads(self.kubectl("get", "namespaces", "-o", "json")).get("items") or []]
+
+    def list_secrets(self, namespace=None, field_selector=None):
+        args = ["get", "secrets"] + (["--all-namespaces"] if namespace is None else ["--namespace", namespace])
+        if field_selector:
+            args.append("--field-selector=%s" % field_selector)
+        return json.loads(self.kubectl(*args, "-o", "json")).get("items") or []
+
+    def get_secret(self, namespace, name):
+        stdout = self.kubectl("--namespace", namespace, "get", "secret", name, "-o", "json", "--ignore-not-found")
+        return json.loads(stdout) if stdout.strip() else None
+
+    def create_secret(self, namespace, secret):
+        return json.loads(self.kubectl("--namespace", namespace, "create", "-f", "-", "-o", "json",
+                                       input=json.dumps(secret).encode()))
+
+    def replace_secret(self, namespace, secret):
+        return json.loads(self.kubectl("--namespace", namespace, "replace", "-f", "-", "-o", "json",
+                                       input=json.dumps(secret).encode()))
+
+    def delete_secret(self, namespace, name):
+        return bool(self.kubectl("--namespace", namespace, "delete", "secret", name, "--ignore-not-found").strip())
+
+    def close(self):
+        pass
@@ -3,30 +3,54 @@
 
 import argparse
 import base64
+import hashlib
 import json
 import os
 import pathlib
 import re
 import socket
-import subprocess
 import sys
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime, timedelta, timezone
 
-import httpx
-from cryptography import x509
+from opscat.tls_secret_helper.cert_cache import CertCache, utc_of
+from opscat.tls_secret_helper.cluster_executor import ClusterExecutor
+from opscat.tls_secret_helper.kube_client import KubeApiError, KubeClient, KubeConfigError, KubectlClient
 
 
-def run_shell_cmd(cmd, exit_if_non_zero=False, print_cmd=True):
-    if print_cmd:
-        sys.stderr.write(f"$ {cmd}\n")
-    proc = subprocess.Popen(cmd, shell=True,
-                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = proc.communicate()
-    if proc.returncode != 0:
-        sys.stderr.write(stderr.decode())
-        if exit_if_non_zero:
-            sys.exit(proc.returncode)
-    return stdout, stderr
+# httpx, cryptography 导入较慢, 只在发送通知, 解析证书, 访问 API Server 时才导入, --help 等操作不需要
+
+# 访问集群的方式: api 为进程内的 KubeClient, kubectl 为调用 kubectl 命令, auto 在 kubeconfig 无法在进程内认证时使用 kubectl
+backend = "auto"
+# 全局同时进行的 API 请求数, 以及每个集群同时进行的 API 请求数 (同时也是每个集群连接池的大小)
+workers = 8
+cluster_workers = 4
+# {kubeconfig: KubeClient | KubectlClient}, 同一集群的所有操作复用一个客户端及其连接池
+kube_clients = {}
+kube_clients_lock = threading.Lock()
+
+
+def kube_client_of(kubeconfig):
+    kubeconfig = pathlib.Path(kubeconfig).expanduser()
+    with kube_clients_lock:
+        if kubeconfig not in kube_clients:
+            if backend == "kubectl":
+                kube_clients[kubeconfig] = KubectlClient(kubeconfig)
+            else:
+                try:
+                    kube_clients[kubeconfig] = KubeClient(kubeconfig, max_connections=cluster_workers)
+                except KubeConfigError as e:
+                    if backend == "api":
+                        raise
+                    sys.stderr.write(f"{kubeconfig.name}: {e}, 改为使用 kubectl\n")
+                    kube_clients[kubeconfig] = KubectlClient(kubeconfig)
+        return kube_clients[kubeconfig]
+
+
+def close_kube_clients():
+    for client in kube_clients.values():
+        client.close()
+    kube_clients.clear()
 
 
 def wechat_bot_send_text(bot_url, message, mentioned_list=[], mentioned_mobile_list=[]):
@@ -38,6 +62,7 @@ def wechat_bot_send_text(bot_url, message, mentioned_list=[], mentioned_mobile_l
             "mentioned_mobile_list": mentioned_mobile_list
         }
     }
+    import httpx
 
     r = httpx.post(bot_url, json=data)
     return r.json()
@@ -45,6 +70,8 @@ def wechat_bot_send_text(bot_url, message, mentioned_list=[], mentioned_mobile_l
 
 def check_cert_validation(cert, days,
                           namespace="default", excluded_common_names=[]):
+    from cryptography import x509
+
     if isinstance(cert, bytes):
         cert_obj = x509.load_pem_x509_certificate(cert)
         cert_fmt_str = f"namespace/{namespace}\n"
@@ -55,7 +82,7 @@ def check_cert_validation(cert, days,
 
     cert_fmt_str += \
         f"    {cert_obj.subject.rfc4514_string()}\n" + \
-        f"    Not Before: {cert_obj.not_valid_before}, Not After: {cert_obj.not_valid_after}"
+        f"    Not Before: {utc_of(cert_obj, 'not_valid_before')}, Not After: {utc_of(cert_obj, 'not_valid_after')}"
 
     cn = cert_obj.subject.get_attributes_for_oid(
         x509.NameOID.COMMON_NAME)[0].value
@@ -63,25 +90,55 @@ def check_cert_validation(cert, days,
     if cn in excluded_common_names:
         return
 
-    if cert_obj.not_valid_after < datetime.now() + timedelta(days=days):
+    if utc_of(cert_obj, "not_valid_after") < datetime.now(timezone.utc) + timedelta(days=days):
         return cert_fmt_str
 
 
-def check_certs_dir(certs_dir, days, bot_url=False):
-    certs_dir_path = pathlib.Path(certs_dir).expanduser()
-    cert_fmt_str_list = []
-    for certs_dir_file in os.listdir(certs_dir_path):
-        if not certs_dir_file.endswith(".crt"):
-            continue
-        cert_fmt_str = check_cert_validation(
-            certs_dir_path.joinpath(certs_dir_file), days)
-        if cert_fmt_str:
-            cert_fmt_str_list.append(cert_fmt_str)
+def format_bundle_expiry(path, entry, deadline):
+    # bundle 中任一证书 (含中间证书) 在 deadline 前过期时返回提醒, 格式与 check_cert_validation 相同
+    # 无法解析的文件由 check_certs_dir() 单独列出
+    if entry.get("error"):
+        return
+    expiring = [cert for cert in entry.get("certs") if datetime.fromisoformat(cert.get("not_after")) < deadline]
+    if not expiring:
+        return
+    return f"{path}\n" + "\n".join(
+        f"    {cert.get('subject')}\n"
+        f"    Not Before: {datetime.fromisoformat(cert.get('not_before'))}, "
+        f"Not After: {datetime.fromisoformat(cert.get('not_after'))}" for cert in expiring)
+
+
+def check_certs_dir(certs_dir, days, bot_url=False, cache_file=None, workers=None):
+    # 证书元数据来自 CertCache, 未变化的文件不会被重新读取和解析
+    certs_dir_path = pathlib.Path(certs_dir).expanduser().absolute()
+    paths = [str(certs_dir_path.joinpath(certs_dir_file)) for certs_dir_file in sorted(os.listdir(certs_dir_path))
+             if certs_dir_file.endswith(".crt")]
+    cert_cache = CertCache(cache_file)
+    entries = cert_cache.lookup(paths, workers)
+    # 列出目录与读取文件之间被删除的文件不再检查
+    paths = [path for path in paths if path in entries]
+    cert_cache.prune(str(certs_dir_path), paths)
+    try:
+        cert_cache.save()
+    except OSError as e:
+        sys.stderr.write(f"无法写入证书缓存 {cache_file}: {e.strerror}\n")
 
-    if not len(cert_fmt_str_list) > 0:
+    deadline = datetime.now(timezone.utc) + timedelta(days=days)
+    cert_fmt_str_list = [cert_fmt_str for cert_fmt_str in (
+        format_bundle_expiry(path, entries.get(path), deadline) for path in paths) if cert_fmt_str]
+    failed_fmt_str_list = [f"{path}\n    {entries.get(path).get('error')}"
+                           for path in paths if entries.get(path).get("error")]
+
+    if not len(cert_fmt_str_list) > 0 and not len(failed_fmt_str_list) > 0:
         return
-    cert_fmt_str_list.append(
-        f"以上证书将于 {days} 天内过期, 请及时前往 {socket.gethostname()}:{certs_dir} 目录更新证书文件\n")
+    if cert_fmt_str_list:
+        cert_fmt_str_list.append(
+            f"以上证书将于 {days} 天内过期, 请及时前往 {socket.gethostname()}:{certs_dir} 目录更新证书文件\n")
+    # 无法解析的文件不知道有效期, 与即将过期的证书分开列出
+    if failed_fmt_str_list:
+        cert_fmt_str_list.append(f"以下证书文件无法解析, 请检查 {socket.gethostname()}:{certs_dir} 目录下的文件:")
+        cert_fmt_str_list.extend(failed_fmt_str_list)
+        cert_fmt_str_list[-1] += "\n"
     message = "\n".join(cert_fmt_str_list)
     sys.stdout.write(message)
 
@@ -89,65 +146,170 @@ def check_certs_dir(certs_dir, days, bot_url=False):
         wechat_bot_send_text(bot_url, message.rstrip())
 
 
-def check_tls_secrets(kubeconfig, namespaces, domain, days, bot_url=None):
-    kubectl = f"kubectl --kubeconfig {kubeconfig}"
+def list_tls_secrets(kubeconfig):
+    # 一次请求列出集群内所有命名空间的 kubernetes.io/tls 类型 secret, 避免按 namespace, domain 逐个请求
+    return kube_client_of(kubeconfig).list_secrets(field_selector="type=kubernetes.io/tls")
+
+
+def format_age(timestamp):
+    # 与 kubectl get 的 AGE 列格式相同, 如 45s, 12m, 5h, 30d
+    if not timestamp:
+        return "<unknown>"
+    created = datetime.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    seconds = int((datetime.now(timezone.utc) - created).total_seconds())
+    if seconds < 120:
+        return f"{max(seconds, 0)}s"
+    if seconds < 3 * 3600:
+        return f"{seconds // 60}m"
+    if seconds < 48 * 3600:
+        return f"{seconds // 3600}h"
+    return f"{seconds // 86400}d"
+
+
+def format_table(headers, rows):
+    # 与 kubectl get 相同的左对齐表格
+    rows = [headers] + [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(headers))]
+    return "".join("   ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip() + "\n"
+                   for row in rows)
+
+
+def secret_rows(cluster, secrets):
+    return [(cluster, item["metadata"]["namespace"], item["metadata"]["name"], item.get("type", ""),
+             len(item.get("data") or {}), format_age(item["metadata"].get("creationTimestamp"))) for item in secrets]
+
+
+def check_tls_secrets(kubeconfig, namespaces, domain, days, secrets=None):
+    # secrets 为 list_tls_secrets() 的结果, 同一集群检查多个域名时只需获取一次
+    secrets = list_tls_secrets(kubeconfig) if secrets is None else secrets
     secret = "ssl-%s" % domain.replace(".", "-")
+    certs = {item["metadata"]["namespace"]: item.get("data", {}).get("tls.crt") for item in secrets
+             if item.get("metadata", {}).get("name") == secret}
     cert_fmt_str_list = []
     for namespace in namespaces:
-        cert_cmd = f"{kubectl} -n {namespace} get secrets {secret} -o jsonpath='{{.data.tls\.crt}}'"
-        stdout, _ = run_shell_cmd(cert_cmd, exit_if_non_zero=False)
-        if not len(stdout) > 0:
+        if not certs.get(namespace):
             continue
-        cert = base64.b64decode(stdout.decode())
+        cert = base64.b64decode(certs.get(namespace))
         cert_fmt_str = check_cert_validation(cert, days, namespace)
         if cert_fmt_str:
             cert_fmt_str_list.append(cert_fmt_str)
 
+    # 返回过期提醒, 由调用方汇总多个集群的结果后统一输出和发送
     if not len(cert_fmt_str_list) > 0:
         return
     cert_fmt_str_list.append(
         f"集群 {os.path.basename(kubeconfig)} 内 secret/{secret} 证书将于 {days} 天内过期, 请及时更新\n")
-    message = "\n".join(cert_fmt_str_list)
-    sys.stdout.write(message)
-
-    if bot_url:
-        wechat_bot_send_text(bot_url, message.rstrip())
+    return "\n".join(cert_fmt_str_list)
 
 
-def tls_secret_helper(kubeconfig, namespaces, domain, action, certs_dir):
-    kubeconfig = pathlib.Path(kubeconfig).expanduser() \
-        if not isinstance(kubeconfig, pathlib.Path) else kubeconfig
-    certs_dir_path = pathlib.Path(certs_dir).expanduser()
-    cert = certs_dir_path.joinpath("%s_bundle.crt" % domain)
-    key = certs_dir_path.joinpath("%s.key" % domain)
-    secret = "ssl-%s" % domain.replace(".", "-")
+def tls_secret_manifest(secret, cert, key):
+    # 与 kubectl create secret tls 生成的对象相同
+    with open(cert, "rb") as f:
+        cert_data = f.read()
+    with open(key, "rb") as f:
+        key_data = f.read()
+    return {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": secret}, "type": "kubernetes.io/tls",
+            "data": {"tls.crt": base64.b64encode(cert_data).decode(), "tls.key": base64.b64encode(key_data).decode()}}
 
-    for namespace in namespaces:
-        kubectl = f"kubectl --kubeconfig {kubeconfig} --namespace {namespace}"
-        del_cmd = f"{kubectl} delete secret {secret} --ignore-not-found"
-        add_cmd = f"{kubectl} create secret tls {secret} --key {key} --cert {cert}"
 
-        run_shell_cmd(del_cmd, exit_if_non_zero=True)
-        if action == "add":
-            run_shell_cmd(add_cmd, exit_if_non_zero=True)
+def secret_fingerprint(data):
+    # secret data 字段 (base64 编码) 中 tls.crt, tls.key 内容的 SHA-256, 本地文件生成的 manifest 与集群内的 secret 使用同一算法
+    sha256 = hashlib.sha256()
+    for field in ("tls.crt", "tls.key"):
+        sha256.update(base64.b64decode((data or {}).get(field) or ""))
+        sha256.update(b"\0")
+    return sha256.hexdigest()
 
 
-def get_namespaces(kubeconfig, args):
+def load_tls_manifests(domains, certs_dir):
+    # 返回 ([(命名空间, secret, 结果, 错误信息)], {secret: manifest}), 证书文件无法读取的域名记为失败
+    certs_dir_path = pathlib.Path(certs_dir).expanduser()
+    rows, manifests = [], {}
+    for domain in domains:
+        secret = "ssl-%s" % domain.replace(".", "-")
+        try:
+            manifests[secret] = tls_secret_manifest(secret, certs_dir_path.joinpath("%s_bundle.crt" % domain),
+                                                    certs_dir_path.joinpath("%s.key" % domain))
+        except OSError as e:
+            rows.append(("-", secret, "failed", f"{e.filename}: {e.strerror}"))
+    return rows, manifests
+
+
+def tls_secret_helper(kubeconfig, namespaces, domains, action, certs_dir, executor):
+    # 在一个集群内为 domains 添加或删除 TLS Secret, 各命名空间的请求通过 executor 并发执行,
+    # 返回 [(命名空间, secret, 结果, 错误信息)], 单个命名空间失败不影响其他命名空间
+    client = kube_client_of(kubeconfig)
+    if action == "add":
+        rows, manifests = load_tls_manifests(domains, certs_dir)
+    else:
+        rows, manifests = [], {"ssl-%s" % domain.replace(".", "-"): None for domain in domains}
+    items = [(namespace, secret, manifest) for secret, manifest in manifests.items() for namespace in namespaces]
+
+    def apply(item):
+        namespace, secret, manifest = item
+        try:
+            deleted = client.delete_secret(namespace, secret)
+            if action == "add":
+                client.create_secret(namespace, manifest)
+                return namespace, secret, "created", ""
+            return namespace, secret, "deleted" if deleted else "not found", ""
+        except KubeApiError as e:
+            return namespace, secret, "failed", str(e)
+
+    return rows + executor.map(kubeconfig, apply, items)
+
+
+def tls_secret_rollout(kubeconfig, namespaces, domains, certs_dir, executor, secrets):
+    # 与 add 不同, 不先删除再创建: secrets 为 list_tls_secrets() 的结果, 证书与私钥的指纹与本地文件一致的命名空间直接跳过,
+    # 其余命名空间只发送一个请求, 已存在时按 resourceVersion 原地替换 (期间 secret 始终可用), 不存在时创建
+    client = kube_client_of(kubeconfig)
+    rows, manifests = load_tls_manifests(domains, certs_dir)
+    deployed = {(item["metadata"]["namespace"], item["metadata"]["name"]): item for item in secrets}
+    # plan 中未变化的命名空间为结果行, 需要更新的为 None, 按原顺序填入请求结果
+    plan, items = [], []
+    for secret, manifest in manifests.items():
+        fingerprint = secret_fingerprint(manifest.get("data"))
+        for namespace in namespaces:
+            current = deployed.get((namespace, secret))
+            if current is not None and secret_fingerprint(current.get("data")) == fingerprint:
+                plan.append((namespace, secret, "unchanged", ""))
+            else:
+                plan.append(None)
+                items.append((namespace, secret, manifest, current))
+
+    def apply(item):
+        namespace, secret, manifest, current = item
+        try:
+            if current is None:
+                client.create_secret(namespace, manifest)
+                return namespace, secret, "created", ""
+            # 保留已有的 labels, annotations, resourceVersion 保证不会覆盖期间被其他人修改的 secret
+            metadata = {key: current["metadata"][key] for key in ("name", "namespace", "resourceVersion",
+                                                                  "labels", "annotations")
+                        if key in current["metadata"]}
+            client.replace_secret(namespace, dict(manifest, metadata=metadata))
+            return namespace, secret, "replaced", ""
+        except KubeApiError as e:
+            return namespace, secret, "failed", str(e)
+
+    results = iter(executor.map(kubeconfig, apply, items))
+    return rows + [row if row is not None else next(results) for row in plan]
+
+
+def filter_namespaces(namespaces):
     exclude_prefix = r"^(c|p|u|cattle|cluster-fleet|fleet|istio|kube|mesh|rancher|tcr|tke-cluster|user)-"
     exclude_full = r"^(ambassador|kubernetes-dashboard|kuboard|lens-metrics|my-eclipse-che|nacos|operators|spark-operator|tutorial)$"
-    kubeconfig = pathlib.Path(kubeconfig).expanduser() \
-        if not isinstance(kubeconfig, pathlib.Path) else kubeconfig
-    namespaces_cmd = f"kubectl --kubeconfig {kubeconfig} get namespaces -oname"
-    stdout, _ = run_shell_cmd(namespaces_cmd, exit_if_non_zero=True)
-    namespaces = [ns.strip().split("/")[1] for ns in stdout.decode().split()] \
-        if not args.namespaces else [ns.strip() for ns in args.namespaces.split(",")]
-    namespaces_filtered = [ns for ns in namespaces
-                           if not re.match(exclude_prefix, ns) and not re.match(exclude_full, ns)]
+    return [ns for ns in namespaces if not re.match(exclude_prefix, ns) and not re.match(exclude_full, ns)]
 
-    return namespaces_filtered
+
+def get_namespaces(kubeconfig, args):
+    if args.namespaces:
+        return filter_namespaces([ns.strip() for ns in args.namespaces.split(",")])
+    return filter_namespaces(kube_client_of(kubeconfig).list_namespaces())
 
 
-def action_tls_wrapper(args):
+def action_tls_wrapper(args, executor):
+    # 各集群并发执行, 全部完成后按集群顺序输出汇总结果, 返回失败的集群与操作数
     try:
         action = args.action.split(":")[1]
     except IndexError:
@@ -168,33 +330,79 @@ def action_tls_wrapper(args):
         kubeconfig_list = [kubeconfig_dir_default.joinpath(
             k) for k in config.keys()]
 
-    # action tls:list
-    if action == "list":
-        for kubeconfig in kubeconfig_list:
-            kubectl = f"kubectl --kubeconfig {kubeconfig}"
-            list_cmd = f"{kubectl} get secrets --all-namespaces --field-selector=type=kubernetes.io/tls"
-            stdout, _ = run_shell_cmd(list_cmd, exit_if_non_zero=False)
-            if not len(stdout) > 0:
-                continue
-            sys.stdout.write(stdout.decode())
-        return
-
-    # action tls:check, tls:add, tls:delete
-    for kubeconfig in kubeconfig_list:
-        namespaces = get_namespaces(kubeconfig, args)
+    def domains_of(kubeconfig):
         domain_key = os.path.basename(kubeconfig) \
             .replace("dev", "test").replace("uat", "prod")
-        domains = config.get(domain_key) or [] \
+        return config.get(domain_key) or [] \
             if not args.domain else [args.domain]
-        for domain in domains:
-            if action == "check":
-                check_tls_secrets(kubeconfig, namespaces,
-                                  domain, args.days, args.bot)
-            elif action in ["add", "del", "delete"]:
-                tls_secret_helper(kubeconfig, namespaces,
-                                  domain, action, args.certs_dir)
-            else:
-                argument_parser().print_help()
+
+    # action tls:list
+    if action == "list":
+        outcomes = executor.run(kubeconfig_list, lambda kubeconfig: executor.call(
+            kubeconfig, list_tls_secrets, kubeconfig))
+        rows = [row for kubeconfig, (secrets, _) in zip(kubeconfig_list, outcomes) if secrets
+                for row in secret_rows(os.path.basename(kubeconfig), secrets)]
+        if len(rows) > 0:
+            sys.stdout.write(format_table(("CLUSTER", "NAMESPACE", "NAME", "TYPE", "DATA", "AGE"), rows))
+        return print_cluster_errors(kubeconfig_list, outcomes)
+
+    # action tls:check
+    if action == "check":
+        def check_cluster(kubeconfig):
+            # 每个集群只请求一次获取全部 TLS secret, 再在本地按 namespace, secret 名称过滤;
+            # 未指定 -n 时只需检查存在 TLS secret 的命名空间, 同样按 get_namespaces 的规则排除系统命名空间
+            secrets = executor.call(kubeconfig, list_tls_secrets, kubeconfig)
+            namespaces = get_namespaces(kubeconfig, args) if args.namespaces else filter_namespaces(
+                sorted({item["metadata"]["namespace"] for item in secrets}))
+            return [check_tls_secrets(kubeconfig, namespaces, domain, args.days, secrets)
+                    for domain in domains_of(kubeconfig)]
+
+        outcomes = executor.run(kubeconfig_list, check_cluster)
+        for messages, _ in outcomes:
+            for message in filter(None, messages or []):
+                sys.stdout.write(message)
+                if args.bot:
+                    wechat_bot_send_text(args.bot, message.rstrip())
+        return print_cluster_errors(kubeconfig_list, outcomes)
+
+    # action tls:add, tls:delete, tls:rollout
+    return tls_rollout(executor, kubeconfig_list, domains_of, args, action)
+
+
+def tls_rollout(executor, kubeconfig_list, domains_of, args, action):
+    def rollout_cluster(kubeconfig):
+        namespaces = executor.call(kubeconfig, get_namespaces, kubeconfig, args)
+        if action == "rollout":
+            secrets = executor.call(kubeconfig, list_tls_secrets, kubeconfig)
+            return tls_secret_rollout(kubeconfig, namespaces, domains_of(kubeconfig), args.certs_dir, executor,
+                                      secrets)
+        return tls_secret_helper(kubeconfig, namespaces, domains_of(kubeconfig), action, args.certs_dir, executor)
+
+    rows = []
+    for kubeconfig, (results, error) in zip(kubeconfig_list, executor.run(kubeconfig_list, rollout_cluster)):
+        cluster = os.path.basename(kubeconfig)
+        if error is not None:
+            rows.append((cluster, "-", "-", "failed", error_message(error)))
+            continue
+        rows.extend((cluster,) + row for row in results)
+    if len(rows) > 0:
+        sys.stdout.write(format_table(("CLUSTER", "NAMESPACE", "SECRET", "RESULT", "ERROR"), rows))
+    failed = sum(1 for row in rows if row[3] == "failed")
+    sys.stderr.write(f"clusters: {len(kubeconfig_list)}, operations: {len(rows)}, failed: {failed}\n")
+    return failed
+
+
+def error_message(e):
+    return str(e) if isinstance(e, (KubeApiError, KubeConfigError)) else f"{type(e).__name__}: {e}"
+
+
+def print_cluster_errors(kubeconfig_list, outcomes):
+    failed = 0
+    for kubeconfig, (_, error) in zip(kubeconfig_list, outcomes):
+        if error is not None:
+            failed += 1
+            sys.stderr.write(f"{os.path.basename(kubeconfig)}: {error_message(error)}\n")
+    return failed
 
 
 def argument_parser():
@@ -203,8 +411,8 @@ def argument_parser():
     certs_dir_default = pathlib.Path("/etc/pki/tls-secret-helper")
     config_default = certs_dir_default.joinpath("config.json")
     action_choices = [
-        "check", "add", "delete",
-        "tls:list", "tls:check", "tls:add", "tls:delete"
+        "check", "add", "delete", "rollout",
+        "tls:list", "tls:check", "tls:add", "tls:delete", "tls:rollout"
     ]
     action_default = action_choices[0]
     epilog = '''
@@ -221,6 +429,9 @@ def argument_parser():
     --action tls:add, 批量添加 TLS Secrets, 可配合 -k, -d, -n 可选参数限定操作范围
     --action tls:delete, 批量删除 TLS Secrets, 可配合 -k, -d, -n 可选参数限定操作范围
 
+    --action rollout, tls:rollout, 与 add, tls:add 相同, 但跳过证书与私钥未变化的命名空间,
+        需要更新的 secret 原地替换, 不会先删除
+
 EXAMPLES:
     为特定集群添加单个证书, 需要同时指定 -k, -d, -n 选项
     $ tls-secret-helper -a add -k ~/.kube/config -d example.com -n default,prod
@@ -249,37 +460,64 @@ EXAMPLES:
     parser.add_argument("-n", "--namespaces",
                         help="逗号分隔 namespaces 列表, 默认为该集群中所有命名空间.")
 
+    parser.add_argument("--workers", default=8, type=int,
+                        help="所有集群合计同时进行的 API 请求数, 多个集群并发执行 (default: %(default)s)")
+    parser.add_argument("--cluster-workers", default=4, type=int,
+                        help="每个集群同时进行的 API 请求数 (default: %(default)s)")
+    parser.add_argument("--backend", choices=["auto", "api", "kubectl"], default="auto",
+                        help="访问集群的方式: api 为直接请求 API Server, kubectl 为调用 kubectl 命令,\n"
+                             "auto 在 kubeconfig 使用 exec 等认证插件时改用 kubectl (default: %(default)s)")
+
     check_group = parser.add_argument_group("--action 为 [check|tls:check] 时")
     check_group.add_argument("--days", default=30, type=int, help="证书过期门限天数")
     check_group.add_argument("--bot", default=None,
                              help="企业微信群机器人 URL, 用于发送证书过期提醒")
+    check_group.add_argument("--cache-file", default=None,
+                             help="check 使用的证书元数据缓存文件, 未变化的证书文件不会重新解析\n"
+                                  "(default: --config-file 所在目录下的 cache/cert-metadata.json)")
+    check_group.add_argument("--no-cache", action="store_true", help="check 不读写证书元数据缓存")
+    check_group.add_argument("--parse-workers", default=os.cpu_count() or 1, type=int,
+                             help="check 并行解析证书文件的进程数 (default: %(default)s)")
 
     return parser
 
 
 def main():
+    global backend, workers, cluster_workers
+
     args = argument_parser().parse_args()
+    backend = args.backend
+    workers, cluster_workers = max(1, args.workers), max(1, args.cluster_workers)
+    executor = ClusterExecutor(workers, cluster_workers)
+    try:
+        failed = run(args, executor)
+    finally:
+        executor.shutdown()
+        close_kube_clients()
+    # 部分集群或操作失败时, 其他集群仍会执行完毕, 最后以非 0 状态退出
+    if failed:
+        sys.exit(1)
 
+
+def run(args, executor):
     # action check
     if args.action == "check":
-        check_certs_dir(args.certs_dir, args.days, args.bot)
+        cache_file = None if args.no_cache else args.cache_file or os.path.join(
+            os.path.dirname(os.path.expanduser(args.config_file)), "cache", "cert-metadata.json")
+        check_certs_dir(args.certs_dir, args.days, args.bot, cache_file, args.parse_workers)
         return
 
-    # action: add, delete
-    if args.action in ["add", "del", "delete"]:
+    # action: add, delete, rollout
+    if args.action in ["add", "del", "delete", "rollout"]:
         # FIXME: 此种情况下 --namespaces 选项是必要的吗?
         if not all([args.kubeconfig, args.domain, args.namespaces]):
             sys.stderr.write("执行 %s 操作时, 必须同时设置 -k, -d, -n 选项\n" % args.action)
             return
-        namespaces = get_namespaces(args.kubeconfig, args)
-        tls_secret_helper(args.kubeconfig, namespaces,
-                          args.domain, args.action, args.certs_dir)
-        return
+        return tls_rollout(executor, [pathlib.Path(args.kubeconfig)], lambda _: [args.domain], args, args.action)
 
-    # action tls:list, tls:add, tls:delete
+    # action tls:list, tls:check, tls:add, tls:delete, tls:rollout
     if args.action.startswith("tls:"):
-        action_tls_wrapper(args)
-        return
+        return action_tls_wrapper(args, executor)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+# coding: utf-8
+# 测试共用的 fixture: 每个测试使用独立的 Alidns 替身服务与配置目录, 以子进程方式运行 alidns 命令行,
+# 避免 alidns 模块级的全局状态 (限速, 缓存, 预写日志等) 在测试之间互相影响
+
+import os
+import sys
+import json
+import subprocess
+
+import pytest
+
+from opscat.alidns.fakeserver import FakeAlidnsServer
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def fake_server():
+    # example.com 下预置 host-0 ~ host-4 共 5 条 A 记录, 记录值为 10.0.0.0 ~ 10.0.0.4
+    server = FakeAlidnsServer().start()
+    server.alidns.add_zone("example.com", 5)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def alidns_cli(tmp_path, fake_server):
+    config_file = tmp_path / "config" / "config.json"
+    config_file.parent.mkdir()
+    config_file.write_text(json.dumps({"ak": "test", "secret": "test", "region": "cn-hangzhou"}))
+    env = dict(os.environ, HOME=str(tmp_path), ACS_ENDPOINT=fake_server.endpoint, PYTHONPATH=ROOT_DIR)
+
+    def run(*args, stdin=""):
+        return subprocess.run(
+            [sys.executable, "-m", "opscat.alidns.alidns", "-c", str(config_file)] + list(args),
+            input=stdin, env=env, capture_output=True, text=True, timeout=60)
+
+    run.config_dir = config_file.parent
+    run.env = env
+    return run
+
+
+def jsonl_of(output):
+    return [json.loads(line) for line in output.splitlines() if line.strip()]
+
+
+def zone_records(server, domain="example.com"):
+    return sorted((record.get("RR"), record.get("Type"), record.get("Value"))
+                  for record in server.alidns.zones.get(domain).values())
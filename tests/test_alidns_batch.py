@@ -0,0 +1,69 @@
+# coding: utf-8
+
+from conftest import jsonl_of, zone_records
+
+
+BATCH_HEADER = "action,domain,type,record,line,value,priority,ttl,status,remark\n"
+
+
+def batch_results(proc):
+    return {result.get("Row"): result.get("Result") for result in jsonl_of(proc.stdout)}
+
+
+def test_batch_resume_skips_completed_rows(alidns_cli, fake_server, tmp_path):
+    batch = tmp_path / "batch.csv"
+    batch.write_text(BATCH_HEADER
+                     + "add,example.com,A,www,default,1.1.1.1,,600,Enable,\n"
+                     # 与已有记录重复, 第一次执行失败
+                     + "add,example.com,A,host-0,default,10.0.0.0,,600,Enable,\n"
+                     + "update,example.com,A,host-1,default,192.168.0.1,,600,Enable,\n"
+                     + "delete,example.com,A,host-2,default,,,600,Enable,\n")
+    proc = alidns_cli("-a", "batch", "-b", str(batch), "-o", "jsonl")
+    assert proc.returncode == 1
+    assert batch_results(proc) == {2: "ok", 3: "failed", 4: "ok", 5: "ok"}
+    assert len(list((alidns_cli.config_dir / "cache" / "journals").iterdir())) == 1
+
+    # 清除冲突的记录后续跑, 已完成的行不再请求 API
+    fake_server.alidns.remove_record(next(record for record in fake_server.alidns.records.values()
+                                          if record.get("RR") == "host-0"))
+    fake_server.requests.clear()
+    proc = alidns_cli("-a", "batch", "-b", str(batch), "-o", "jsonl", "--resume")
+    assert proc.returncode == 0, proc.stderr
+    assert batch_results(proc) == {2: "done", 3: "ok", 4: "done", 5: "done"}
+    assert dict(fake_server.requests) == {"AddDomainRecord": 1}
+    assert zone_records(fake_server) == [
+        ("host-0", "A", "10.0.0.0"),
+        ("host-1", "A", "192.168.0.1"),
+        ("host-3", "A", "10.0.0.3"),
+        ("host-4", "A", "10.0.0.4"),
+        ("www", "A", "1.1.1.1"),
+    ]
+
+    # 全部完成后再次续跑不会有任何请求
+    fake_server.requests.clear()
+    proc = alidns_cli("-a", "batch", "-b", str(batch), "-o", "jsonl", "--resume")
+    assert proc.returncode == 0, proc.stderr
+    assert set(batch_results(proc).values()) == {"done"}
+    assert not fake_server.requests
+
+
+def test_batch_resume_ignores_journal_of_changed_file(alidns_cli, fake_server, tmp_path):
+    batch = tmp_path / "batch.csv"
+    batch.write_text(BATCH_HEADER + "add,example.com,A,www,default,1.1.1.1,,600,Enable,\n")
+    assert alidns_cli("-a", "batch", "-b", str(batch), "-o", "jsonl").returncode == 0
+
+    # 预写日志按文件内容的哈希命名, 修改过的文件从头执行
+    batch.write_text(BATCH_HEADER + "add,example.com,A,www,default,2.2.2.2,,600,Enable,\n")
+    proc = alidns_cli("-a", "batch", "-b", str(batch), "-o", "jsonl", "--resume")
+    assert proc.returncode == 0, proc.stderr
+    assert batch_results(proc) == {2: "ok"}
+    assert ("www", "A", "2.2.2.2") in zone_records(fake_server)
+
+
+def test_batch_from_stdin_is_not_journaled(alidns_cli, fake_server):
+    stdin = BATCH_HEADER + "add,example.com,A,www,default,1.1.1.1,,600,Enable,\n"
+    proc = alidns_cli("-a", "batch", "-b", "-", "-o", "jsonl", "--resume", stdin=stdin)
+    assert proc.returncode == 0, proc.stderr
+    assert "无法使用 --resume" in proc.stderr
+    assert batch_results(proc) == {2: "ok"}
+    assert not (alidns_cli.config_dir / "cache" / "journals").exists()
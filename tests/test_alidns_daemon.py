@@ -0,0 +1,98 @@
+# coding: utf-8
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+import pytest
+
+from opscat.alidns import daemon
+
+from conftest import jsonl_of
+
+
+@pytest.fixture
+def start_daemon(alidns_cli):
+    # Unix socket 路径长度有限制 (约 108 字节), 不放在较深的 tmp_path 下
+    socket_dir = tempfile.mkdtemp(prefix="alidns-")
+    processes = []
+
+    def start(*args):
+        socket_path = os.path.join(socket_dir, "alidns-%d.sock" % len(processes))
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "opscat.alidns.alidns", "-c", str(alidns_cli.config_dir / "config.json"),
+             "-a", "daemon", "--socket", socket_path] + list(args),
+            env=alidns_cli.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        processes.append(proc)
+        deadline = time.monotonic() + 30
+        while not daemon.ping(socket_path):
+            assert proc.poll() is None, proc.stderr.read().decode()
+            assert time.monotonic() < deadline, "alidns daemon did not start"
+            time.sleep(0.05)
+        return socket_path
+
+    yield start
+    for proc in processes:
+        proc.terminate()
+        proc.wait(timeout=10)
+        proc.stderr.close()
+    shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+def test_search_queries_by_keyword(start_daemon, fake_server):
+    fake_server.alidns.add_zone("example.net", 300)
+    socket_path = start_daemon()
+    response = daemon.request(socket_path, {"action": "search:exact", "domain": "example.net", "keyword": "host-7"})
+    assert response.get("ok"), response
+    assert [record.get("Value") for record in response.get("records")] == ["10.0.0.7"]
+    # 未启用本地快照时不为一次查询拉取整个记录集 (300 条记录需要 3 页)
+    assert dict(fake_server.requests) == {"DescribeDomainRecords": 1}
+
+
+def test_search_with_zone_cache_fetches_zone_once(start_daemon, fake_server):
+    socket_path = start_daemon("--cache-ttl", "300")
+    for keyword in ("host-1", "host-2", "host-3"):
+        response = daemon.request(socket_path, {"action": "search", "domain": "example.com", "keyword": keyword})
+        assert [record.get("RR") for record in response.get("records")] == [keyword]
+    assert dict(fake_server.requests) == {"DescribeDomainRecords": 1}
+
+
+def test_write_api_calls_include_lookup(start_daemon, fake_server):
+    socket_path = start_daemon()
+    response = daemon.request(socket_path, {
+        "action": "update", "domain": "example.com", "record": "host-1", "type": "A", "value": "192.168.0.1"})
+    assert response.get("ok"), response
+    # 响应中的 api_calls 与替身服务实际收到的请求一致, 包括按 RR 查找记录的请求
+    assert response.get("api_calls") == dict(fake_server.requests)
+    assert response.get("api_calls").get("DescribeDomainRecords") == 1
+    assert response.get("api_calls").get("UpdateDomainRecord") == 1
+
+    fake_server.requests.clear()
+    response = daemon.request(socket_path, {
+        "action": "delete", "domain": "example.com", "record": "host-2", "type": "A"})
+    assert response.get("ok"), response
+    assert response.get("api_calls") == dict(fake_server.requests)
+    assert response.get("api_calls").get("DeleteDomainRecord") == 1
+
+
+def test_ambiguous_write_requires_record_id(start_daemon, fake_server):
+    fake_server.alidns.insert_record("example.com", "host-1", "A", "10.9.9.9")
+    socket_path = start_daemon()
+    response = daemon.request(socket_path, {
+        "action": "update", "domain": "example.com", "record": "host-1", "type": "A", "value": "192.168.0.1"})
+    assert not response.get("ok")
+    assert "record_id" in response.get("error")
+    assert dict(fake_server.requests) == {"DescribeDomainRecords": 1}
+
+
+def test_cli_forwards_to_daemon(alidns_cli, start_daemon, fake_server):
+    socket_path = start_daemon()
+    proc = alidns_cli("-a", "search:exact", "-d", "example.com", "-k", "host-3", "--socket", socket_path,
+                      "-o", "jsonl")
+    assert proc.returncode == 0, proc.stderr
+    assert [record.get("RecordId") for record in jsonl_of(proc.stdout)] == [
+        record.get("RecordId") for record in fake_server.alidns.records.values() if record.get("RR") == "host-3"]
+    assert dict(fake_server.requests) == {"DescribeDomainRecords": 1}
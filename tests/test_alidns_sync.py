@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import random
+
+from opscat.alidns import alidns
+
+from conftest import jsonl_of, zone_records
+
+
+def live_record(record_id, rr, resolv_type, value, ttl=600):
+    return {"RecordId": record_id, "RR": rr, "Type": resolv_type, "Value": value, "TTL": ttl,
+            "Status": "ENABLE", "Remark": ""}
+
+
+def desired_record(rr, resolv_type, value, ttl=""):
+    return {"type": resolv_type, "record": rr, "value": value, "ttl": ttl, "priority": "", "status": "", "remark": ""}
+
+
+def test_diff_zone_minimal_changes():
+    live = [
+        live_record("1", "www", "A", "1.1.1.1"),
+        live_record("2", "www", "A", "2.2.2.2"),
+        live_record("3", "mail", "A", "3.3.3.3"),
+        live_record("4", "old", "TXT", "bye"),
+    ]
+    desired = [
+        desired_record("www", "A", "1.1.1.1", ttl="300"),
+        desired_record("www", "A", "9.9.9.9"),
+        desired_record("mail", "A", "3.3.3.3"),
+        desired_record("new", "CNAME", "example.net"),
+    ]
+    changes = alidns.diff_zone("example.com", desired, live)
+    assert [(change.get("action"), change.get("record"), change.get("value"), change.get("record_id"))
+            for change in changes] == [
+        ("update", "www", "1.1.1.1", "1"),
+        ("add", "new", "example.net", None),
+        ("delete", "old", "bye", "4"),
+        ("update", "www", "9.9.9.9", "2"),
+    ]
+
+
+def test_diff_zone_order_is_deterministic():
+    # 线上记录的返回顺序不影响计划
+    live = [live_record(str(i), "host-%d" % (i % 3), "A", "10.0.0.%d" % i) for i in range(9)]
+    desired = [desired_record("host-%d" % (i % 4), "A", "10.1.0.%d" % i) for i in range(8)]
+    expected = alidns.diff_zone("example.com", desired, live)
+    for seed in range(5):
+        shuffled = list(live)
+        random.Random(seed).shuffle(shuffled)
+        assert alidns.diff_zone("example.com", desired, shuffled) == expected
+
+
+def test_sync_applies_plan(alidns_cli, fake_server, tmp_path):
+    desired = tmp_path / "example.com.csv"
+    desired.write_text("type,record,value,priority,ttl,status,remark\n"
+                       "A,host-0,10.0.0.0,,,,\n"
+                       "A,host-1,10.0.0.1,,,,\n"
+                       "A,host-2,192.168.0.2,,,,\n"
+                       "TXT,_acme-challenge,\"v=1, token\",,,,\n")
+    proc = alidns_cli("-a", "sync", "-d", "example.com", "-b", str(desired), "-y", "-o", "jsonl")
+    assert proc.returncode == 0, proc.stderr
+    results = jsonl_of(proc.stdout)
+    assert sorted(result.get("Result") for result in results if "Result" in result) == ["ok"] * 4
+    assert zone_records(fake_server) == [
+        ("_acme-challenge", "TXT", "v=1, token"),
+        ("host-0", "A", "10.0.0.0"),
+        ("host-1", "A", "10.0.0.1"),
+        ("host-2", "A", "192.168.0.2"),
+    ]
+
+    # 再次同步时线上记录已与期望状态一致, 不再有写请求
+    fake_server.requests.clear()
+    proc = alidns_cli("-a", "sync", "-d", "example.com", "-b", str(desired), "-y")
+    assert proc.returncode == 0, proc.stderr
+    assert set(fake_server.requests) == {"DescribeDomainRecords"}
+
+
+def test_sync_refuses_other_domain(alidns_cli, fake_server, tmp_path):
+    desired = tmp_path / "example.net.csv"
+    desired.write_text("domain,type,record,value\n"
+                       "example.com,A,host-0,10.0.0.0\n"
+                       "example.net,A,www,1.1.1.1\n")
+    before = zone_records(fake_server)
+    proc = alidns_cli("-a", "sync", "-d", "example.com", "-b", str(desired), "-y")
+    assert proc.returncode == 1
+    assert "line 3: example.net" in proc.stderr
+    assert zone_records(fake_server) == before
+    assert not fake_server.requests
+
+
+def test_sync_empty_requires_allow_empty(alidns_cli, fake_server, tmp_path):
+    desired = tmp_path / "example.com.csv"
+    desired.write_text("type,record,value,priority,ttl,status,remark\n")
+    proc = alidns_cli("-a", "sync", "-d", "example.com", "-b", str(desired), "-y")
+    assert proc.returncode == 1
+    assert "--allow-empty" in proc.stderr
+    assert len(zone_records(fake_server)) == 5
+    assert not fake_server.requests
+
+    proc = alidns_cli("-a", "sync", "-d", "example.com", "-b", str(desired), "-y", "--allow-empty")
+    assert proc.returncode == 0, proc.stderr
+    assert zone_records(fake_server) == []
+    assert fake_server.requests.get("DeleteDomainRecord") == 5
@@ -0,0 +1,80 @@
+# coding: utf-8
+
+from opscat.alidns.log_store import LogStore
+
+from conftest import jsonl_of
+
+
+def domain_log(action_time, timestamp, action="ADD", message="www A 1.1.1.1"):
+    return {"ActionTime": action_time, "ActionTimestamp": timestamp, "Action": action,
+            "Message": message, "ClientIp": "127.0.0.1"}
+
+
+def test_high_water_mark(tmp_path):
+    log_store = LogStore(str(tmp_path / "logs.sqlite3"))
+    assert log_store.high_water_mark("default", "domain") is None
+    assert log_store.append("default", "domain", "", [
+        domain_log("2026-01-02T08:00Z", 1767340800000),
+        domain_log("2026-01-01T08:00Z", 1767254400000),
+    ]) == 2
+    assert log_store.high_water_mark("default", "domain") == "2026-01-02T08:00Z"
+
+    # 高水位不会因为较早的日志而回退, 重复的日志被忽略, 同一分钟内的另一条操作照常写入
+    assert log_store.append("default", "domain", "", [
+        domain_log("2026-01-01T08:00Z", 1767254400000),
+        domain_log("2026-01-02T08:00Z", 1767340800000),
+        domain_log("2026-01-02T08:00Z", 1767340830000),
+    ]) == 1
+    assert log_store.high_water_mark("default", "domain") == "2026-01-02T08:00Z"
+
+    # 没有新日志时不写入高水位
+    assert log_store.append("default", "record", "example.com", []) == 0
+    assert log_store.high_water_mark("default", "record", "example.com") is None
+    log_store.close()
+
+
+def test_high_water_mark_is_scoped(tmp_path):
+    log_store = LogStore(str(tmp_path / "logs.sqlite3"))
+    log_store.append("default", "record", "example.com", [domain_log("2026-01-02T08:00Z", 1767340800000)])
+    log_store.append("prod", "record", "example.com", [domain_log("2026-03-01T08:00Z", 1772352000000)])
+    log_store.append("default", "record", "example.net", [domain_log("2026-02-01T08:00Z", 1769932800000)])
+    assert log_store.high_water_mark("default", "record", "example.com") == "2026-01-02T08:00Z"
+    assert log_store.high_water_mark("prod", "record", "example.com") == "2026-03-01T08:00Z"
+    assert log_store.high_water_mark("default", "record", "example.net") == "2026-02-01T08:00Z"
+    assert log_store.high_water_mark("default", "domain") is None
+    assert len(list(log_store.query("default", "record", "example.com"))) == 1
+    log_store.close()
+
+
+def test_log_sync_starts_from_high_water_mark(alidns_cli, fake_server):
+    fake = fake_server.alidns
+    fake.logs.extend([
+        dict(domain_log("2026-01-01T08:00Z", 1767254400000), DomainName="example.com"),
+        dict(domain_log("2026-01-05T08:00Z", 1767600000000, action="DEL"), DomainName="example.com"),
+    ])
+    start_dates = []
+    describe_domain_logs = fake.DescribeDomainLogs
+
+    def record_start_date(params):
+        start_dates.append(params.get("StartDate"))
+        return describe_domain_logs(params)
+
+    fake.DescribeDomainLogs = record_start_date
+
+    proc = alidns_cli("-a", "logs:domain", "--log-store", "-S", "2025-12-01", "-o", "jsonl")
+    assert proc.returncode == 0, proc.stderr
+    assert "新增 2 条" in proc.stderr
+    assert [log.get("ActionTime") for log in jsonl_of(proc.stdout)] == ["2026-01-05T08:00Z", "2026-01-01T08:00Z"]
+    assert set(start_dates) == {"2025-12-01"}
+
+    # 第二次同步从高水位所在日期开始, 当天已同步的日志不会重复写入
+    fake.logs.append(dict(domain_log("2026-01-05T09:30Z", 1767605400000), DomainName="example.com"))
+    start_dates.clear()
+    proc = alidns_cli("-a", "logs:domain", "--log-store", "-S", "2025-12-01", "-o", "jsonl")
+    assert proc.returncode == 0, proc.stderr
+    assert "新增 1 条" in proc.stderr
+    assert set(start_dates) == {"2026-01-05"}
+    assert len(jsonl_of(proc.stdout)) == 3
+
+    proc = alidns_cli("-a", "logs:domain", "--log-store", "-S", "2025-12-01", "--log-action", "del", "-o", "jsonl")
+    assert [log.get("Action") for log in jsonl_of(proc.stdout)] == ["DEL"]
@@ -0,0 +1,98 @@
+# coding: utf-8
+
+import pytest
+
+from opscat.alidns import rate_limit
+from opscat.alidns.rate_limit import RequestLimiter
+
+from conftest import jsonl_of
+
+
+class ApiError(Exception):
+    def __init__(self, code, http_status=400):
+        Exception.__init__(self, code)
+        self.code = code
+        self.http_status = http_status
+
+    def get_error_code(self):
+        return self.code
+
+
+class Flaky:
+    # 前 failures 次调用抛出 error, 之后返回 "ok"
+    def __init__(self, error, failures):
+        self.error = error
+        self.failures = failures
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error
+        return "ok"
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # 记录退避等待的上限, 不实际等待
+    delays = []
+    monkeypatch.setattr(rate_limit.random, "uniform", lambda low, high: high)
+    monkeypatch.setattr(rate_limit.time, "sleep", delays.append)
+    return delays
+
+
+def test_throttling_is_retried_with_exponential_backoff(sleeps):
+    limiter = RequestLimiter(retries=5, base_delay=0.2, max_delay=1)
+    func = Flaky(ApiError("Throttling.User"), 4)
+    assert limiter.call(func) == "ok"
+    assert func.calls == 5
+    assert limiter.retried == 4
+    assert sleeps == [0.2, 0.4, 0.8, 1]
+
+
+def test_retries_are_bounded(sleeps):
+    limiter = RequestLimiter(retries=2, base_delay=0.1)
+    func = Flaky(ApiError("ServiceUnavailable", 503), 10)
+    with pytest.raises(ApiError):
+        limiter.call(func)
+    assert func.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_client_errors_are_not_retried(sleeps):
+    limiter = RequestLimiter(retries=5)
+    func = Flaky(ApiError("DomainRecordDuplicate"), 1)
+    with pytest.raises(ApiError):
+        limiter.call(func)
+    assert func.calls == 1
+    assert limiter.retried == 0
+    assert not sleeps
+
+
+def test_uncertain_writes_are_recovered_before_retry(sleeps):
+    limiter = RequestLimiter(retries=5)
+    func = Flaky(ApiError("SDK.HttpError"), 1)
+    # 临时性错误后上一次请求可能已经生效, 由 recover 确认后不再重试
+    assert limiter.call(func, recover=lambda: "recovered") == "recovered"
+    assert func.calls == 1
+    # 限流错误说明请求未被执行, 不需要确认
+    recovered = []
+    func = Flaky(ApiError("Throttling"), 1)
+    assert limiter.call(func, recover=lambda: recovered.append(True)) == "ok"
+    assert func.calls == 2
+    assert not recovered
+
+
+def test_throttling_halves_concurrency_once_per_round(sleeps):
+    limiter = RequestLimiter(concurrency=8, retries=1)
+    for _ in range(3):
+        limiter.call(Flaky(ApiError("Throttling.User"), 1))
+    assert int(limiter.concurrency.limit) == 4
+
+
+def test_search_survives_server_throttling(alidns_cli, fake_server):
+    fake_server.alidns.add_zone("example.net", 250)
+    fake_server.throttle_rate = 0.3
+    proc = alidns_cli("-a", "search", "-d", "example.net", "--retries", "20", "-o", "jsonl")
+    assert proc.returncode == 0, proc.stderr
+    assert len(jsonl_of(proc.stdout)) == 250